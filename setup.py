@@ -44,6 +44,9 @@ setup(
             "front = udata_front.models",
         ],
         "udata.front": "front = udata_front.frontend",
+        "udata.tasks": [
+            "front = udata_front.tasks",
+        ],
         "udata.apis": [
             "front_oembed = udata_front.views.oembed",
             "front_api = udata_front.api",
@@ -10,6 +10,9 @@ import io
 import logging
 from datetime import datetime
 
+APIGOUVFR_EXTRAS_KEY = "apigouvfr:apis"
+APIGOUVFR_EXPECTED_FIELDS = ["title", "tagline", "path", "slug", "owner", "openness", "logo"]
+
 # Imports necessários para o Monkeypatch
 try:
     from flask import request
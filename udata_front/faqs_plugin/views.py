@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from udata_front import theme
+from udata_front import page_cache, theme
 from udata import i18n
+from udata.app import cache
 from udata.i18n import I18nBlueprint
 from flask import (
     request, 
@@ -16,9 +17,12 @@ from wtforms.fields import EmailField
 from udata.forms import fields, validators
 from flask_mail import Message
 from flask_security.utils import do_flash
+from mongoengine.signals import post_delete, post_save
 
 from udata.models import Organization
 
+DOCAPI_ORGANIZATIONS_KEY = 'docapi-organizations'
+
 
 class ContactForm(FlaskForm):
     name = fields.StringField("Name", [validators.DataRequired()])
@@ -61,8 +65,43 @@ def contact():
                 do_flash(i18n.gettext(u"Thank you for your message. We'll get back to you shortly."), 'success')
     return theme.render('custom/contact.html', form=form)
 
+
+def get_organizations():
+    '''Organizations identifiers and names sorted by name, cached until one changes'''
+    organizations = cache.get(DOCAPI_ORGANIZATIONS_KEY)
+    if organizations is None:
+        organizations = [{
+            'id': str(org['_id']),
+            'slug': org.get('slug'),
+            'name': org.get('name'),
+            'acronym': org.get('acronym'),
+        } for org in (Organization.objects.only('id', 'slug', 'name', 'acronym')
+                                          .order_by('name').as_pymongo())]
+        cache.set(DOCAPI_ORGANIZATIONS_KEY, organizations, timeout=0)
+    return organizations
+
+
+def expire_organizations(sender, document, **kwargs):
+    if not current_app:
+        return
+    cache.delete(DOCAPI_ORGANIZATIONS_KEY)
+    page_cache.purge(DOCAPI_ORGANIZATIONS_KEY)
+
+
+def on_organization_saved(sender, document, created=False, **kwargs):
+    # Metrics updates don't change the listing
+    if created or set(document._get_changed_fields()) & {'slug', 'name', 'acronym'}:
+        expire_organizations(sender, document)
+
+
+post_save.connect(on_organization_saved, sender=Organization)
+post_delete.connect(expire_organizations, sender=Organization)
+
+
 #Add docapi
 @blueprint.route('/docapi/')
 def docapi():
-    organizations = Organization.objects.all()
-    return theme.render('custom/api.html', organizations=organizations)
\ No newline at end of file
+    return page_cache.cached_page(
+        lambda: theme.render('custom/api.html', organizations=get_organizations()),
+        [DOCAPI_ORGANIZATIONS_KEY],
+    )
\ No newline at end of file
@@ -0,0 +1,105 @@
+'''
+Denormalized followers, sortable by follower name.
+
+`Follow` only references the follower, so follower lists can not be sorted
+by name with an index. Active follows are mirrored in `Follower` documents
+holding the follower name, updated on follow, unfollow and user rename.
+They are backfilled by a migration and can be fully rebuilt
+by the `index-followers` job.
+Follower counts are cached until the next follow or unfollow.
+'''
+from mongoengine.signals import post_save
+
+from udata.app import cache
+from udata.core.followers.signals import on_follow, on_unfollow
+from udata.models import Follow, User
+
+from udata_front.models import Follower
+
+COUNT_KEY = 'followers-count:{0}'
+
+
+def name_of(user):
+    '''The follower name as sorted: case insensitive'''
+    return user.fullname.lower()
+
+
+def following_ref(follow):
+    '''The followed object class name and identifier, without dereferencing it'''
+    value = follow._data.get('following')
+    if value is None:
+        return None, None
+    elif isinstance(value, dict):
+        return value['_cls'].rsplit('.', 1)[-1], value['_ref'].id
+    return type(value).__name__, value.id
+
+
+def index_follow(follow, name=None):
+    '''Mirror an active follow'''
+    following_type, following_id = following_ref(follow)
+    if following_id is None:
+        return
+    Follower.objects(follow=follow.id).update_one(
+        upsert=True,
+        set__following=following_id,
+        set__following_type=following_type,
+        set__follower=follow.follower,
+        set__follower_name=name if name is not None else name_of(follow.follower),
+        set__since=follow.since,
+    )
+    cache.delete(COUNT_KEY.format(following_id))
+
+
+def unindex_follow(follow):
+    _, following_id = following_ref(follow)
+    Follower.objects(follow=follow.id).delete()
+    cache.delete(COUNT_KEY.format(following_id))
+
+
+def index_followers():
+    '''Rebuild all the followers from the active follows, returning their count'''
+    names = {}
+    indexed = set()
+    for follow in Follow.objects(until=None).no_cache().no_dereference():
+        user_id = follow._data['follower'].id
+        if user_id not in names:
+            user = User.objects(id=user_id).only('first_name', 'last_name').first()
+            names[user_id] = name_of(user) if user else ''
+        index_follow(follow, names[user_id])
+        indexed.add(follow.id)
+    stale = [follow_id for follow_id in Follower.objects.scalar('follow')
+             if follow_id not in indexed]
+    if stale:
+        Follower.objects(follow__in=stale).delete()
+    return len(indexed)
+
+
+def count_followers(obj):
+    '''The number of active followers of an object, cached'''
+    key = COUNT_KEY.format(obj.id)
+    count = cache.get(key)
+    if count is None:
+        count = Follower.objects(following=obj.id).count()
+        cache.set(key, count)
+    return count
+
+
+@on_follow.connect
+def on_followed(follow, **kwargs):
+    index_follow(follow)
+
+
+@on_unfollow.connect
+def on_unfollowed(follow, **kwargs):
+    unindex_follow(follow)
+
+
+def on_user_saved(sender, document, created=False, **kwargs):
+    if created:
+        return
+    changed = document._get_changed_fields()
+    if 'first_name' in changed or 'last_name' in changed:
+        Follower.objects(follower=document.id).update(set__follower_name=name_of(document))
+
+
+post_save.connect(on_user_saved, sender=User)
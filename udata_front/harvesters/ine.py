@@ -1,10 +1,15 @@
 from __future__ import annotations
 
+import hashlib
+import os
+import queue
 import re
+import threading
 import unicodedata
 import xml.etree.ElementTree as ET
 import time
 import random
+from contextlib import closing
 from datetime import datetime, timezone
 
 import requests
@@ -15,14 +20,21 @@ from udata.harvest.backends.base import BaseBackend
 from udata.harvest.models import HarvestItem
 from slugify import slugify
 
-from .tools.harvester_utils import normalize_url_slashes
+from udata_front.models import HarvestDownload
+
+from .tools.harvester_utils import (
+    FINGERPRINT_FIELD,
+    content_fingerprint,
+    harvested_fingerprints,
+    normalize_url_slashes,
+)
 
 
 class INEBackend(BaseBackend):
     """
-    INE Harvester - modo FAST (2 fases):
-    1) Parse XML -> metadados em memória
-    2) Change detection + bulk_write no Mongo (muito mais rápido)
+    INE Harvester - modo FAST (pipeline):
+    1) Parse XML (thread) -> chunks numa fila limitada
+    2) Change detection + bulk_write no Mongo por chunk, em paralelo com o parsing
 
     Configuração de ficheiro:
     - IS_TEST_MODE = True: usa /tmp/ine.xml (você adiciona/remove manualmente)
@@ -46,6 +58,7 @@ class INEBackend(BaseBackend):
     # Harvester Configuration
     IS_TEST_MODE = False  # True: usa ficheiro em /tmp/ine.xml (você gere) | False: download automático com limpeza
     BULK_SIZE = 500
+    PIPELINE_CHUNKS = 4  # chunks lidos à frente da escrita (limita a memória)
     LOG_EVERY = 200
     CHECK_CHANGES = True
     USE_LOCAL_FILE = (
@@ -60,11 +73,33 @@ class INEBackend(BaseBackend):
 
     HVD_INDICATOR_IDS: set[str] = set()
 
+    # Campos comparados por _has_changed (projeção da pré-busca)
+    CHANGE_PROJECTION = {
+        "title": 1,
+        "description": 1,
+        "tags": 1,
+        "resources.url": 1,
+        "resources.title": 1,
+        "resources.description": 1,
+        "resources.format": 1,
+        "harvest.remote_id": 1,
+    }
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         self._cc_by_license = None
 
+        # Downloads a persistir após um harvest concluído com sucesso
+        self._pending_downloads = []
+        self._download_states = {}
+        self._write_errors = 0
+        self._rss_baseline_mb = None
+        self._peak_rss_mb = None
+        self._hvd_unchanged = False
+        self._unchanged = False
+        self._parsed = 0
+
         self._session = requests.Session()
         adapter = requests.adapters.HTTPAdapter(
             pool_connections=16, pool_maxsize=16, max_retries=0
@@ -135,25 +170,148 @@ class INEBackend(BaseBackend):
         tag = self._MULTI_DASH_RE.sub("-", tag).strip("-")
         return tag
 
+    # --------------------------
+    # Downloads condicionais (ETag / Last-Modified + SHA-256)
+    # --------------------------
+    def _load_download_states(self):
+        """Carrega numa única query os downloads (catálogo e HVD) da fonte."""
+        urls = [self.source.url, self.HVD_URL]
+        self._download_states = {
+            state.url: state
+            for state in HarvestDownload.objects(source=self.source.id, url__in=urls)
+        }
+
+    def _download_state(self, url: str) -> HarvestDownload:
+        return self._download_states.get(url) or HarvestDownload(
+            source=self.source.id, url=url
+        )
+
+    def _remember_download(self, state, resp, sha256: str, data=None):
+        """Validadores a persistir no fim do harvest (não antes: um harvest falhado repete)."""
+        if resp.status_code != 304:
+            state.etag = resp.headers.get("ETag")
+            state.last_modified = resp.headers.get("Last-Modified")
+            state.sha256 = sha256
+        if data is not None:
+            state.data = data
+        self._pending_downloads.append(state)
+
+    def _save_downloads(self, catalog: bool = True):
+        """
+        Persiste os validadores pendentes. Sem `catalog`, os do catálogo não
+        são guardados: o próximo harvest volta a descarregá-lo e processá-lo.
+        """
+        for state in self._pending_downloads:
+            if not catalog and state.url == self.source.url:
+                continue
+            state.updated_at = datetime.utcnow()
+            state.save()
+        self._pending_downloads = []
+
     # --------------------------
     # HVD IDs
     # --------------------------
+    HVD_URL = "https://www.ine.pt/ine/xml_indic_hvd.jsp?opc=3&lang=PT"
+
     def _fetch_hvd_ids(self) -> set[str]:
-        url = "https://www.ine.pt/ine/xml_indic_hvd.jsp?opc=3&lang=PT"
+        url = self.HVD_URL
+        state = self._download_state(url)
+        known = state.data.get("ids")
+        self._hvd_unchanged = False
         try:
-            resp = self._make_request_with_retry(url, timeout=30, stream=False)
+            headers = state.conditional_headers if known is not None else {}
+            resp = self._make_request_with_retry(
+                url, headers=headers, timeout=30, stream=False
+            )
+            if resp.status_code == 304:
+                self._hvd_unchanged = True
+                self._remember_download(state, resp, state.sha256)
+                self._log.info("[INE] HVD IDs inalterados (304): %s", len(known))
+                return set(known)
+
+            sha256 = hashlib.sha256(resp.content).hexdigest()
+            if known is not None and sha256 == state.sha256:
+                self._hvd_unchanged = True
+                self._remember_download(state, resp, sha256)
+                self._log.info("[INE] HVD IDs inalterados (sha256): %s", len(known))
+                return set(known)
+
             root = ET.fromstring(resp.content)
             ids = {
                 ind.attrib["id"]
                 for ind in root.findall(".//indicator")
                 if "id" in ind.attrib
             }
+            self._remember_download(state, resp, sha256, {"ids": sorted(ids)})
             self._log.info("[INE] HVD IDs carregados: %s", len(ids))
             return ids
         except Exception as e:
             self._log.warning("[INE] Falha ao carregar HVD IDs: %s", e)
+            if known is not None:
+                # Mantém a última lista conhecida em vez de remover as tags HVD
+                return set(known)
             return set()
 
+    # --------------------------
+    # Download do catálogo
+    # --------------------------
+    def _download_catalog(self, conditional: bool):
+        """
+        Descarrega o catálogo XML (ficheiro local ou memória).
+        Retorna a fonte para o iterparse, ou None se o conteúdo não mudou
+        desde o último harvest concluído (304 ou mesmo SHA-256).
+        """
+        from io import BytesIO
+
+        state = self._download_state(self.source.url)
+        headers = state.conditional_headers if conditional else {}
+        digest = hashlib.sha256()
+
+        if self.USE_LOCAL_FILE:
+            # Modo produção com ficheiro local: baixa, processa e remove
+            self._log.info(
+                "[INE] Baixando XML e salvando em %s (será removido após processamento)...",
+                self.LOCAL_FILE_PATH,
+            )
+            # Usar _make_request_with_retry para robustez e stream=True para memória
+            resp = self._make_request_with_retry(
+                self.source.url, headers=headers, stream=True
+            )
+            if resp.status_code != 304:
+                with open(self.LOCAL_FILE_PATH, "wb") as f:
+                    for chunk in resp.iter_content(chunk_size=8192):
+                        if chunk:
+                            digest.update(chunk)
+                            f.write(chunk)
+                self._log.info("[INE] Download concluído.")
+            source_context = self.LOCAL_FILE_PATH
+        else:
+            # Modo memória: baixa direto para RAM
+            self._log.info("[INE] Baixando XML para memória...")
+            resp = self._make_request_with_retry(
+                self.source.url, headers=headers, stream=False
+            )
+            digest.update(resp.content)
+            source_context = BytesIO(resp.content)
+
+        if resp.status_code == 304:
+            self._log.info("[INE] Catálogo inalterado (304 Not Modified)")
+            self._remember_download(state, resp, state.sha256)
+            return None
+
+        sha256 = digest.hexdigest()
+        self._remember_download(state, resp, sha256)
+        if conditional and sha256 == state.sha256:
+            self._log.info("[INE] Catálogo inalterado (sha256=%s)", sha256)
+            return None
+        return source_context
+
+    def autoarchive(self):
+        # Harvest ignorado: nenhum item no job, nada a arquivar
+        if self._unchanged:
+            return
+        super().autoarchive()
+
     # --------------------------
     # Extrai metadados do indicator (já normalizados)
     # --------------------------
@@ -239,32 +397,89 @@ class INEBackend(BaseBackend):
         return md
 
     # --------------------------
-    # Change detection (barato + deep size check)
+    # Pré-busca dos datasets existentes (1 query por chunk)
     # --------------------------
-    def _has_changed(self, dataset, new_md: dict, remote_id: str) -> bool:
-        if not getattr(dataset, "id", None):
-            return True
+    def _prefetch_existing(self, collection, remote_ids) -> dict:
+        """
+        Carrega numa única query os datasets existentes de um chunk,
+        apenas com os campos comparados por _has_changed.
+        Retorna {remote_id: documento parcial}.
+        """
+        if not remote_ids:
+            return {}
+        # Mesmo critério que BaseBackend.get_dataset: source_id ou domínio
+        sources = [{"harvest.source_id": str(self.source.id)}]
+        if self.source.domain:
+            sources.append({"harvest.domain": self.source.domain})
+        query = {
+            "harvest.remote_id": {"$in": [str(rid) for rid in remote_ids]},
+            "$or": sources,
+        }
+        existing = {}
+        for doc in collection.find(query, self.CHANGE_PROJECTION):
+            existing.setdefault(doc["harvest"]["remote_id"], doc)
+        return existing
+
+    def _hydrate(self, docs) -> dict:
+        """Carrega os Dataset completos (apenas os alterados). Retorna {_id: Dataset}."""
+        ids = [doc["_id"] for doc in docs]
+        if not ids:
+            return {}
+        return {dataset.id: dataset for dataset in Dataset.objects(id__in=ids)}
+
+    def _new_dataset(self):
+        if self.source.organization:
+            return Dataset(organization=self.source.organization)
+        return Dataset(owner=self.source.owner)
 
-        if (dataset.title or "") != (new_md.get("title") or ""):
-            return True
+    # --------------------------
+    # Fingerprint dos metadados escritos
+    # --------------------------
+    def _desired_tags(self, remote_id: str, md: dict) -> set:
+        desired = set(md.get("tags_norm") or [])
+        if remote_id in self.HVD_INDICATOR_IDS:
+            desired.update({"estatisticas", "hvd"})
+        return desired
+
+    def _fingerprint(self, remote_id: str, md: dict) -> str:
+        return content_fingerprint(
+            {
+                "title": md.get("title") or "",
+                "description": md.get("description") or "",
+                "tags": self._desired_tags(remote_id, md),
+                "resources": md.get("resources") or [],
+                "remote_url": md.get("remote_url"),
+            }
+        )
 
-        if (dataset.description or "") != (new_md.get("description") or ""):
+    # --------------------------
+    # Change detection campo a campo
+    # (só para datasets harvested antes do fingerprint)
+    # --------------------------
+    def _has_changed(self, current: dict, new_md: dict, remote_id: str) -> bool:
+        """Compara o documento parcial da pré-busca com os novos metadados."""
+        if (current.get("title") or "") != (new_md.get("title") or ""):
             return True
 
-        desired = set(new_md.get("tags_norm") or [])
-        if remote_id in self.HVD_INDICATOR_IDS:
-            desired.update({"estatisticas", "hvd"})
+        if (current.get("description") or "") != (new_md.get("description") or ""):
+            return True
 
-        if set(dataset.tags or []) != desired:
+        if set(current.get("tags") or []) != self._desired_tags(remote_id, new_md):
             return True
 
-        current_urls = {r.url for r in dataset.resources}
+        resources = current.get("resources") or []
+        current_urls = {r.get("url") for r in resources}
         if current_urls != set(new_md.get("resource_urls") or []):
             return True
 
         current_sig = {
-            (r.url, r.title or "", r.description or "", r.format or "")
-            for r in dataset.resources
+            (
+                r.get("url"),
+                r.get("title") or "",
+                r.get("description") or "",
+                r.get("format") or "",
+            )
+            for r in resources
         }
         if current_sig != (new_md.get("resource_sig") or set()):
             return True
@@ -312,6 +527,11 @@ class INEBackend(BaseBackend):
         # Identificador do backend
         dataset.harvest.backend = "ine"
 
+        # Fingerprint dos metadados escritos (change detection)
+        dataset.harvest.fingerprint = md.get("fingerprint") or self._fingerprint(
+            remote_id, md
+        )
+
         # URL remota do dataset no portal de origem
         if md.get("remote_url"):
             dataset.harvest.remote_url = md["remote_url"]
@@ -348,24 +568,31 @@ class INEBackend(BaseBackend):
         Executa bulk_write e trata BulkWriteError:
         - Loga bwe.details['writeErrors'] com o remote_id correspondente (via índice)
         - Reprocessa o batch em modo "divide and conquer" para salvar o máximo possível.
+
+        Retorna (matched, modified, upserted) onde upserted é {remote_id: _id}
+        dos datasets criados, obtido dos upserted_ids do resultado via op_ids.
+        As operações que falham mesmo isoladas são contadas em self._write_errors.
         """
         from pymongo.errors import BulkWriteError
 
         if not ops:
-            return 0, 0, 0  # matched, modified, upserted
+            return 0, 0, {}  # matched, modified, upserted
 
         t0 = time.time()
         try:
             res = collection.bulk_write(ops, ordered=False)
             dt = time.time() - t0
-            upserted = len(getattr(res, "upserted_ids", {}) or {})
+            upserted = {
+                op_ids[idx]: _id
+                for idx, _id in (getattr(res, "upserted_ids", {}) or {}).items()
+            }
             self._log.info(
                 "[INE] bulk_write OK: ops=%s em %.2fs | matched=%s modified=%s upserted=%s",
                 len(ops),
                 dt,
                 getattr(res, "matched_count", "?"),
                 getattr(res, "modified_count", "?"),
-                upserted,
+                len(upserted),
             )
             return (
                 getattr(res, "matched_count", 0),
@@ -397,19 +624,160 @@ class INEBackend(BaseBackend):
                     err.get("errmsg"),
                 )
 
+            # Com ordered=False as restantes operações foram escritas:
+            # os upserts já feitos não voltam a ser upserts ao reprocessar
+            upserted = {
+                op_ids[u["index"]]: u["_id"]
+                for u in details.get("upserted", []) or []
+                if isinstance(u.get("index"), int) and u["index"] < len(op_ids)
+            }
+
             # Estratégia: dividir o batch e tentar salvar a maioria
             if len(ops) == 1:
                 # não há como dividir mais; já logamos
-                return 0, 0, 0
+                self._write_errors += 1
+                return 0, 0, upserted
 
             mid = len(ops) // 2
-            self._flush_bulk(collection, ops[:mid], op_ids[:mid])
-            self._flush_bulk(collection, ops[mid:], op_ids[mid:])
+            for part_ops, part_ids in ((ops[:mid], op_ids[:mid]), (ops[mid:], op_ids[mid:])):
+                _, _, part_upserted = self._flush_bulk(collection, part_ops, part_ids)
+                upserted.update(part_upserted)
+
+            return 0, 0, upserted
+
+    def _created_items(self, created_remote_ids, upserted) -> list:
+        """HarvestItems dos datasets criados, com o _id devolvido pelo bulk_write."""
+        items = []
+        for rid in created_remote_ids:
+            h_item = HarvestItem(remote_id=rid, status="done")
+            if rid in upserted:
+                h_item.dataset = upserted[rid]
+            else:
+                self._log.warning(
+                    "[INE] Dataset criado sem _id no resultado do bulk_write: %s", rid
+                )
+            items.append(h_item)
+        return items
 
-            return 0, 0, 0
+    # --------------------------
+    # Pipeline de parsing (iterparse -> fila limitada)
+    # --------------------------
+    def _parse_indicators(self, source_context):
+        """Itera (remote_id, md) dos indicadores do XML, com memória constante."""
+        # source_context pode ser file path ou file-like object (BytesIO)
+        context = iter(ET.iterparse(source_context, events=("start", "end")))
+        event, root = next(context)  # Pega o elemento raiz
+
+        for event, elem in context:
+            if event == "end" and elem.tag == "indicator":
+                self._parsed += 1
+                md = self._extract_metadata(elem)
+                remote_id = elem.get("id")
+
+                # Skip items without title (mandatory field)
+                if remote_id and md.get("title"):
+                    yield remote_id, md
+                elif remote_id:
+                    self._log.warning("[INE] Skipping item %s: missing title", remote_id)
+
+                elem.clear()
+                root.clear()  # Limpa memoria da arvore XML
+
+    def _stream_chunks(self, source_context):
+        """
+        Chunks de BULK_SIZE indicadores, lidos por uma thread de parsing
+        numa fila de PIPELINE_CHUNKS chunks: o parsing avança enquanto o
+        chunk anterior é escrito, e a memória fica limitada à fila.
+        """
+        chunks = queue.Queue(maxsize=self.PIPELINE_CHUNKS)
+        stop = threading.Event()
+        end = object()
+        self._parsed = 0
+
+        def put(item):
+            # Desiste se o consumidor parou (erro na fase de escrita)
+            while not stop.is_set():
+                try:
+                    chunks.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                chunk = []
+                seen = set()
+                for remote_id, md in self._parse_indicators(source_context):
+                    if remote_id in seen:
+                        self._log.warning("[INE] Indicador duplicado ignorado: %s", remote_id)
+                        continue
+                    seen.add(remote_id)
+                    chunk.append((remote_id, md))
+                    if len(chunk) >= self.BULK_SIZE:
+                        if not put(chunk):
+                            return
+                        chunk = []
+                if chunk and not put(chunk):
+                    return
+                put(end)
+            except Exception as e:
+                put(e)
+
+        parser = threading.Thread(target=produce, name="ine-parser", daemon=True)
+        parser.start()
+        try:
+            while True:
+                item = chunks.get()
+                if item is end:
+                    break
+                if isinstance(item, Exception):
+                    self._log.error("[INE] Erro no parsing do XML: %s", item)
+                    raise item
+                yield item
+            self._log.info("[INE] Parsing XML concluído. Total items: %s", self._parsed)
+        finally:
+            stop.set()
+
+    @staticmethod
+    def _current_rss_mb():
+        """RSS atual do processo (Linux: /proc/self/statm), None se indisponível."""
+        try:
+            with open("/proc/self/statm") as statm:
+                resident_pages = int(statm.read().split()[1])
+        except (OSError, ValueError, IndexError):
+            return None
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+    def _sample_rss(self):
+        """Regista o pico de RSS deste harvest (o worker é de longa duração)."""
+        rss = self._current_rss_mb()
+        if rss is not None:
+            if self._rss_baseline_mb is None:
+                self._rss_baseline_mb = rss
+            self._peak_rss_mb = max(self._peak_rss_mb or 0, rss)
+
+    def _report_throughput(self, processed: int, total_time: float):
+        """Loga (e guarda no job) o débito e o pico de memória deste harvest."""
+        self._sample_rss()
+        throughput = processed / total_time if total_time else 0
+        self._log.info(
+            "[INE] Débito: %.1f itens/s (%s parsed) | pico RSS: %s MB (início: %s MB)",
+            throughput,
+            self._parsed,
+            self._peak_rss_mb and round(self._peak_rss_mb, 1),
+            self._rss_baseline_mb and round(self._rss_baseline_mb, 1),
+        )
+        if self.job:
+            self.job.data["throughput"] = round(throughput, 1)
+            if self._peak_rss_mb is not None:
+                self.job.data["peak_rss_mb"] = round(self._peak_rss_mb, 1)
+                self.job.data["rss_growth_mb"] = round(
+                    self._peak_rss_mb - self._rss_baseline_mb, 1
+                )
 
     # --------------------------
-    # inner_harvest (2 fases)
+    # inner_harvest (pipeline)
     # --------------------------
     def inner_harvest(self):
         self._log.info("[INE] Iniciando harvester de %s", self.source.url)
@@ -422,11 +790,16 @@ class INEBackend(BaseBackend):
         )
 
         start_time = time.time()
+        self._unchanged = False
+        self._write_errors = 0
+        self._rss_baseline_mb = None
+        self._peak_rss_mb = None
+        self._sample_rss()
+        self._load_download_states()
         self.HVD_INDICATOR_IDS = self._fetch_hvd_ids()
 
         try:
             import os
-            from io import BytesIO
 
             # Determina a fonte do XML baseado no modo de operação
             if self.IS_TEST_MODE:
@@ -440,59 +813,26 @@ class INEBackend(BaseBackend):
                     self.LOCAL_FILE_PATH,
                 )
                 source_context = self.LOCAL_FILE_PATH
-            elif self.USE_LOCAL_FILE:
-                # Modo produção com ficheiro local: baixa, processa e remove
-                self._log.info(
-                    "[INE] Baixando XML e salvando em %s (será removido após processamento)...",
-                    self.LOCAL_FILE_PATH,
-                )
-                # Usar _make_request_with_retry para robustez e stream=True para memória
-                resp = self._make_request_with_retry(self.source.url, stream=True)
-                with open(self.LOCAL_FILE_PATH, "wb") as f:
-                    for chunk in resp.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                self._log.info("[INE] Download concluído.")
-                source_context = self.LOCAL_FILE_PATH
             else:
-                # Modo memória: baixa direto para RAM
-                self._log.info("[INE] Baixando XML para memória...")
-                resp = self._make_request_with_retry(self.source.url, stream=False)
-                source_context = BytesIO(resp.content)
-
-            # Fase 1: Criação do iterador sobre o XML
-            # source_context pode ser file path ou file-like object (BytesIO)
-            context = ET.iterparse(source_context, events=("start", "end"))
-            context = iter(context)
-            event, root = next(context)  # Pega o elemento raiz
-
-            metadata_map = {}  # {remote_id: metadata_dict}
-            total_parsed = 0
-
-            for event, elem in context:
-                if event == "end" and elem.tag == "indicator":
-                    total_parsed += 1
-                    md = self._extract_metadata(elem)
-                    remote_id = elem.get("id")
-
-                    # Skip items without title (mandatory field)
-                    if remote_id and md.get("title"):
-                        metadata_map[remote_id] = md
-                    elif remote_id:
-                        self._log.warning(
-                            "[INE] Skipping item %s: missing title", remote_id
-                        )
-
-                    elem.clear()
-                    root.clear()  # Limpa memoria da arvore XML
-
-            self._log.info(
-                "[INE] Parsing XML concluído. Total items: %s. Iniciando processamento...",
-                total_parsed,
-            )
+                # Pedido condicional só se a lista HVD também não mudou
+                # (as tags HVD dependem dela)
+                source_context = self._download_catalog(
+                    conditional=self._hvd_unchanged
+                )
+                if source_context is None:
+                    self._unchanged = True
+                    if self.job:
+                        self.job.data["unchanged"] = True
+                    self._save_downloads()
+                    self._remove_local_file()
+                    self._log.info(
+                        "[INE] Catálogo e HVD inalterados: fases 1 e 2 ignoradas (%.1fs)",
+                        time.time() - start_time,
+                    )
+                    return
 
         except Exception as e:
-            self._log.error("[INE] Erro no download/parsing do XML: %s", e)
+            self._log.error("[INE] Erro no download do XML: %s", e)
             # Remover ficheiro descarregado em caso de erro (não remover em modo teste)
             if not self.IS_TEST_MODE and self.USE_LOCAL_FILE:
                 try:
@@ -516,20 +856,23 @@ class INEBackend(BaseBackend):
                     )
             raise
 
-        # --- Fim Fase 1, Inicio Fase 2 (Processamento) ---
+        # --- Pipeline: parsing (thread) -> fila limitada -> diff + bulk_write ---
         self._log.info(
-            "[INE] Fase 2: change detection + bulk_write (bulk_size=%s)",
+            "[INE] Pipeline parse -> change detection + bulk_write (bulk_size=%s, chunks em fila=%s)",
             self.BULK_SIZE,
+            self.PIPELINE_CHUNKS,
         )
 
         from pymongo import ReplaceOne, UpdateOne
 
         ops = []
         op_ids = []
+        # remote_ids criados nas operações ainda não escritas
+        created_remote_ids = []
         # Lista temporária para HarvestItems deste batch
         batch_harvest_items = []
 
-        dataset_collection = None
+        dataset_collection = Dataset._get_collection()
 
         changed = 0
         created = 0
@@ -544,167 +887,178 @@ class INEBackend(BaseBackend):
             )
 
         # Processar em batches para eficiência com escrita em massa.
-        # Estratégia: iterar metadados em chunks, fazer change detection,
-        # acumular operações Mongo, e fazer flush quando atinge BULK_SIZE.
-        all_items = list(metadata_map.items())
-        total_items = len(all_items)
-
-        # Processar em chunks do tamanho do bulk_size
-        for i in range(0, total_items, self.BULK_SIZE):
-            chunk = all_items[i : i + self.BULK_SIZE]
-
-            # --- Passo A: Pré-buscar datasets ---
-            for remote_id, md in chunk:
-                md["__dataset_obj"] = self.get_dataset(remote_id)
-
-            # --- Passo B: Processamento do chunk ---
-            # Guarda remote_ids de datasets criados para buscar IDs depois
-            created_remote_ids = []
-
-            for remote_id, md in chunk:
-                processed += 1
-                item_status = "done"
-                dataset = md.pop("__dataset_obj")  # recupera e limpa
+        # Estratégia: consumir os chunks à medida que o XML é lido, fazer
+        # change detection, acumular operações Mongo, e fazer flush quando
+        # atinge BULK_SIZE. closing() para a thread de parsing logo que a
+        # escrita falhe, sem esperar pela recolha do gerador.
+        with closing(self._stream_chunks(source_context)) as chunks:
+            for chunk in chunks:
+                self._sample_rss()
+
+                # --- Passo A: Pré-buscar datasets ---
+                # Uma query por chunk, projetada nos fingerprints: só os datasets
+                # alterados são carregados por completo.
+                for remote_id, md in chunk:
+                    md["fingerprint"] = self._fingerprint(remote_id, md)
+                existing = harvested_fingerprints(
+                    self.source, [remote_id for remote_id, _ in chunk]
+                )
+                # Datasets sem fingerprint: comparação campo a campo (uma vez)
+                legacy = self._prefetch_existing(
+                    dataset_collection,
+                    [rid for rid, cur in existing.items() if cur["fingerprint"] is None],
+                )
+                to_update = []
+                backfill = set()
+                for remote_id, md in chunk:
+                    current = existing.get(remote_id)
+                    if current is None:
+                        continue
+                    if not self.CHECK_CHANGES:
+                        to_update.append(current)
+                    elif current["fingerprint"] is None:
+                        if self._has_changed(legacy.get(remote_id) or {}, md, remote_id):
+                            to_update.append(current)
+                        else:
+                            backfill.add(remote_id)
+                    elif current["fingerprint"] != md["fingerprint"]:
+                        to_update.append(current)
+                hydrated = self._hydrate(to_update)
 
-                try:
-                    if dataset_collection is None:
-                        dataset_collection = dataset._get_collection()
-
-                    # Verifica se o dataset existe baseado no harvest.remote_id
-                    # O get_dataset retorna um dataset existente (com id) ou um novo (sem id)
-                    is_existing = (
-                        getattr(dataset, "harvest", None) is not None
-                        and getattr(dataset.harvest, "remote_id", None) == remote_id
-                        and getattr(dataset, "id", None) is not None
-                    )
+                # --- Passo B: Processamento do chunk ---
+                for remote_id, md in chunk:
+                    processed += 1
+                    item_status = "done"
 
-                    # ========================================
-                    # CASO 1: Dataset já existe na base de dados
-                    # ========================================
-                    if is_existing:
-                        # Verificar se houve alterações nos metadados
-                        if self.CHECK_CHANGES and not self._has_changed(
-                            dataset, md, remote_id
-                        ):
-                            # Sem alterações -> SKIP
-                            skipped += 1
-                            item_status = "skipped"
-                            self._log.debug(
-                                "[INE] SKIP: remote_id=%s (sem alterações)", remote_id
-                            )
+                    try:
+                        current = existing.get(remote_id)
+
+                        # ========================================
+                        # CASO 1: Dataset já existe na base de dados
+                        # ========================================
+                        if current is not None:
+                            dataset = hydrated.get(current["_id"])
+                            if dataset is None:
+                                # Sem alterações -> SKIP
+                                skipped += 1
+                                item_status = "skipped"
+                                self._log.debug(
+                                    "[INE] SKIP: remote_id=%s (sem alterações)", remote_id
+                                )
+                                if remote_id in backfill:
+                                    ops.append(
+                                        UpdateOne(
+                                            {"_id": current["_id"]},
+                                            {"$set": {FINGERPRINT_FIELD: md["fingerprint"]}},
+                                        )
+                                    )
+                                    op_ids.append(remote_id)
+                            else:
+                                # Com alterações -> UPDATE
+                                self._apply_metadata_to_dataset(dataset, remote_id, md)
+                                doc = dataset.to_mongo()
+                                doc_dict = dict(doc)
+                                _id = doc_dict.get("_id", dataset.id)
+                                ops.append(ReplaceOne({"_id": _id}, doc_dict, upsert=False))
+                                op_ids.append(remote_id)
+                                changed += 1
+                                self._log.debug(
+                                    "[INE] UPDATE: remote_id=%s (metadados alterados)",
+                                    remote_id,
+                                )
+
+                            # HarvestItem para datasets existentes
+                            if self.job:
+                                h_item = HarvestItem(
+                                    remote_id=remote_id, status=item_status
+                                )
+                                h_item.dataset = current["_id"]
+                                batch_harvest_items.append(h_item)
+
+                        # ========================================
+                        # CASO 2: Dataset não existe -> CREATE
+                        # ========================================
                         else:
-                            # Com alterações -> UPDATE
+                            dataset = self._new_dataset()
                             self._apply_metadata_to_dataset(dataset, remote_id, md)
                             doc = dataset.to_mongo()
                             doc_dict = dict(doc)
-                            _id = doc_dict.get("_id", dataset.id)
-                            ops.append(ReplaceOne({"_id": _id}, doc_dict, upsert=False))
+                            # Remover _id pois será gerado pelo MongoDB
+                            doc_dict.pop("_id", None)
+                            ops.append(
+                                UpdateOne(
+                                    {
+                                        "harvest.remote_id": str(remote_id),
+                                        "harvest.source_id": (
+                                            str(self.source.id) if self.source.id else None
+                                        ),
+                                    },
+                                    {"$setOnInsert": doc_dict},
+                                    upsert=True,
+                                )
+                            )
                             op_ids.append(remote_id)
-                            changed += 1
+                            created += 1
+                            created_remote_ids.append(remote_id)
                             self._log.debug(
-                                "[INE] UPDATE: remote_id=%s (metadados alterados)",
-                                remote_id,
+                                "[INE] CREATE: remote_id=%s (novo dataset)", remote_id
                             )
 
-                        # HarvestItem para datasets existentes
+                    except Exception:
+                        failed += 1
+                        item_status = "failed"
+                        self._log.exception(
+                            "[INE] Falha na fase 2 para remote_id=%s", remote_id
+                        )
+                        # HarvestItem para falhas
                         if self.job:
-                            h_item = HarvestItem(
-                                remote_id=remote_id, status=item_status
-                            )
-                            h_item.dataset = dataset.id
+                            h_item = HarvestItem(remote_id=remote_id, status=item_status)
                             batch_harvest_items.append(h_item)
 
-                    # ========================================
-                    # CASO 2: Dataset não existe -> CREATE
-                    # ========================================
-                    else:
-                        self._apply_metadata_to_dataset(dataset, remote_id, md)
-                        doc = dataset.to_mongo()
-                        doc_dict = dict(doc)
-                        # Remover _id pois será gerado pelo MongoDB
-                        doc_dict.pop("_id", None)
-                        ops.append(
-                            UpdateOne(
-                                {
-                                    "harvest.remote_id": str(remote_id),
-                                    "harvest.source_id": (
-                                        str(self.source.id) if self.source.id else None
-                                    ),
-                                },
-                                {"$setOnInsert": doc_dict},
-                                upsert=True,
-                            )
-                        )
-                        op_ids.append(remote_id)
-                        created += 1
-                        created_remote_ids.append(remote_id)
-                        self._log.debug(
-                            "[INE] CREATE: remote_id=%s (novo dataset)", remote_id
-                        )
+                # --- Fim do loop do chunk ---
 
-                except Exception:
-                    failed += 1
-                    item_status = "failed"
-                    self._log.exception(
-                        "[INE] Falha na fase 2 para remote_id=%s", remote_id
-                    )
-                    # HarvestItem para falhas
+                # Flush Ops
+                # HarvestItems dos datasets criados só após a escrita, a partir
+                # dos upserted_ids (sem queries adicionais)
+                if len(ops) >= self.BULK_SIZE:
+                    _, _, upserted = self._flush_bulk(dataset_collection, ops, op_ids)
                     if self.job:
-                        h_item = HarvestItem(remote_id=remote_id, status=item_status)
-                        batch_harvest_items.append(h_item)
-
-            # --- Fim do loop do chunk ---
-
-            # Flush Ops
-            if len(ops) >= self.BULK_SIZE and dataset_collection is not None:
-                self._flush_bulk(dataset_collection, ops, op_ids)
-                ops, op_ids = [], []
-
-            # Buscar IDs dos datasets criados e criar HarvestItems
-            if self.job and created_remote_ids and dataset_collection is not None:
-                for rid in created_remote_ids:
-                    try:
-                        ds_doc = dataset_collection.find_one(
-                            {"harvest.remote_id": str(rid)}, {"_id": 1}
+                        batch_harvest_items.extend(
+                            self._created_items(created_remote_ids, upserted)
                         )
-                        h_item = HarvestItem(remote_id=rid, status="done")
-                        if ds_doc:
-                            h_item.dataset = ds_doc["_id"]
-                        batch_harvest_items.append(h_item)
-                    except Exception:
-                        self._log.warning(
-                            "[INE] Não foi possível buscar ID do dataset criado: %s",
-                            rid,
-                        )
-                        h_item = HarvestItem(remote_id=rid, status="done")
-                        batch_harvest_items.append(h_item)
-
-            if self.job and len(batch_harvest_items) >= (self.BULK_SIZE * 2):
-                before_len = len(self.job.items)
-                self.job.items.extend(batch_harvest_items)
-                self.job.save()
-                after_len = len(self.job.items)
-                self._log.info(
-                    "[INE] Job Save: items grew from %s to %s (added %s)",
-                    before_len,
-                    after_len,
-                    len(batch_harvest_items),
-                )
-                batch_harvest_items = []
+                    ops, op_ids, created_remote_ids = [], [], []
 
-            if processed % (self.LOG_EVERY * 5) == 0:
-                self._log.info(
-                    "[INE] Fase 2 progresso: processed=%s changed=%s created=%s skipped=%s failed=%s",
-                    processed,
-                    changed,
-                    created,
-                    skipped,
-                    failed,
-                )
+                if self.job and len(batch_harvest_items) >= (self.BULK_SIZE * 2):
+                    before_len = len(self.job.items)
+                    self.job.items.extend(batch_harvest_items)
+                    self.job.save()
+                    after_len = len(self.job.items)
+                    self._log.info(
+                        "[INE] Job Save: items grew from %s to %s (added %s)",
+                        before_len,
+                        after_len,
+                        len(batch_harvest_items),
+                    )
+                    batch_harvest_items = []
+
+                if processed % (self.LOG_EVERY * 5) == 0:
+                    self._log.info(
+                        "[INE] Fase 2 progresso: processed=%s changed=%s created=%s "
+                        "skipped=%s failed=%s",
+                        processed,
+                        changed,
+                        created,
+                        skipped,
+                        failed,
+                    )
 
         # Final Flush Ops
-        if ops and dataset_collection is not None:
-            self._flush_bulk(dataset_collection, ops, op_ids)
+        if ops:
+            _, _, upserted = self._flush_bulk(dataset_collection, ops, op_ids)
+            if self.job:
+                batch_harvest_items.extend(
+                    self._created_items(created_remote_ids, upserted)
+                )
 
         # Final Flush Job Items
         if self.job and batch_harvest_items:
@@ -730,9 +1084,24 @@ class INEBackend(BaseBackend):
             skipped,
             failed,
         )
+        self._report_throughput(processed, total_time)
+
+        # Validadores do catálogo persistidos só se todos os itens foram escritos:
+        # senão o próximo harvest responderia "inalterado" sem repetir as falhas
+        complete = failed == 0 and self._write_errors == 0
+        if not complete:
+            self._log.warning(
+                "[INE] Validadores do catálogo não guardados: failed=%s writeErrors=%s",
+                failed,
+                self._write_errors,
+            )
+        self._save_downloads(catalog=complete)
 
         # Remover ficheiro descarregado após processamento bem-sucedido
-        # (não remover em modo teste)
+        self._remove_local_file()
+
+    def _remove_local_file(self):
+        """Remove o ficheiro descarregado (não remove em modo teste)."""
         if not self.IS_TEST_MODE and self.USE_LOCAL_FILE:
             try:
                 import os
@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+import hashlib
+import json
 import logging
 from datetime import datetime
 from udata.i18n import lazy_gettext as _
@@ -77,4 +79,56 @@ def normalize_url_slashes(url: str) -> str:
         parts[1] = re.sub(r'/+', '/', parts[1])
         return "://".join(parts)
     else:
-        return re.sub(r'/+', '/', url)
\ No newline at end of file
+        return re.sub(r'/+', '/', url)
+
+
+'''
+Content fingerprints of harvested datasets.
+Backends store the fingerprint of the normalized metadata they write in
+`harvest.fingerprint`: detecting changes is then a projection-only query
+comparing fingerprints, without hydrating the datasets.
+'''
+FINGERPRINT_FIELD = 'harvest.fingerprint'
+
+
+def _normalize(value):
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def content_fingerprint(metadata: dict) -> str:
+    """
+    Stable SHA-256 of the metadata a backend writes on a dataset.
+    Keys order and sets order don't change the fingerprint.
+    """
+    payload = json.dumps(metadata, sort_keys=True, separators=(',', ':'),
+                         ensure_ascii=False, default=_normalize)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def harvested_fingerprints(source, remote_ids) -> dict:
+    """
+    The stored fingerprints of the datasets harvested by a source,
+    as `{remote_id: {'_id': ..., 'fingerprint': ...}}`.
+    The fingerprint is `None` for datasets harvested before fingerprinting.
+    """
+    # Same criteria as BaseBackend.get_dataset: source id or domain
+    sources = [{'harvest.source_id': str(source.id)}]
+    if source.domain:
+        sources.append({'harvest.domain': source.domain})
+    query = {
+        'harvest.remote_id': {'$in': [str(rid) for rid in remote_ids]},
+        '$or': sources,
+    }
+    projection = {'harvest.remote_id': 1, FINGERPRINT_FIELD: 1}
+    fingerprints = {}
+    for doc in Dataset._get_collection().find(query, projection):
+        harvest = doc['harvest']
+        fingerprints.setdefault(harvest['remote_id'], {
+            '_id': doc['_id'],
+            'fingerprint': harvest.get('fingerprint'),
+        })
+    return fingerprints
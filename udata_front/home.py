@@ -0,0 +1,89 @@
+'''
+Home page snapshot.
+
+The `build-home-snapshot` job materializes, per language, everything the
+home page displays: the last post, the site metrics and the theme home
+context (such as the blog post).
+The home page is rendered from that snapshot. Once older than
+`HOME_SNAPSHOT_MAX_AGE`, the snapshot is still served while a single job
+rebuilds it in the background.
+'''
+import logging
+
+from datetime import datetime, timedelta
+
+from flask import current_app, g
+
+from udata.app import cache
+from udata.core.post.models import Post
+from udata.core.site.models import current_site
+from udata.i18n import gettext as _, language
+
+from udata_front import theme
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_KEY = 'home-snapshot:{0}'
+REFRESH_LOCK_KEY = 'home-snapshot-refresh:{0}'
+
+
+def post_card(post):
+    if not post:
+        return None
+    return {
+        'name': post.name,
+        'headline': post.headline,
+        'published': post.published,
+        'display_url': post.display_url,
+        'image': str(post.image) if post.image else None,
+    }
+
+
+def build_context():
+    metrics = current_site.metrics
+    context = {
+        'last_post': post_card(Post.objects.published().first()),
+        'data_metrics': [
+            (_('Datasets and Dataservices'),
+             metrics.get('datasets', 0) + metrics.get('dataservices', 0)),
+            (_('Files'), metrics.get('resources', 0)),
+            (_('Organizations'), metrics.get('organizations', 0)),
+        ],
+        'community_metrics': [
+            (_('Reuses'), metrics.get('reuses', 0)),
+            (_('Users'), metrics.get('users', 0)),
+            (_('Discussions'), metrics.get('discussions', 0)),
+        ]
+    }
+    processor = theme.current.get_processor('home')
+    return processor(context)
+
+
+def build(lang):
+    '''Build and store the home snapshot of a language'''
+    with current_app.test_request_context(), language(lang):
+        snapshot = {'built_at': datetime.utcnow(), 'context': build_context()}
+    cache.set(SNAPSHOT_KEY.format(lang), snapshot, timeout=0)
+    cache.delete(REFRESH_LOCK_KEY.format(lang))
+    return snapshot
+
+
+def refresh(lang):
+    '''Rebuild a snapshot in the background, unless a rebuild is already pending'''
+    from udata_front.tasks import build_home_snapshot
+    if cache.add(REFRESH_LOCK_KEY.format(lang), True,
+                 timeout=current_app.config['HOME_SNAPSHOT_MAX_AGE']):
+        build_home_snapshot.delay(lang)
+
+
+def get_context(lang=None):
+    '''The home context of the current language, stale while being revalidated'''
+    lang = lang or g.lang_code
+    snapshot = cache.get(SNAPSHOT_KEY.format(lang))
+    if snapshot is None:
+        snapshot = build(lang)
+    else:
+        max_age = timedelta(seconds=current_app.config['HOME_SNAPSHOT_MAX_AGE'])
+        if snapshot['built_at'] + max_age < datetime.utcnow():
+            refresh(lang)
+    return snapshot['context']
@@ -0,0 +1,13 @@
+"""
+Index activities by class and creation date for the activity feed key filter
+"""
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def migrate(db):
+    log.info("Creating the activity (_cls, -created_at) index.")
+    db.activity.create_index([("_cls", 1), ("created_at", -1)])
+    log.info("Index created.")
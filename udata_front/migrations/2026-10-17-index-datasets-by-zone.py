@@ -0,0 +1,13 @@
+"""
+Index datasets by spatial zones for the territory pages
+"""
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def migrate(db):
+    log.info("Creating the dataset spatial.zones index.")
+    db.dataset.create_index([("spatial.zones", 1)])
+    log.info("Index created.")
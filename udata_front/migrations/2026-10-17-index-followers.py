@@ -0,0 +1,15 @@
+"""
+Backfill the followers sortable by name from the existing active follows
+"""
+
+import logging
+
+from udata_front.followers import index_followers
+
+log = logging.getLogger(__name__)
+
+
+def migrate(db):
+    log.info("Indexing the active follows as followers.")
+    count = index_followers()
+    log.info(f"{count} followers indexed.")
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from udata.i18n import lazy_gettext as _
 from udata.models import (
     db, Dataset, User, Organization, Reuse, TerritoryDataset,
@@ -258,3 +260,107 @@ REGION_DATASETS = {
 TERRITORY_DATASETS['commune'].update(TOWN_DATASETS)
 TERRITORY_DATASETS['departement'].update(COUNTY_DATASETS)
 TERRITORY_DATASETS['region'].update(REGION_DATASETS)
+
+
+class OrganizationStats(db.Document):
+    '''
+    Materialized counters displayed on the organization page.
+
+    Kept up to date incrementally by the signal handlers in `udata_front.stats`
+    and periodically reconciled by the `reconcile-organization-stats` job.
+    '''
+    organization = db.ObjectIdField(primary_key=True)
+    datasets = db.IntField(default=0)
+    visible_datasets = db.IntField(default=0)
+    reuses = db.IntField(default=0)
+    visible_reuses = db.IntField(default=0)
+    dataservices = db.IntField(default=0)
+    visible_dataservices = db.IntField(default=0)
+    followers = db.IntField(default=0)
+    updated_at = db.DateTimeField(default=datetime.utcnow)
+
+    meta = {
+        'collection': 'organization_stats',
+    }
+
+    def __str__(self):
+        return 'Stats for organization {0}'.format(self.organization)
+
+    @classmethod
+    def increment(cls, org_id, **counters):
+        '''
+        Atomically increment some counters.
+
+        Missing stats are left untouched: they are fully computed on first access.
+        '''
+        counters = {'inc__' + key: value for key, value in counters.items() if value}
+        if not counters:
+            return
+        cls.objects(organization=org_id).update_one(
+            set__updated_at=datetime.utcnow(), **counters)
+
+
+class Follower(db.Document):
+    '''
+    An active follow, with its follower name denormalized for sorting.
+
+    Kept up to date by the signal handlers in `udata_front.followers`,
+    backfilled by a migration and rebuilt by the `index-followers` job.
+    '''
+    follow = db.ObjectIdField(primary_key=True)
+    following = db.ObjectIdField(required=True)
+    following_type = db.StringField(required=True)
+    follower = db.ReferenceField('User', required=True)
+    follower_name = db.StringField(default='')
+    since = db.DateTimeField()
+
+    meta = {
+        'collection': 'followers',
+        'indexes': [
+            ('following', 'follower_name'),
+            'follower',
+        ],
+    }
+
+    def __str__(self):
+        return 'Follower of {0}'.format(self.following)
+
+
+class HarvestDownload(db.Document):
+    '''
+    Validators of the last successfully processed download of a harvest source url.
+
+    Lets harvest backends send conditional requests and skip unchanged content.
+    `data` holds what a backend derived from the content, reused while unchanged.
+    '''
+    source = db.ObjectIdField(required=True)
+    url = db.StringField(required=True)
+    etag = db.StringField()
+    last_modified = db.StringField()
+    sha256 = db.StringField()
+    data = db.DictField()
+    updated_at = db.DateTimeField(default=datetime.utcnow)
+
+    meta = {
+        'collection': 'harvest_downloads',
+        'indexes': [
+            {'fields': ('source', 'url'), 'unique': True},
+        ],
+    }
+
+    def __str__(self):
+        return 'Download of {0}'.format(self.url)
+
+    @property
+    def conditional_headers(self):
+        '''The headers of a conditional request for this url'''
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+# Register signal handlers wherever models are loaded (front, workers, CLI)
+from udata_front import followers, stats, page_cache  # noqa: E402,F401
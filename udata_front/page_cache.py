@@ -0,0 +1,147 @@
+'''
+Opt-in full-page cache for anonymous GET requests.
+
+Rendered pages are stored zlib-compressed in the application cache
+(Redis in production) and tagged with surrogate keys: the identifiers
+of the objects they have been built from.
+Each surrogate key has a version token and a page is only served
+while all its tags still have the version it was rendered with.
+Saving or deleting an object drops its surrogate keys versions,
+invalidating exactly the pages built from it.
+'''
+import hashlib
+import logging
+import uuid
+import zlib
+
+from flask import current_app, g, make_response, request
+from flask_security import current_user
+from flask_wtf.csrf import generate_csrf
+from mongoengine.signals import post_delete, post_save
+
+from udata.app import cache
+from udata.core.dataservices.models import Dataservice
+from udata.models import Dataset, Organization, Reuse
+
+log = logging.getLogger(__name__)
+
+PAGE_KEY = 'page-cache:page:{0}'
+TAG_KEY = 'page-cache:tag:{0}'
+
+# Pages embed a per-session CSRF token which must not be shared between visitors
+CSRF_PLACEHOLDER = '__page_cache_csrf_token__'
+
+# Referenced objects whose pages display (part of) a given model
+SURROGATE_FIELDS = {
+    Dataset: ('organization',),
+    Reuse: ('organization', 'datasets'),
+    Dataservice: ('organization', 'datasets'),
+    Organization: (),
+}
+
+
+def is_enabled():
+    return current_app.config['PAGE_CACHE_ENABLED']
+
+
+def is_cacheable():
+    return is_enabled() and request.method == 'GET' and current_user.is_anonymous
+
+
+def ref_ids(document, field):
+    '''Extract referenced identifiers without dereferencing them'''
+    value = document._data.get(field)
+    values = value if isinstance(value, (list, tuple)) else [value]
+    return [getattr(v, 'id', v) for v in values if v is not None]
+
+
+def surrogate_keys(document):
+    '''Surrogate keys of a document: its own identifier and the ones it references'''
+    keys = [str(document.id)]
+    for field in SURROGATE_FIELDS.get(type(document), ()):
+        keys.extend(str(ref_id) for ref_id in ref_ids(document, field))
+    return keys
+
+
+def page_key():
+    '''Cache key for the current request: endpoint, view args, language and query string'''
+    view_args = sorted(
+        (name, str(getattr(value, 'id', value)))
+        for name, value in (request.view_args or {}).items()
+    )
+    parts = (
+        request.endpoint,
+        repr(view_args),
+        g.get('lang_code', ''),
+        repr(sorted(request.args.items(multi=True))),
+    )
+    return PAGE_KEY.format(hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest())
+
+
+def get_versions(keys):
+    '''Get the current surrogate keys versions, creating the missing ones'''
+    tag_keys = [TAG_KEY.format(key) for key in keys]
+    versions = cache.get_many(*tag_keys)
+    for tag_key, version in zip(tag_keys, versions):
+        if version is None:
+            cache.add(tag_key, uuid.uuid4().hex, timeout=0)
+    if None in versions:
+        versions = cache.get_many(*tag_keys)
+    return list(zip(keys, versions))
+
+
+def is_fresh(tags):
+    keys = [key for key, _ in tags]
+    return get_versions(keys) == [tuple(tag) for tag in tags]
+
+
+def purge(*keys):
+    '''Invalidate every cached page tagged with any of the given surrogate keys'''
+    if keys:
+        cache.delete_many(*[TAG_KEY.format(key) for key in keys])
+
+
+def cached_page(render, keys):
+    '''
+    Serve the current page from cache when possible.
+
+    :param render: a callable rendering the page HTML
+    :param keys: the surrogate keys of the objects displayed by the page
+    '''
+    if not is_cacheable():
+        return render()
+
+    key = page_key()
+    entry = cache.get(key)
+    if entry and is_fresh(entry['tags']):
+        html = zlib.decompress(entry['body']).decode('utf-8')
+        response = make_response(html.replace(CSRF_PLACEHOLDER, generate_csrf()))
+        response.headers['X-Page-Cache'] = 'HIT'
+    else:
+        # Versions are read before rendering so a concurrent purge is never missed
+        tags = get_versions(keys)
+        html = render()
+        body = html.replace(generate_csrf(), CSRF_PLACEHOLDER)
+        cache.set(key, {
+            'tags': tags,
+            'body': zlib.compress(body.encode('utf-8')),
+        }, timeout=current_app.config['PAGE_CACHE_TIMEOUT'])
+        response = make_response(html)
+        response.headers['X-Page-Cache'] = 'MISS'
+    response.headers['Surrogate-Key'] = ' '.join(keys)
+    return response
+
+
+def purge_document(sender, document, **kwargs):
+    # Surrogate keys versions are also used by conditional GET validators
+    if not current_app:
+        return
+    try:
+        purge(*surrogate_keys(document))
+    except Exception:
+        log.exception('Unable to purge page cache for %s', document)
+
+
+for model in SURROGATE_FIELDS:
+    post_save.connect(purge_document, sender=model)
+    post_delete.connect(purge_document, sender=model)
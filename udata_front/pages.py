@@ -0,0 +1,106 @@
+'''
+Local mirror of the static pages repository.
+
+The `sync-pages` job downloads the `PAGES_GH_REPO_NAME` repository tarball
+at `PAGES_REPO_BRANCH` and stores each page of its `pages` directory in
+cache, with a manifest of the page slugs, extensions and parsed front matter.
+Once synced, static pages are rendered from the mirror without any
+network access: a slug missing from the manifest does not exist.
+'''
+import hashlib
+import io
+import logging
+import posixpath
+import tarfile
+
+from datetime import datetime
+
+import frontmatter
+import requests
+
+from flask import current_app
+
+from udata.app import cache
+
+log = logging.getLogger(__name__)
+
+ARCHIVE_URL = 'https://codeload.github.com/{repo}/tar.gz/refs/heads/{branch}'
+ARCHIVE_TIMEOUT = 30
+
+MANIFEST_KEY = 'pages-mirror-manifest'
+CONTENT_KEY = 'pages-mirror-content:{0}'
+
+PAGES_DIR = 'pages'
+EXTENSIONS = ('md', 'html')
+
+
+def get_manifest():
+    '''The mirror manifest, `None` if the pages have never been synced'''
+    return cache.get(MANIFEST_KEY)
+
+
+def gh_url(slug, extension):
+    repo = current_app.config['PAGES_GH_REPO_NAME']
+    branch = current_app.config.get('PAGES_REPO_BRANCH', 'master')
+    return f'https://github.com/{repo}/blob/{branch}/{PAGES_DIR}/{slug}.{extension}'
+
+
+def archive_pages(data):
+    '''Yield the `(slug, extension, content)` of the pages of a repository tarball'''
+    with tarfile.open(fileobj=io.BytesIO(data), mode='r:gz') as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            # Members are prefixed by a `<repo>-<sha>` directory
+            parts = member.name.split('/')[1:]
+            if len(parts) < 2 or parts[0] != PAGES_DIR or '..' in parts:
+                continue
+            path, _, extension = posixpath.join(*parts[1:]).rpartition('.')
+            if extension not in EXTENSIONS:
+                continue
+            content = archive.extractfile(member).read().decode('utf-8')
+            yield path, extension, content
+
+
+def sync():
+    '''Mirror the pages repository, returning the manifest'''
+    url = ARCHIVE_URL.format(repo=current_app.config['PAGES_GH_REPO_NAME'],
+                             branch=current_app.config.get('PAGES_REPO_BRANCH', 'master'))
+    response = requests.get(url, timeout=ARCHIVE_TIMEOUT)
+    response.raise_for_status()
+
+    pages = {}
+    for slug, extension, content in archive_pages(response.content):
+        # Markdown wins over html, as for the remote extension detection
+        if slug in pages and extension != 'md':
+            continue
+        digest = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        try:
+            metadata = frontmatter.loads(content).metadata
+        except Exception:
+            log.exception('Unable to parse the front matter of page %s', slug)
+            metadata = {}
+        cache.set(CONTENT_KEY.format(digest), content, timeout=0)
+        pages[slug] = {'extension': extension, 'hash': digest, 'metadata': metadata}
+
+    previous = get_manifest()
+    manifest = {'synced_at': datetime.utcnow(), 'pages': pages}
+    cache.set(MANIFEST_KEY, manifest, timeout=0)
+    if previous:
+        current = {page['hash'] for page in pages.values()}
+        obsolete = {page['hash'] for page in previous['pages'].values()} - current
+        cache.delete_many(*(CONTENT_KEY.format(digest) for digest in obsolete))
+    log.info('Mirrored %d static page(s) from %s', len(pages), url)
+    return manifest
+
+
+def get_page(slug, manifest):
+    '''A mirrored page `(content, gh_url, extension)`, `None` if missing from the mirror'''
+    page = manifest['pages'].get(slug)
+    if not page:
+        return None
+    content = cache.get(CONTENT_KEY.format(page['hash']))
+    if content is None:
+        log.error('Static page %s is missing from the mirror', slug)
+        return None
+    return content, gh_url(slug, page['extension']), page['extension']
@@ -0,0 +1,155 @@
+'''
+Refresh-ahead cache for external content.
+
+Content fetched from an upstream (blog feed, remote terms, static pages)
+is stored without expiration along with its fetch date.
+Requests always serve the last good value: once older than its maximum age,
+a single background task per key fetches it again.
+Only a key never fetched is fetched within the request,
+concurrent requests for it waiting for that single fetch.
+
+Each upstream has a circuit breaker: after `EXTERNAL_CONTENT_BREAKER_THRESHOLD`
+consecutive failures, it is not called again before
+`EXTERNAL_CONTENT_BREAKER_COOLDOWN` seconds.
+'''
+import logging
+import time
+
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import current_app
+
+from udata.app import cache
+
+log = logging.getLogger(__name__)
+
+VALUE_KEY = 'external-content:{0}'
+LOCK_KEY = 'external-content-lock:{0}'
+BREAKER_KEY = 'external-content-breaker:{0}'
+
+# Seconds between two checks while waiting for a concurrent first fetch
+WAIT_INTERVAL = 0.1
+
+FETCHERS = {}
+
+UNAVAILABLE = object()
+
+
+class Unavailable(Exception):
+    '''No value has ever been fetched for a key and none could be'''
+
+
+def key_of(name, args):
+    return ':'.join((name,) + tuple(str(arg) for arg in args))
+
+
+def is_open(name):
+    '''Whether the circuit breaker of an upstream currently prevents calling it'''
+    state = cache.get(BREAKER_KEY.format(name))
+    return bool(
+        state
+        and state['failures'] >= current_app.config['EXTERNAL_CONTENT_BREAKER_THRESHOLD']
+        and datetime.utcnow() < state['retry_at']
+    )
+
+
+def record_failure(name):
+    key = BREAKER_KEY.format(name)
+    state = cache.get(key) or {'failures': 0}
+    cooldown = current_app.config['EXTERNAL_CONTENT_BREAKER_COOLDOWN']
+    cache.set(key, {
+        'failures': state['failures'] + 1,
+        'retry_at': datetime.utcnow() + timedelta(seconds=cooldown),
+    }, timeout=0)
+
+
+def fetch(name, args):
+    '''Fetch and store a value, returning its entry or `None` on failure'''
+    func, _ = FETCHERS[name]
+    key = key_of(name, args)
+    try:
+        if is_open(name):
+            log.warning('Upstream %s is failing, not fetching %s', name, key)
+            return None
+        try:
+            value = func(*args)
+        except Exception:
+            log.exception('Unable to fetch %s', key)
+            record_failure(name)
+            return None
+        cache.delete(BREAKER_KEY.format(name))
+        entry = {'value': value, 'fetched_at': datetime.utcnow()}
+        cache.set(VALUE_KEY.format(key), entry, timeout=0)
+        return entry
+    finally:
+        cache.delete(LOCK_KEY.format(key))
+
+
+def refresh(name, args):
+    '''Fetch a value again, from the background task'''
+    if name not in FETCHERS:
+        log.warning('Unknown external content %s', name)
+        return
+    fetch(name, tuple(args))
+
+
+def schedule_refresh(name, args, key):
+    from udata_front.tasks import refresh_external_content
+    timeout = current_app.config['EXTERNAL_CONTENT_BREAKER_COOLDOWN']
+    if not is_open(name) and cache.add(LOCK_KEY.format(key), True, timeout=timeout):
+        refresh_external_content.delay(name, list(args))
+
+
+def wait_for(key, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        entry = cache.get(VALUE_KEY.format(key))
+        if entry is not None or not cache.get(LOCK_KEY.format(key)):
+            return entry
+    return None
+
+
+def get(name, args):
+    '''The last good value of a key, scheduling a refresh once stale'''
+    _, max_age = FETCHERS[name]
+    key = key_of(name, args)
+    entry = cache.get(VALUE_KEY.format(key))
+    if entry is not None:
+        if entry['fetched_at'] + timedelta(seconds=max_age) < datetime.utcnow():
+            schedule_refresh(name, args, key)
+        return entry['value']
+    timeout = current_app.config['EXTERNAL_CONTENT_WAIT']
+    if cache.add(LOCK_KEY.format(key), True, timeout=timeout):
+        entry = fetch(name, args)
+    else:
+        # Coalesce with the fetch in progress
+        entry = wait_for(key, timeout)
+    if entry is None:
+        raise Unavailable(key)
+    return entry['value']
+
+
+def refreshed(name, max_age, default=UNAVAILABLE):
+    '''
+    Serve a fetching function results from the refresh-ahead cache.
+
+    :param name: the upstream name, shared by its keys circuit breaker
+    :param max_age: seconds after which a value is refreshed in background
+    :param default: the value returned instead of raising `Unavailable`
+    '''
+    def wrapper(func):
+        FETCHERS[name] = (func, max_age)
+
+        @wraps(func)
+        def cached(*args):
+            try:
+                return get(name, args)
+            except Unavailable:
+                if default is UNAVAILABLE:
+                    raise
+                return default
+        cached.fetch = func
+        return cached
+    return wrapper
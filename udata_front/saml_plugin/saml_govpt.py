@@ -20,8 +20,13 @@ from saml2.pack import http_form_post_message
 from saml2.sigver import SignatureError
 
 import base64
+import os
+import threading
+import time
 import xml.etree.ElementTree as ET
 
+from contextlib import contextmanager
+
 from .faa_level import FAAALevel, LogoutUrl
 from .requested_atributes import RequestedAttributes, RequestedAttribute
 
@@ -33,12 +38,8 @@ autenticacao_gov = Blueprint('saml', __name__)
 #################################################################
 
 
-def saml_client_for(metadata_file):
-
-    acs_url = url_for("saml.idp_initiated", _external=True)
-    out_url = url_for("saml.saml_logout_postback", _external=True)
-
-    settings = {
+def client_settings(metadata_file, acs_url, out_url):
+    return {
         'entityid': current_app.config.get('SECURITY_SAML_ENTITY_ID'),
         'name': current_app.config.get('SECURITY_SAML_ENTITY_NAME'),
         'key_file': current_app.config.get('SECURITY_SAML_KEY_FILE'),
@@ -70,10 +71,91 @@ def saml_client_for(metadata_file):
             },
         },
     }
+
+
+#################################################################
+# Per-process cache of loaded configurations.
+# Loading a configuration parses the IdP metadata and the key and
+# certificate, so it is kept until one of these files changes: a changed
+# file is reloaded in background while the previous configuration keeps
+# serving requests.
+# Clients keep per-user state (identities, outstanding requests) so each
+# request gets its own client bound to the cached configuration.
+##
+#################################################################
+_configs = {}
+_reloading = set()
+_configs_lock = threading.Lock()
+
+
+def files_signature(settings):
+    '''The modification times of the files a configuration loads'''
+    paths = settings['metadata']['local'] + [settings['key_file'], settings['cert_file']]
+    signature = []
+    for path in paths:
+        try:
+            signature.append(os.stat(path).st_mtime_ns if path else None)
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def load_config(settings):
     spConfig = Saml2Config()
     spConfig.load(settings)
-    saml_client = Saml2Client(config=spConfig)
-    return saml_client
+    return spConfig
+
+
+def reload_config(key, settings, signature, logger):
+    try:
+        config = load_config(settings)
+    except Exception:
+        # Keep the previous configuration until the files change again
+        logger.exception('Unable to reload the SAML configuration for %s', key[0])
+        config = None
+    else:
+        logger.info('Reloaded the SAML configuration for %s', key[0])
+    with _configs_lock:
+        _configs[key] = (signature, config or _configs[key][1])
+        _reloading.discard(key)
+
+
+def cached_config(settings):
+    '''A loaded configuration, loaded once per process and configuration files state'''
+    endpoints = settings['service']['sp']['endpoints']['assertion_consumer_service']
+    key = (settings['metadata']['local'][0], endpoints[0][0])
+    signature = files_signature(settings)
+    with _configs_lock:
+        cached = _configs.get(key)
+        if cached and cached[0] != signature and key not in _reloading:
+            _reloading.add(key)
+            threading.Thread(target=reload_config, daemon=True,
+                             args=(key, settings, signature, current_app.logger)).start()
+    if cached:
+        return cached[1]
+    config = load_config(settings)
+    with _configs_lock:
+        _configs.setdefault(key, (signature, config))
+    return config
+
+
+@contextmanager
+def timed_verification(server):
+    '''Log the time spent parsing and verifying a response against an IdP'''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current_app.logger.info('SAML response verification against %s took %.1f ms',
+                                server, (time.perf_counter() - start) * 1000)
+
+
+def saml_client_for(metadata_file):
+
+    acs_url = url_for("saml.idp_initiated", _external=True)
+    out_url = url_for("saml.saml_logout_postback", _external=True)
+
+    return Saml2Client(config=cached_config(client_settings(metadata_file, acs_url, out_url)))
 
 
 #################################################################
@@ -150,7 +232,8 @@ def idp_initiated():
                     continue
             if root is None:
                 raise ValueError("Não foi possível decodificar o XML com codecs disponíveis.")
-            authn_response = saml_client.parse_authn_request_response(decoded_response, entity.BINDING_HTTP_POST)
+            with timed_verification(server):
+                authn_response = saml_client.parse_authn_request_response(decoded_response, entity.BINDING_HTTP_POST)
             root = ET.fromstring(decoded_response)  # Analisar a resposta decodificada para diagnóstico
         except sigver.MissingKey:
             continue
@@ -280,42 +363,7 @@ def eidas_client_for(metadata_file):
     acs_url = url_for("saml.idp_eidas_initiated", _external=True)
     out_url = url_for("saml.eidas_logout_postback", _external=True)
 
-    settings = {
-        'entityid': current_app.config.get('SECURITY_SAML_ENTITY_ID'),
-        'name': current_app.config.get('SECURITY_SAML_ENTITY_NAME'),
-        'key_file': current_app.config.get('SECURITY_SAML_KEY_FILE'),
-        'cert_file': current_app.config.get('SECURITY_SAML_CERT_FILE'),
-        'metadata': {
-            "local": [metadata_file]
-        },
-        'accepted_time_diff': 60,
-        'service': {
-            'sp': {
-                'endpoints': {
-                    'assertion_consumer_service': [
-                        (acs_url, BINDING_HTTP_REDIRECT),
-                        (acs_url, BINDING_HTTP_POST)
-                    ],
-                    'single_logout_service': [
-                        (out_url, BINDING_HTTP_REDIRECT),
-                        (out_url, BINDING_HTTP_POST),
-                    ],
-                },
-                # Don't verify that the incoming requests originate from us via
-                # the built-in cache for authn request ids in pysaml2
-                'allow_unsolicited': True,
-                # Sign authn requests
-                'authn_requests_signed': True,
-                'logout_requests_signed': True,
-                'want_assertions_signed': True,
-                'want_response_signed': True,
-            },
-        },
-    }
-    spConfig = Saml2Config()
-    spConfig.load(settings)
-    saml_client = Saml2Client(config=spConfig)
-    return saml_client
+    return Saml2Client(config=cached_config(client_settings(metadata_file, acs_url, out_url)))
 
 
 #################################################################
@@ -397,7 +445,8 @@ def idp_eidas_initiated():
                     continue
             if root is None:
                 raise ValueError("Não foi possível decodificar o XML com codecs disponíveis.")
-            authn_response = saml_client.parse_authn_request_response(decoded_response, entity.BINDING_HTTP_POST)
+            with timed_verification(server):
+                authn_response = saml_client.parse_authn_request_response(decoded_response, entity.BINDING_HTTP_POST)
             root = ET.fromstring(decoded_response)  # Analisar a resposta decodificada para diagnóstico
         except sigver.MissingKey:
             continue
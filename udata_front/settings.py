@@ -15,6 +15,29 @@ RESOURCES_DEFAULT_PAGE_SIZE = 6
 # Number of resources to show resource search on dataset page
 RESOURCES_MIN_COUNT_TO_SHOW_SEARCH = 12
 
+# Full-page cache for anonymous visitors on detail pages
+# Requires a shared cache backend (Redis) as entries are invalidated on save
+PAGE_CACHE_ENABLED = False
+# Page cache entries lifetime in seconds
+PAGE_CACHE_TIMEOUT = 60 * 60
+
+# Lifetime in seconds of the cached territory datasets counts,
+# for the changes not expiring them (a dataset or an organization leaving a territory)
+TERRITORY_COUNTS_TIMEOUT = 60 * 60
+
+# Maximum number of urls per prebuilt sitemap shard (the sitemap protocol limit)
+SITEMAP_SHARD_SIZE = 50000
+
+# Circuit breaker of external content upstreams (blog feed, remote terms, static pages):
+# consecutive failures before stopping to call an upstream, and seconds before calling it again
+EXTERNAL_CONTENT_BREAKER_THRESHOLD = 3
+EXTERNAL_CONTENT_BREAKER_COOLDOWN = 60
+# Maximum seconds a request waits for external content never fetched yet
+EXTERNAL_CONTENT_WAIT = 5
+
+# Seconds after which the home page snapshot is rebuilt in background (still being served)
+HOME_SNAPSHOT_MAX_AGE = 5 * 60
+
 # Frontend banner parameters
 BANNER_ACTIVATED = False
 BANNER_HTML_CONTENT_EN = ''
@@ -0,0 +1,227 @@
+'''
+Prebuilt sitemap.
+
+Each sitemap source is a query streamed with a server-side cursor
+and a projection on the fields its urls need.
+The `build-sitemap` job splits each source into gzipped shards
+of at most `SITEMAP_SHARD_SIZE` urls delimited by identifiers,
+and stores them with the sitemap index in cache.
+Later builds only rewrite the shards holding documents modified since
+the previous build (its watermark) or whose url count changed.
+'''
+import gzip
+import logging
+
+from bisect import bisect_right
+from datetime import datetime
+from io import BytesIO
+from itertools import chain, islice
+
+from flask import current_app, url_for
+
+from udata.app import cache
+from udata.sitemap import sitemap, CACHE_KEY
+
+log = logging.getLogger(__name__)
+
+STATE_KEY = 'sitemap-state'
+SHARD_KEY = 'sitemap-shard:{0}:{1}'
+
+# Static pages, given by the plain sitemap generators
+PAGES = 'pages'
+
+SOURCES = []
+
+
+class SitemapSource(object):
+    '''
+    A sitemap generator yielding an url per document of a queryset.
+
+    :param name: the source name, used in shards urls
+    :param queryset: a callable returning the queryset of documents to list
+    :param endpoint: the documents urls endpoint
+    :param param: the endpoint parameter given the document slug (or id)
+    :param values: a callable building the endpoint values from a raw document,
+                   in place of `param`
+    :param fields: the fields projected for `values`
+    :param modified: the documents modification date field, if any
+    '''
+    def __init__(self, name, queryset, endpoint, changefreq, priority,
+                 param=None, values=None, fields=('slug',), modified=None):
+        self.name = name
+        self.queryset = queryset
+        self.endpoint = endpoint
+        self.changefreq = changefreq
+        self.priority = priority
+        self.param = param
+        self.values = values or self.default_values
+        self.fields = fields
+        self.modified = modified
+        self.__name__ = queryset.__name__
+
+    def default_values(self, doc):
+        return {self.param: doc.get('slug') or str(doc['_id'])}
+
+    def documents(self, start=None, end=None):
+        '''Stream the raw documents with identifiers in `[start, end)`'''
+        queryset = self.between(self.queryset(), start, end)
+        return (queryset.no_cache().order_by('id').only(*self.fields)
+                        .as_pymongo())
+
+    def between(self, queryset, start=None, end=None):
+        if start is not None:
+            queryset = queryset(id__gte=start)
+        if end is not None:
+            queryset = queryset(id__lt=end)
+        return queryset
+
+    def changed_since(self, date):
+        '''Identifiers of documents modified since a date, visible or not'''
+        if not self.modified:
+            return []
+        model = self.queryset()._document
+        return model.objects(**{'{0}__gte'.format(self.modified): date}).no_cache().scalar('id')
+
+    def __call__(self):
+        for doc in self.documents():
+            yield self.endpoint, self.values(doc), None, self.changefreq, self.priority
+
+
+def register_source(name, endpoint, param, changefreq, priority, **kwargs):
+    '''
+    Register a queryset function as a sitemap source.
+
+    The source is registered as a sitemap generator too.
+    '''
+    def wrapper(func):
+        source = SitemapSource(name, func, endpoint, changefreq, priority,
+                               param=param, **kwargs)
+        SOURCES.append(source)
+        return sitemap.register_generator(source)
+    return wrapper
+
+
+def to_url(endpoint, values, lastmod=None, changefreq=None, priority=None):
+    '''A flask-sitemap url entry'''
+    return {
+        'loc': url_for(endpoint, _external=True, **values),
+        'lastmod': lastmod,
+        'changefreq': changefreq,
+        'priority': priority,
+    }
+
+
+def render_shard(urls):
+    '''Stream urls into a gzipped sitemap'''
+    template = current_app.jinja_env.get_template('flask_sitemap/sitemap.xml')
+    buffer = BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb') as out:
+        for chunk in template.generate(urlset=urls):
+            out.write(chunk.encode('utf-8'))
+    return buffer.getvalue()
+
+
+def write_shard(name, start, urls, built_at):
+    cache.set(SHARD_KEY.format(name, start), render_shard(urls), timeout=0)
+    return {'start': start, 'count': len(urls), 'lastmod': built_at}
+
+
+def write_range(source, start, end, built_at):
+    '''(Re)write the shards of a source identifiers range, splitting oversized ranges'''
+    size = current_app.config['SITEMAP_SHARD_SIZE']
+    docs = iter(source.documents(start, end))
+    shards = []
+    for doc in docs:
+        chunk = list(chain([doc], islice(docs, size - 1)))
+        chunk_start = start if not shards else chunk[0]['_id']
+        urls = [to_url(source.endpoint, source.values(d), None,
+                       source.changefreq, source.priority) for d in chunk]
+        shards.append(write_shard(source.name, chunk_start, urls, built_at))
+    return shards or [write_shard(source.name, start, [], built_at)]
+
+
+def dirty_shards(source, shards, since):
+    '''Indexes of the shards to rewrite'''
+    queryset = source.queryset()
+    starts = [shard['start'] for shard in shards[1:]]
+    dirty = set()
+    for index, shard in enumerate(shards):
+        end = shards[index + 1]['start'] if index + 1 < len(shards) else None
+        if source.between(queryset, shard['start'], end).count() != shard['count']:
+            dirty.add(index)
+    for obj_id in source.changed_since(since):
+        dirty.add(bisect_right(starts, obj_id))
+    return dirty
+
+
+def build_source(source, previous, built_at):
+    '''Build the shards of a source, only rewriting dirty ones'''
+    if not previous:
+        return write_range(source, None, None, built_at)
+    shards = previous['shards']
+    dirty = dirty_shards(source, shards, previous['built_at'])
+    built = []
+    for index, shard in enumerate(shards):
+        end = shards[index + 1]['start'] if index + 1 < len(shards) else None
+        if index in dirty:
+            built.extend(write_range(source, shard['start'], end, built_at))
+        else:
+            built.append(shard)
+    # An empty shard range can be merged into the previous one
+    kept = [shard for i, shard in enumerate(built) if i == 0 or shard['count']]
+    obsolete = {shard['start'] for shard in shards} - {shard['start'] for shard in kept}
+    cache.delete_many(*(SHARD_KEY.format(source.name, start) for start in obsolete))
+    log.info('Sitemap source %s: rewrote %d shard(s) out of %d',
+             source.name, len(dirty), len(shards))
+    return kept
+
+
+def build_pages(built_at):
+    '''Build the shard of static pages, given by the plain sitemap generators'''
+    urls = []
+    for generator in sitemap.url_generators:
+        if isinstance(generator, SitemapSource):
+            continue
+        for generated in generator():
+            urls.append(to_url(*generated))
+    return [write_shard(PAGES, None, urls, built_at)]
+
+
+def build(full=False):
+    '''
+    Build the sitemap shards and index.
+
+    :param full: ignore the previous build and rewrite every shard
+    '''
+    previous = {} if full else (cache.get(STATE_KEY) or {})
+    # Taken before querying so concurrent modifications are seen by the next build
+    built_at = datetime.utcnow()
+    state = {}
+    with current_app.test_request_context():
+        state[PAGES] = {'built_at': built_at, 'shards': build_pages(built_at)}
+        for source in SOURCES:
+            shards = build_source(source, previous.get(source.name), built_at)
+            state[source.name] = {'built_at': built_at, 'shards': shards}
+        index = current_app.jinja_env.get_template(
+            'flask_sitemap/sitemapindex.xml'
+        ).render(sitemaps=[
+            {
+                'loc': url_for('site.sitemap_shard', source=name, page=page,
+                               _external=True),
+                'lastmod': shard['lastmod'].date().isoformat(),
+            }
+            for name, source_state in state.items()
+            for page, shard in enumerate(source_state['shards'], 1)
+        ])
+    cache.set(STATE_KEY, state, timeout=0)
+    # The sitemap index view serves this key when present
+    cache.set(CACHE_KEY.format(None), index, timeout=0)
+    return state
+
+
+def get_shard(name, page):
+    '''The gzipped content of a built shard, if any'''
+    state = (cache.get(STATE_KEY) or {}).get(name)
+    if not state or not 0 < page <= len(state['shards']):
+        return None
+    return cache.get(SHARD_KEY.format(name, state['shards'][page - 1]['start']))
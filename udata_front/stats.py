@@ -0,0 +1,143 @@
+'''
+Incremental maintenance of the materialized organization statistics.
+
+Counters are stored in `OrganizationStats` documents so the organization page
+never has to count datasets, reuses, dataservices or followers live.
+Creations, hard deletions and follows are applied as atomic increments
+on existing stats (missing ones are computed on first access).
+Updates touching a visibility or ownership field trigger a recount
+of the affected kind for the organization only.
+Anything bypassing signals (raw updates, bulk writes) is fixed
+by the periodic `reconcile-organization-stats` job.
+'''
+from datetime import datetime
+from mongoengine.signals import post_delete
+
+from udata.core.dataservices.models import Dataservice
+from udata.core.followers.signals import on_follow, on_unfollow
+from udata.core.owned import Owned
+from udata.models import Dataset, Follow, Organization, Reuse
+
+from udata_front.models import OrganizationStats
+
+
+def is_visible_dataset(dataset):
+    return not dataset.private and not dataset.deleted and not dataset.archived
+
+
+def is_visible_reuse(reuse):
+    return not reuse.private and not reuse.deleted and bool(reuse.datasets)
+
+
+def is_visible_dataservice(dataservice):
+    return (not dataservice.private and not dataservice.deleted_at
+            and not dataservice.archived_at)
+
+
+# model: (counter name, visibility predicate, fields affecting counters)
+TRACKED_MODELS = {
+    Dataset: ('datasets', is_visible_dataset,
+              {'organization', 'private', 'deleted', 'archived'}),
+    Reuse: ('reuses', is_visible_reuse,
+            {'organization', 'private', 'deleted', 'datasets'}),
+    Dataservice: ('dataservices', is_visible_dataservice,
+                  {'organization', 'private', 'deleted_at', 'archived_at'}),
+}
+
+
+def org_id_of(document):
+    '''Get the organization identifier without dereferencing it'''
+    org = document._data.get('organization')
+    return getattr(org, 'id', org)
+
+
+def count_for(model, org_id):
+    '''Count all and visible objects of a given model for an organization'''
+    name = TRACKED_MODELS[model][0]
+    return {
+        name: model.objects(organization=org_id).count(),
+        'visible_' + name: model.objects(organization=org_id).visible().count(),
+    }
+
+
+def compute_organization_stats(org_id):
+    '''Recount every statistic of an organization from live data'''
+    values = {}
+    for model in TRACKED_MODELS:
+        values.update(count_for(model, org_id))
+    values['followers'] = Follow.objects.followers(
+        Organization(id=org_id)).count()
+    stats = OrganizationStats(organization=org_id, **values)
+    stats.save()
+    return stats
+
+
+def get_organization_stats(org):
+    '''Get the materialized statistics of an organization, computing them on first access'''
+    stats = OrganizationStats.objects(organization=org.id).first()
+    return stats or compute_organization_stats(org.id)
+
+
+def recount(model, org_id):
+    '''Recount a single model counters for an organization having materialized stats'''
+    if not OrganizationStats.objects(organization=org_id).count():
+        return
+    values = {'set__' + key: value for key, value in count_for(model, org_id).items()}
+    OrganizationStats.objects(organization=org_id).update_one(
+        set__updated_at=datetime.utcnow(), **values)
+
+
+def on_created(document, **kwargs):
+    org_id = org_id_of(document)
+    if not org_id:
+        return
+    name, is_visible, _ = TRACKED_MODELS[type(document)]
+    OrganizationStats.increment(org_id, **{
+        name: 1,
+        'visible_' + name: 1 if is_visible(document) else 0,
+    })
+
+
+def on_updated(document, **kwargs):
+    org_id = org_id_of(document)
+    if not org_id:
+        return
+    _, _, fields = TRACKED_MODELS[type(document)]
+    changed = {field.split('.')[0] for field in document._get_changed_fields()}
+    if changed & fields:
+        recount(type(document), org_id)
+
+
+def on_deleted(sender, document, **kwargs):
+    org_id = org_id_of(document)
+    if not org_id:
+        return
+    name, is_visible, _ = TRACKED_MODELS[sender]
+    OrganizationStats.increment(org_id, **{
+        name: -1,
+        'visible_' + name: -1 if is_visible(document) else 0,
+    })
+
+
+for model in TRACKED_MODELS:
+    model.on_create.connect(on_created)
+    model.on_update.connect(on_updated)
+    post_delete.connect(on_deleted, sender=model)
+
+
+@Owned.on_owner_change.connect
+def on_owner_change(document, previous):
+    if isinstance(previous, Organization) and type(document) in TRACKED_MODELS:
+        recount(type(document), previous.id)
+
+
+@on_follow.connect
+def on_organization_followed(follow):
+    if isinstance(follow.following, Organization):
+        OrganizationStats.increment(follow.following.id, followers=1)
+
+
+@on_unfollow.connect
+def on_organization_unfollowed(follow):
+    if isinstance(follow.following, Organization):
+        OrganizationStats.increment(follow.following.id, followers=-1)
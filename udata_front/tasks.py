@@ -6,12 +6,20 @@ from flask import current_app
 
 from udata.commands import success, error
 from udata.core.dataset.models import Dataset
-from udata.tasks import job
+from udata.models import Organization
+from udata.tasks import job, task
 
 from udata_front import (
     APIGOUVFR_EXTRAS_KEY,
     APIGOUVFR_EXPECTED_FIELDS,
+    followers,
+    home,
+    pages,
+    refresh,
+    sitemaps,
+    territories,
 )
+from udata_front.stats import compute_organization_stats
 
 
 def get_dataset(id_or_slug):
@@ -61,3 +69,57 @@ def apigouvfr_load_apis(self):
         process_dataset(d_id, d_apis)
 
     success('Done.')
+
+
+@job('reconcile-organization-stats')
+def reconcile_organization_stats(self):
+    '''Recompute materialized organization statistics from live data'''
+    count = 0
+    for org_id in Organization.objects.scalar('id'):
+        compute_organization_stats(org_id)
+        count += 1
+    success(f'Reconciled statistics for {count} organization(s).')
+
+
+@job('build-sitemap')
+def build_sitemap(self):
+    '''Build the sitemap shards modified since the previous build, and the index'''
+    state = sitemaps.build()
+    count = sum(len(source['shards']) for source in state.values())
+    success(f'Built a sitemap index of {count} shard(s).')
+
+
+@job('build-home-snapshot')
+def build_home_snapshot(self, lang=None):
+    '''Build the home page snapshot of a language, or of every language'''
+    languages = [lang] if lang else current_app.config['LANGUAGES']
+    for code in languages:
+        home.build(code)
+    success(f'Built the home snapshot for {len(languages)} language(s).')
+
+
+@job('build-territories')
+def build_territories(self):
+    '''Build the sorted zones and GeoJSON of each handled level and language'''
+    count = territories.build()
+    success(f'Built {count} territories level(s).')
+
+
+@job('sync-pages')
+def sync_pages(self):
+    '''Mirror the static pages repository'''
+    manifest = pages.sync()
+    success(f'Mirrored {len(manifest["pages"])} static page(s).')
+
+
+@job('index-followers')
+def index_followers(self):
+    '''Rebuild the followers sortable by name from the active follows'''
+    count = followers.index_followers()
+    success(f'Indexed {count} follower(s).')
+
+
+@task(ignore_result=True)
+def refresh_external_content(name, args):
+    '''Fetch some external content again for the refresh-ahead cache'''
+    refresh.refresh(name, args)
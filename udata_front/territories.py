@@ -0,0 +1,67 @@
+'''
+Prebuilt territories home.
+
+The `build-territories` job builds, for each handled level and language,
+the sorted zones of the level as a compact GeoJSON feature collection
+along with its content hash, and stores them in cache.
+The territories home only reads the highest level build,
+and serves its GeoJSON under an url versioned by the hash.
+'''
+import hashlib
+import json
+import logging
+import unicodedata
+
+from flask import current_app, url_for
+
+from udata.app import cache
+from udata.i18n import language
+from udata.models import GeoZone
+
+log = logging.getLogger(__name__)
+
+LEVEL_KEY = 'territories-level:{0}:{1}'
+
+
+def sort_key(name):
+    '''Sort names alphabetically, ignoring accents'''
+    return unicodedata.normalize('NFD', name).encode('ascii', 'ignore')
+
+
+def build_level(level, lang):
+    '''Build and store the zones of a level in a given language'''
+    with current_app.test_request_context(), language(lang):
+        zones = sorted(((zone.toGeoJSON(), zone)
+                        for zone in GeoZone.objects(level=level).no_cache()),
+                       key=lambda pair: sort_key(pair[0]['properties']['name']))
+        features = [feature for feature, _ in zones]
+        regions = [{
+            'name': feature['properties']['name'],
+            'url': url_for('territories.territory', territory=zone),
+        } for feature, zone in zones]
+    geojson = json.dumps({'type': 'FeatureCollection', 'features': features},
+                         separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    built = {
+        'hash': hashlib.sha256(geojson).hexdigest()[:16],
+        'geojson': geojson,
+        'regions': regions,
+    }
+    cache.set(LEVEL_KEY.format(level, lang), built, timeout=0)
+    return built
+
+
+def build():
+    '''Build every handled level in every language, returning the built count'''
+    count = 0
+    for level in current_app.config['HANDLED_LEVELS']:
+        for lang in current_app.config['LANGUAGES']:
+            built = build_level(level, lang)
+            log.info('Territories %s (%s): %d zone(s), hash %s',
+                     level, lang, len(built['regions']), built['hash'])
+            count += 1
+    return count
+
+
+def get_level(level, lang):
+    '''The built zones of a level, built on first use if the job did not run yet'''
+    return cache.get(LEVEL_KEY.format(level, lang)) or build_level(level, lang)
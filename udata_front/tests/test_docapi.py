@@ -0,0 +1,56 @@
+import pytest
+
+from mongoengine.context_managers import query_counter
+
+from udata.app import cache
+from udata.core.organization.factories import OrganizationFactory
+
+from udata_front.faqs_plugin.views import get_organizations
+from udata_front.tests import GouvFrSettings
+
+
+class DocapiSettings(GouvFrSettings):
+    CACHE_TYPE = 'flask_caching.backends.simple'
+
+
+@pytest.mark.usefixtures('clean_db')
+class DocapiOrganizationsTest:
+    settings = DocapiSettings
+    modules = []
+
+    def test_sorted_and_cached(self, app):
+        cache.clear()
+        OrganizationFactory(name='Beta')
+        alpha = OrganizationFactory(name='Alpha')
+
+        organizations = get_organizations()
+        assert [org['name'] for org in organizations] == ['Alpha', 'Beta']
+        assert organizations[0] == {
+            'id': str(alpha.id),
+            'slug': alpha.slug,
+            'name': 'Alpha',
+            'acronym': alpha.acronym,
+        }
+        with query_counter() as count:
+            assert get_organizations() == organizations
+            assert count == 0
+
+    def test_expired_on_rename_only(self, app):
+        cache.clear()
+        org = OrganizationFactory(name='Alpha')
+        get_organizations()
+
+        org.description = 'Not displayed'
+        org.save()
+        assert get_organizations()[0]['name'] == 'Alpha'
+
+        org.name = 'Renamed'
+        org.save()
+        assert get_organizations()[0]['name'] == 'Renamed'
+
+    def test_expired_on_delete(self, app):
+        cache.clear()
+        org = OrganizationFactory()
+        get_organizations()
+        org.delete()
+        assert get_organizations() == []
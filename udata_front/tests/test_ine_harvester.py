@@ -0,0 +1,235 @@
+import pytest
+import threading
+import xml.etree.ElementTree as ET
+
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+
+from udata.core.organization.factories import OrganizationFactory
+from udata.harvest.tests.factories import HarvestJobFactory, HarvestSourceFactory
+from udata.models import Dataset
+
+from udata_front.harvesters.ine import INEBackend
+from udata_front.harvesters.tools.harvester_utils import content_fingerprint
+from udata_front.models import HarvestDownload
+from udata_front.tests import GouvFrSettings
+
+CATALOG_URL = 'https://www.ine.pt/ine/xml_indic.jsp'
+HVD_URL = 'https://www.ine.pt/ine/xml_indic_hvd.jsp?opc=3&lang=PT'
+
+
+def catalog(*indicators):
+    return ('<catalog>{0}</catalog>'.format(''.join(
+        '<indicator id="{0}"><title>{1}</title>'
+        '<description>Description {0}</description>'
+        '<keywords>economia, emprego</keywords></indicator>'.format(remote_id, title)
+        for remote_id, title in indicators
+    ))).encode('utf-8')
+
+
+def calls_on(spy, model):
+    '''The calls of a `Collection` method spy on the collection of a model'''
+    name = model._get_collection_name()
+    return [call for call in spy.call_args_list if call.args[0].name == name]
+
+
+@pytest.fixture
+def backend(rmock):
+    rmock.get(HVD_URL, content=b'<indicators/>')
+    source = HarvestSourceFactory(url=CATALOG_URL, backend='ine',
+                                  organization=OrganizationFactory())
+    job = HarvestJobFactory(source=source, status='running', items=[])
+    backend = INEBackend(job)
+    backend.USE_LOCAL_FILE = False
+    backend.BULK_SIZE = 2
+    return backend
+
+
+@pytest.mark.usefixtures('clean_db')
+class INEBackendTest:
+    settings = GouvFrSettings
+    modules = []
+
+    def test_created_items_without_extra_queries(self, backend, rmock, mocker):
+        indicators = [(str(remote_id), 'Indicador {0}'.format(remote_id))
+                      for remote_id in range(5)]
+        rmock.get(CATALOG_URL, content=catalog(*indicators))
+        find = mocker.spy(Collection, 'find')
+        find_one = mocker.spy(Collection, 'find_one')
+
+        backend.inner_harvest()
+        # A single datasets query per chunk and no lookup per created dataset
+        assert find_one.call_count == 0
+        assert len(calls_on(find, Dataset)) == 3
+        # Catalogue and HVD download validators loaded together
+        assert len(calls_on(find, HarvestDownload)) == 1
+
+        datasets = {d.harvest.remote_id: d.id for d in Dataset.objects}
+        assert len(datasets) == 5
+        items = {item.remote_id: item for item in backend.job.items}
+        assert {rid: item.dataset.id for rid, item in items.items()} == datasets
+        assert all(item.status == 'done' for item in items.values())
+
+    def test_unchanged_items_skipped(self, backend, rmock):
+        rmock.get(CATALOG_URL, content=catalog(('1', 'Indicador 1'), ('2', 'Indicador 2')))
+        backend.inner_harvest()
+        backend.job.items = []
+
+        rmock.get(CATALOG_URL, content=catalog(('1', 'Indicador 1'), ('2', 'Renomeado')))
+        backend.inner_harvest()
+
+        statuses = {item.remote_id: item.status for item in backend.job.items}
+        assert statuses == {'1': 'skipped', '2': 'done'}
+        assert Dataset.objects.get(harvest__remote_id='2').title == 'Renomeado'
+        assert Dataset.objects.count() == 2
+
+    def test_unchanged_items_cost_no_hydration_nor_write(self, backend, rmock, mocker):
+        rmock.get(CATALOG_URL, content=catalog(('1', 'Indicador 1'), ('2', 'Indicador 2')))
+        backend.inner_harvest()
+        assert all(d.harvest.fingerprint for d in Dataset.objects)
+
+        backend.job.items = []
+        # Force the diff despite the unchanged catalogue
+        HarvestDownload.objects.delete()
+        bulk_write = mocker.spy(Collection, 'bulk_write')
+        hydrate = mocker.spy(INEBackend, '_hydrate')
+        backend.inner_harvest()
+
+        assert bulk_write.call_count == 0
+        assert hydrate.call_args.args[1] == []
+        assert {item.status for item in backend.job.items} == {'skipped'}
+
+    def test_fingerprint_backfilled_without_rewrite(self, backend, rmock):
+        rmock.get(CATALOG_URL, content=catalog(('1', 'Indicador 1')))
+        backend.inner_harvest()
+        dataset = Dataset.objects.get(harvest__remote_id='1')
+        fingerprint = dataset.harvest.fingerprint
+        modified_at = dataset.harvest.modified_at
+        Dataset._get_collection().update_one(
+            {'_id': dataset.id}, {'$unset': {'harvest.fingerprint': 1}})
+        HarvestDownload.objects.delete()
+
+        backend.job.items = []
+        backend.inner_harvest()
+
+        dataset.reload()
+        assert dataset.harvest.fingerprint == fingerprint
+        assert dataset.harvest.modified_at == modified_at
+        assert backend.job.items[0].status == 'skipped'
+
+    def test_unchanged_catalog_short_circuits(self, backend, rmock, mocker):
+        content = catalog(('1', 'Indicador 1'))
+        rmock.get(CATALOG_URL, content=content, headers={'ETag': '"v1"'})
+        rmock.get(HVD_URL, content=b'<indicators><indicator id="1"/></indicators>',
+                  headers={'ETag': '"h1"'})
+        backend.inner_harvest()
+        download = HarvestDownload.objects.get(url=CATALOG_URL)
+        assert download.etag == '"v1"'
+        assert download.sha256
+
+        backend.job.items = []
+        rmock.get(CATALOG_URL, status_code=304)
+        rmock.get(HVD_URL, status_code=304)
+        prefetch = mocker.spy(INEBackend, '_prefetch_existing')
+        backend.inner_harvest()
+
+        assert rmock.request_history[-1].headers['If-None-Match'] == '"v1"'
+        assert backend.job.data['unchanged'] is True
+        assert backend.job.items == []
+        assert prefetch.call_count == 0
+        # The HVD ids are reused from the last download
+        assert backend.HVD_INDICATOR_IDS == {'1'}
+
+    def test_same_payload_without_validators_short_circuits(self, backend, rmock):
+        rmock.get(CATALOG_URL, content=catalog(('1', 'Indicador 1')))
+        backend.inner_harvest()
+
+        backend.job.items = []
+        backend.inner_harvest()
+        assert backend.job.data['unchanged'] is True
+        assert backend.job.items == []
+
+    def test_failed_harvest_does_not_persist_validators(self, backend, rmock, mocker):
+        rmock.get(CATALOG_URL, content=catalog(('1', 'Indicador 1')),
+                  headers={'ETag': '"v1"'})
+        mocker.patch.object(INEBackend, '_flush_bulk', side_effect=ValueError('down'))
+        with pytest.raises(ValueError):
+            backend.inner_harvest()
+        assert HarvestDownload.objects(url=CATALOG_URL).count() == 0
+
+    def test_failed_items_do_not_persist_catalog_validators(self, backend, rmock, mocker):
+        rmock.get(CATALOG_URL, content=catalog(('1', 'Indicador 1'), ('2', 'Indicador 2')),
+                  headers={'ETag': '"v1"'})
+        apply_metadata = INEBackend._apply_metadata_to_dataset
+
+        def fail_on_second(self, dataset, remote_id, md):
+            if remote_id == '2':
+                raise ValueError('invalid')
+            return apply_metadata(self, dataset, remote_id, md)
+
+        mocker.patch.object(INEBackend, '_apply_metadata_to_dataset', fail_on_second)
+        backend.inner_harvest()
+        assert HarvestDownload.objects(url=CATALOG_URL).count() == 0
+        assert HarvestDownload.objects(url=HVD_URL).count() == 1
+
+        # The failed item is retried on the next run
+        mocker.stopall()
+        backend.job.items = []
+        backend.inner_harvest()
+        assert backend.job.data.get('unchanged') is not True
+        assert Dataset.objects.count() == 2
+        assert HarvestDownload.objects.get(url=CATALOG_URL).etag == '"v1"'
+
+    def test_write_errors_do_not_persist_catalog_validators(self, backend, rmock, mocker):
+        rmock.get(CATALOG_URL, content=catalog(('1', 'Indicador 1')),
+                  headers={'ETag': '"v1"'})
+        mocker.patch.object(Collection, 'bulk_write', side_effect=BulkWriteError({
+            'writeErrors': [{'index': 0, 'code': 121, 'errmsg': 'validation failed'}],
+        }))
+
+        backend.inner_harvest()
+
+        assert backend._write_errors == 1
+        assert HarvestDownload.objects(url=CATALOG_URL).count() == 0
+
+    def test_streamed_in_chunks_with_report(self, backend, rmock):
+        indicators = [(str(remote_id), 'Indicador {0}'.format(remote_id))
+                      for remote_id in range(5)]
+        # Duplicates are only harvested once
+        rmock.get(CATALOG_URL, content=catalog(*indicators, ('1', 'Duplicado')))
+        backend.PIPELINE_CHUNKS = 1
+
+        backend.inner_harvest()
+
+        assert sorted(item.remote_id for item in backend.job.items) == [
+            '0', '1', '2', '3', '4']
+        assert Dataset.objects.get(harvest__remote_id='1').title == 'Indicador 1'
+        assert backend.job.data['throughput'] > 0
+        assert backend.job.data['peak_rss_mb'] > 0
+        assert backend.job.data['rss_growth_mb'] >= 0
+
+    def test_write_error_stops_parser(self, backend, rmock, mocker):
+        indicators = [(str(remote_id), 'Indicador {0}'.format(remote_id))
+                      for remote_id in range(20)]
+        rmock.get(CATALOG_URL, content=catalog(*indicators))
+        backend.PIPELINE_CHUNKS = 1
+        mocker.patch.object(INEBackend, '_flush_bulk', side_effect=ValueError('down'))
+
+        with pytest.raises(ValueError):
+            backend.inner_harvest()
+
+        parsers = [t for t in threading.enumerate() if t.name == 'ine-parser']
+        for parser in parsers:
+            parser.join(timeout=5)
+        assert not any(parser.is_alive() for parser in parsers)
+
+    def test_parse_error_raised(self, backend, rmock):
+        rmock.get(CATALOG_URL, content=catalog(('1', 'Indicador 1'))[:-5])
+        with pytest.raises(ET.ParseError):
+            backend.inner_harvest()
+
+
+def test_content_fingerprint_is_stable():
+    fingerprint = content_fingerprint({'title': 'a', 'tags': {'x', 'y', 'z'}})
+    assert content_fingerprint({'tags': {'z', 'y', 'x'}, 'title': 'a'}) == fingerprint
+    assert content_fingerprint({'title': 'b', 'tags': {'x', 'y', 'z'}}) != fingerprint
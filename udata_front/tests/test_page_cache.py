@@ -0,0 +1,80 @@
+from flask import url_for
+
+from udata.core.dataset.factories import DatasetFactory
+from udata.core.organization.factories import OrganizationFactory
+from udata.core.reuse.factories import VisibleReuseFactory
+
+from udata_front.tests import GouvFrSettings
+from udata_front.tests.frontend import GouvfrFrontTestCase
+
+
+class PageCacheSettings(GouvFrSettings):
+    PAGE_CACHE_ENABLED = True
+    CACHE_TYPE = 'flask_caching.backends.simple'
+
+
+class PageCacheTest(GouvfrFrontTestCase):
+    settings = PageCacheSettings
+
+    def test_anonymous_page_is_cached(self):
+        '''It should serve the second anonymous hit from cache'''
+        dataset = DatasetFactory()
+        url = url_for('datasets.show', dataset=dataset)
+
+        first = self.get(url)
+        self.assert200(first)
+        self.assertEqual(first.headers['X-Page-Cache'], 'MISS')
+        self.assertIn(str(dataset.id), first.headers['Surrogate-Key'])
+
+        second = self.get(url)
+        self.assert200(second)
+        self.assertEqual(second.headers['X-Page-Cache'], 'HIT')
+
+    def test_cache_key_depends_on_query_string(self):
+        '''It should cache each query string separately'''
+        dataset = DatasetFactory()
+        self.get(url_for('datasets.show', dataset=dataset))
+        response = self.get(url_for('datasets.show', dataset=dataset, reuses_page=1))
+        self.assertEqual(response.headers['X-Page-Cache'], 'MISS')
+
+    def test_authenticated_page_is_not_cached(self):
+        '''It should never cache pages for authenticated users'''
+        self.login()
+        dataset = DatasetFactory()
+        url = url_for('datasets.show', dataset=dataset)
+        self.get(url)
+        response = self.get(url)
+        self.assert200(response)
+        self.assertNotIn('X-Page-Cache', response.headers)
+
+    def test_purge_on_save(self):
+        '''It should purge the page when the displayed object is saved'''
+        dataset = DatasetFactory()
+        url = url_for('datasets.show', dataset=dataset)
+        self.get(url)
+
+        dataset.title = 'Updated title'
+        dataset.save()
+
+        response = self.get(url)
+        self.assertEqual(response.headers['X-Page-Cache'], 'MISS')
+        self.assertIn(b'Updated title', response.data)
+
+    def test_purge_related_pages_only(self):
+        '''It should only purge pages tagged with the saved object keys'''
+        org = OrganizationFactory()
+        dataset = DatasetFactory(organization=org)
+        other = DatasetFactory()
+        reuse = VisibleReuseFactory(datasets=[dataset])
+        org_url = url_for('organizations.show', org=org)
+        dataset_url = url_for('datasets.show', dataset=dataset)
+        other_url = url_for('datasets.show', dataset=other)
+        for url in org_url, dataset_url, other_url:
+            self.get(url)
+
+        reuse.title = 'Updated title'
+        reuse.save()
+
+        self.assertEqual(self.get(dataset_url).headers['X-Page-Cache'], 'MISS')
+        self.assertEqual(self.get(org_url).headers['X-Page-Cache'], 'HIT')
+        self.assertEqual(self.get(other_url).headers['X-Page-Cache'], 'HIT')
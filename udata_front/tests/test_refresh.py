@@ -0,0 +1,121 @@
+import pytest
+
+from datetime import timedelta
+
+from udata.app import cache
+
+from udata_front import refresh
+from udata_front.tests import GouvFrSettings
+
+
+class RefreshSettings(GouvFrSettings):
+    CACHE_TYPE = 'flask_caching.backends.simple'
+    EXTERNAL_CONTENT_BREAKER_THRESHOLD = 2
+    EXTERNAL_CONTENT_WAIT = 0.3
+
+
+class Upstream(object):
+    '''A fake upstream counting its calls'''
+    def __init__(self):
+        self.calls = 0
+        self.error = None
+        self.value = 'first'
+
+    def __call__(self, arg):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return '{0}-{1}'.format(self.value, arg)
+
+
+@pytest.fixture
+def upstream(app):
+    cache.clear()
+    upstream = Upstream()
+    fetcher = refresh.refreshed('test-upstream', 60)(upstream)
+    yield upstream, fetcher
+    refresh.FETCHERS.pop('test-upstream')
+
+
+def make_stale(*args):
+    key = refresh.VALUE_KEY.format(refresh.key_of('test-upstream', args))
+    entry = cache.get(key)
+    entry['fetched_at'] -= timedelta(seconds=61)
+    cache.set(key, entry)
+
+
+class RefreshTest:
+    settings = RefreshSettings
+    modules = []
+
+    def test_fetched_once(self, upstream):
+        upstream, fetcher = upstream
+        assert fetcher('a') == 'first-a'
+        assert fetcher('a') == 'first-a'
+        assert fetcher('b') == 'first-b'
+        assert upstream.calls == 2
+
+    def test_stale_value_served_while_refreshed(self, upstream, mocker):
+        upstream, fetcher = upstream
+        delay = mocker.patch('udata_front.tasks.refresh_external_content.delay')
+        fetcher('a')
+        make_stale('a')
+        upstream.value = 'second'
+
+        assert fetcher('a') == 'first-a'
+        assert fetcher('a') == 'first-a'
+        delay.assert_called_once_with('test-upstream', ['a'])
+
+        refresh.refresh('test-upstream', ['a'])
+        assert fetcher('a') == 'second-a'
+
+    def test_failure_keeps_last_good_value(self, upstream, mocker):
+        upstream, fetcher = upstream
+        mocker.patch('udata_front.tasks.refresh_external_content.delay',
+                     side_effect=refresh.refresh)
+        fetcher('a')
+        make_stale('a')
+        upstream.error = ValueError('down')
+
+        assert fetcher('a') == 'first-a'
+        assert fetcher('a') == 'first-a'
+
+    def test_unavailable_without_value(self, upstream):
+        upstream, fetcher = upstream
+        upstream.error = ValueError('down')
+        with pytest.raises(refresh.Unavailable):
+            fetcher('a')
+
+    def test_default_without_value(self, app):
+        cache.clear()
+
+        @refresh.refreshed('test-default', 60, default='default')
+        def fetcher():
+            raise ValueError('down')
+
+        try:
+            assert fetcher() == 'default'
+        finally:
+            refresh.FETCHERS.pop('test-default')
+
+    def test_circuit_breaker(self, upstream):
+        upstream, fetcher = upstream
+        upstream.error = ValueError('down')
+        for arg in 'abcd':
+            with pytest.raises(refresh.Unavailable):
+                fetcher(arg)
+        # Upstream not called anymore once failed twice
+        assert upstream.calls == 2
+        assert refresh.is_open('test-upstream')
+
+        cache.delete(refresh.BREAKER_KEY.format('test-upstream'))
+        upstream.error = None
+        assert fetcher('a') == 'first-a'
+
+    def test_concurrent_first_fetch_coalesced(self, upstream):
+        upstream, fetcher = upstream
+        # Another worker is fetching this key
+        cache.add(refresh.LOCK_KEY.format(refresh.key_of('test-upstream', ('a',))), True)
+        with pytest.raises(refresh.Unavailable):
+            fetcher('a')
+        assert upstream.calls == 0
@@ -0,0 +1,53 @@
+import os
+import pytest
+
+from udata_front.saml_plugin import saml_govpt
+from udata_front.tests import GouvFrSettings
+
+
+def sp_settings(tmpdir):
+    metadata = tmpdir.join('metadata.xml')
+    metadata.write('<md/>')
+    return metadata, {
+        'metadata': {'local': [str(metadata)]},
+        'key_file': None,
+        'cert_file': None,
+        'service': {'sp': {'endpoints': {
+            'assertion_consumer_service': [('http://local.test/saml/sso', 'post')],
+        }}},
+    }
+
+
+@pytest.fixture
+def load_config(mocker):
+    saml_govpt._configs.clear()
+    yield mocker.patch.object(saml_govpt, 'load_config',
+                              side_effect=lambda settings: object())
+    saml_govpt._configs.clear()
+
+
+class SamlConfigCacheTest:
+    settings = GouvFrSettings
+    modules = []
+
+    def test_loaded_once(self, app, tmpdir, load_config):
+        _, settings = sp_settings(tmpdir)
+        config = saml_govpt.cached_config(settings)
+        assert saml_govpt.cached_config(settings) is config
+        assert load_config.call_count == 1
+
+    def test_reloaded_in_background_on_change(self, app, tmpdir, load_config, mocker):
+        thread = mocker.patch('threading.Thread')
+        metadata, settings = sp_settings(tmpdir)
+        config = saml_govpt.cached_config(settings)
+        stat = os.stat(str(metadata))
+        os.utime(str(metadata), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+        # Previous configuration served while reloading, a single reload started
+        assert saml_govpt.cached_config(settings) is config
+        assert saml_govpt.cached_config(settings) is config
+        assert thread.call_count == 1
+
+        saml_govpt.reload_config(*thread.call_args.kwargs['args'])
+        assert saml_govpt.cached_config(settings) is not config
+        assert thread.call_count == 1
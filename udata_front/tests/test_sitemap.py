@@ -1,3 +1,9 @@
+import gzip
+
+from flask import url_for
+from lxml import etree
+
+from udata.app import cache
 from udata.core.dataset.factories import DatasetFactory
 from udata.core.organization.factories import OrganizationFactory
 from udata.core.post.factories import PostFactory
@@ -5,6 +11,10 @@ from udata.core.reuse.factories import VisibleReuseFactory
 from udata.core.spatial.factories import GeoZoneFactory
 from udata.core.topic.factories import TopicFactory
 
+from udata.tests.helpers import assert200, assert404
+from udata.tests.plugin import SitemapClient
+
+from udata_front import sitemaps
 from udata_front.tests import GouvFrSettings
 
 
@@ -116,3 +126,57 @@ class SitemapTest:
         sitemap.assert_url(url, 1, 'daily')
         loc = url.xpath('s:loc', namespaces=sitemap.NAMESPACES)[0].text
         assert loc.startswith('https://')
+
+
+class SitemapBuildSettings(GouvFrSettings):
+    CACHE_TYPE = 'flask_caching.backends.simple'
+    SITEMAP_SHARD_SIZE = 2
+
+
+class SitemapBuildTest:
+    settings = SitemapBuildSettings
+    modules = []
+
+    def shard_urls(self, client, source, page):
+        response = client.get(url_for('site.sitemap_shard', source=source, page=page))
+        assert200(response)
+        urlset = etree.fromstring(gzip.decompress(response.data))
+        return [loc.text for loc in urlset.xpath('//s:loc', namespaces=SitemapClient.NAMESPACES)]
+
+    def test_build_shards_and_index(self, client, sitemap):
+        '''It should serve the built index and split sources into shards'''
+        cache.clear()
+        datasets = DatasetFactory.create_batch(3)
+
+        sitemaps.build()
+
+        index = sitemap.fetch()
+        assert index.tag.endswith('sitemapindex')
+        assert url_for('site.sitemap_shard', source='datasets', page=2,
+                       _external=True) in sitemap.xpath('s:sitemap/s:loc/text()')
+        urls = (self.shard_urls(client, 'datasets', 1)
+                + self.shard_urls(client, 'datasets', 2))
+        assert urls == [url_for('datasets.show_redirect', dataset=d, _external=True)
+                        for d in datasets]
+
+    def test_build_only_rewrites_modified_shards(self, mocker):
+        '''It should only rewrite the shards holding modified documents'''
+        cache.clear()
+        first, second, third = DatasetFactory.create_batch(3)
+        sitemaps.build()
+
+        write_range = mocker.spy(sitemaps, 'write_range')
+        sitemaps.build()
+        assert not [c for c in write_range.call_args_list if c.args[0].name == 'datasets']
+
+        third.title = 'Modified'
+        third.save()
+        sitemaps.build()
+        calls = [c for c in write_range.call_args_list if c.args[0].name == 'datasets']
+        assert len(calls) == 1
+        assert calls[0].args[1] == third.id
+
+    def test_unknown_shard(self, client):
+        '''It should return a 404 on a shard which was not built'''
+        cache.clear()
+        assert404(client.get(url_for('site.sitemap_shard', source='datasets', page=1)))
@@ -1,12 +1,23 @@
+import frontmatter
+import io
 import pytest
 import requests
+import tarfile
+
+from datetime import timedelta
 
 from flask import url_for
+from mongoengine.context_managers import query_counter
 
 from udata.app import cache
 from udata.core.dataset.factories import DatasetFactory
+from udata.core.dataset.models import Dataset
 from udata.core.reuse.factories import ReuseFactory
-from udata_front.views.gouvfr import get_pages_gh_urls, detect_pages_extension
+from udata_front import pages, refresh
+from udata_front.views.gouvfr import (
+    PAGE_CACHE_DURATION, detect_pages_extension, get_objects, get_pages_gh_urls,
+    render_page_body,
+)
 from udata_front.tests import GouvFrSettings
 
 
@@ -36,22 +47,6 @@ class StaticPagesTest:
         response = client.get(url_for('gouvfr.show_page', slug='doesnotexist/'))
         assert response.status_code == 503
 
-    def test_page_error_w_cache(self, client, rmock, mocker):
-        cache_mock_set = mocker.patch.object(cache, 'set')
-        mocker.patch.object(cache, 'get', return_value='dummy_from_cache')
-        raw_url, gh_url = get_pages_gh_urls('cache1')
-        # fill cache
-        rmock.head(f'{raw_url}.md', status_code=200)
-        rmock.get(f'{raw_url}.md', text="""#test""")
-        response = client.get(url_for('gouvfr.show_page', slug='cache1/'))
-        assert cache_mock_set.called
-        rmock.head(f'{raw_url}.md', status_code=500)
-        rmock.get(f'{raw_url}.html', status_code=500)
-        response = client.get(url_for('gouvfr.show_page', slug='cache1/'))
-        assert response.status_code == 200
-        assert b'dummy_from_cache' in response.data
-        assert rmock.call_count == 4
-
     def test_page_error_empty_cache(self, client, rmock, mocker):
         mocker.patch.object(cache, 'get', return_value=None)
         raw_url, _ = get_pages_gh_urls('cache1')
@@ -134,3 +129,127 @@ reuses:
         response = client.get(url_missing_trailing_slash)
         assert response.status_code == 302
         assert response.location == url_missing_trailing_slash + '/'
+
+
+class StaticPagesCacheSettings(GouvFrSettings):
+    CACHE_TYPE = 'flask_caching.backends.simple'
+
+
+@pytest.mark.usefixtures('clean_db')
+class StaticPagesCacheTest:
+    settings = StaticPagesCacheSettings
+    modules = []
+
+    def test_page_error_w_cache(self, client, rmock, mocker):
+        cache.clear()
+        mocker.patch('udata_front.tasks.refresh_external_content.delay',
+                     side_effect=refresh.refresh)
+        raw_url, gh_url = get_pages_gh_urls('cache1')
+        # fill cache
+        rmock.head(f'{raw_url}.md', status_code=200)
+        rmock.get(f'{raw_url}.md', text="""cached content""")
+        response = client.get(url_for('gouvfr.show_page', slug='cache1/'))
+        assert response.status_code == 200
+
+        key = refresh.VALUE_KEY.format(refresh.key_of('pages', ('cache1',)))
+        entry = cache.get(key)
+        entry['fetched_at'] -= timedelta(seconds=PAGE_CACHE_DURATION + 1)
+        cache.set(key, entry)
+        rmock.head(f'{raw_url}.md', status_code=500)
+        rmock.get(f'{raw_url}.html', status_code=500)
+        response = client.get(url_for('gouvfr.show_page', slug='cache1/'))
+        assert response.status_code == 200
+        assert b'cached content' in response.data
+        assert rmock.call_count == 4
+
+    def test_page_served_from_cache(self, client, rmock):
+        cache.clear()
+        raw_url, gh_url = get_pages_gh_urls('cache2')
+        rmock.head(f'{raw_url}.md', status_code=200)
+        rmock.get(f'{raw_url}.md', text="""cached content""")
+        for _ in range(2):
+            response = client.get(url_for('gouvfr.show_page', slug='cache2/'))
+            assert response.status_code == 200
+        assert rmock.call_count == 2
+
+    def test_objects_resolved_in_batch(self, app):
+        datasets = DatasetFactory.create_batch(3)
+        with query_counter() as queries:
+            resolved = get_objects(Dataset, [
+                datasets[0].slug, str(datasets[1].id), 'unknown', datasets[2].slug,
+            ])
+        assert queries == 2
+        assert resolved == datasets
+
+    def test_page_body_cached_until_objects_change(self, app):
+        cache.clear()
+        dataset = DatasetFactory()
+        page = frontmatter.loads(f"""---
+datasets:
+  - {dataset.slug}
+---
+# test
+""")
+        with app.test_request_context('/'):
+            assert dataset.title in render_page_body(page, 'md')
+
+            with query_counter() as queries:
+                render_page_body(page, 'md')
+            assert queries == 0
+
+            dataset.title = 'A new title'
+            dataset.save()
+            assert 'A new title' in render_page_body(page, 'md')
+
+
+def make_archive(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        for name, content in files.items():
+            data = content.encode('utf-8')
+            info = tarfile.TarInfo(f'docs-0123abc/{name}')
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+@pytest.mark.usefixtures('clean_db')
+class StaticPagesMirrorTest:
+    settings = StaticPagesCacheSettings
+    modules = []
+
+    @pytest.fixture
+    def mirror(self, app, rmock):
+        cache.clear()
+        url = pages.ARCHIVE_URL.format(repo=app.config['PAGES_GH_REPO_NAME'],
+                                       branch=app.config['PAGES_REPO_BRANCH'])
+        rmock.get(url, content=make_archive({
+            'pages/test.md': '---\ntitle: Test\n---\n# test',
+            'pages/test.html': '<h1>ignored</h1>',
+            'pages/faqs/reuse.html': '<h1>reuse</h1>',
+            'README.md': '# readme',
+        }))
+        return pages.sync()
+
+    def test_sync_manifest(self, mirror):
+        assert sorted(mirror['pages']) == ['faqs/reuse', 'test']
+        assert mirror['pages']['test']['extension'] == 'md'
+        assert mirror['pages']['test']['metadata'] == {'title': 'Test'}
+        assert mirror['pages']['faqs/reuse']['extension'] == 'html'
+
+    def test_page_rendered_from_mirror(self, client, rmock, mirror):
+        rmock.reset_mock()
+        response = client.get(url_for('gouvfr.show_page', slug='test/'))
+        assert response.status_code == 200
+        assert b'<h1>test</h1>' in response.data
+
+        response = client.get(url_for('gouvfr.show_page', slug='faqs/reuse/'))
+        assert response.status_code == 200
+        assert b'<h1>reuse</h1>' in response.data
+        assert rmock.call_count == 0
+
+    def test_page_not_in_mirror(self, client, rmock, mirror):
+        rmock.reset_mock()
+        response = client.get(url_for('gouvfr.show_page', slug='doesnotexist/'))
+        assert response.status_code == 404
+        assert rmock.call_count == 0
@@ -1,12 +1,20 @@
 import copy
 import pytest
 
+from bson import ObjectId
+
 from flask import current_app
 
 from udata.core.dataset.factories import DatasetFactory
+from udata.core.organization.factories import OrganizationFactory
+from udata.core.user.factories import UserFactory
+from udata.models import Follow
 from udata_front import APIGOUVFR_EXTRAS_KEY
+from udata_front.models import Follower, OrganizationStats
 from udata_front.tests import GouvFrSettings
-from udata_front.tasks import apigouvfr_load_apis
+from udata_front.tasks import (
+    apigouvfr_load_apis, index_followers, reconcile_organization_stats,
+)
 
 
 @pytest.mark.usefixtures('clean_db')
@@ -37,3 +45,44 @@ class ApiGouvFrTasksTest:
         apigouvfr_load_apis()
         dataset.reload()
         assert dataset.extras.get(APIGOUVFR_EXTRAS_KEY) == apis
+
+
+@pytest.mark.usefixtures('clean_db')
+class OrganizationStatsTasksTest:
+    settings = GouvFrSettings
+    modules = []
+
+    def test_reconcile_organization_stats(self):
+        org = OrganizationFactory()
+        DatasetFactory.create_batch(2, organization=org)
+        DatasetFactory(organization=org, private=True)
+        OrganizationStats.objects.create(organization=org.id, datasets=42)
+
+        reconcile_organization_stats()
+
+        stats = OrganizationStats.objects.get(organization=org.id)
+        assert stats.datasets == 3
+        assert stats.visible_datasets == 2
+        assert stats.reuses == 0
+
+
+@pytest.mark.usefixtures('clean_db')
+class FollowersTasksTest:
+    settings = GouvFrSettings
+    modules = []
+
+    def test_index_followers(self):
+        dataset = DatasetFactory()
+        follow = Follow.objects.create(follower=UserFactory(first_name='Alice'),
+                                       following=dataset)
+        Follow.objects.create(follower=UserFactory(), following=dataset)
+        Follower.objects.delete()
+        Follower.objects.create(follow=ObjectId(), following=dataset.id,
+                                following_type='Dataset', follower=follow.follower)
+
+        index_followers()
+
+        assert Follower.objects(following=dataset.id).count() == 2
+        follower = Follower.objects.get(follow=follow.id)
+        assert follower.following_type == 'Dataset'
+        assert follower.follower_name.startswith('alice')
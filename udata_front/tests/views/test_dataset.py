@@ -1,12 +1,18 @@
+import time
+
 from datetime import datetime
+from unittest import mock
 
 import feedparser
 
 from flask import url_for
+from mongoengine.context_managers import query_counter
 
+from udata.core.dataservices.factories import DataserviceFactory
 from udata.core.dataset.factories import (
     ResourceFactory, DatasetFactory, LicenseFactory, CommunityResourceFactory,
 )
+from udata.core.reuse.factories import VisibleReuseFactory
 from udata.core.user.factories import UserFactory
 from udata.core.organization.factories import OrganizationFactory
 from udata.models import Follow
@@ -133,6 +139,77 @@ class DatasetBlueprintTest(GouvfrFrontTestCase):
         self.assertEqual(json_ld['description'],
                          'an &lt;script&gt;evil()&lt;/script&gt;')
 
+    def test_render_display_reuses_and_dataservices(self):
+        '''It should paginate reuses and dataservices with their totals'''
+        dataset = DatasetFactory()
+        VisibleReuseFactory.create_batch(3, datasets=[dataset])
+        DataserviceFactory.create_batch(2, datasets=[dataset])
+        response = self.get(url_for('datasets.show', dataset=dataset))
+        self.assert200(response)
+        self.assertEqual(self.get_context_variable('total_reuses'), 3)
+        self.assertEqual(self.get_context_variable('total_dataservices'), 2)
+        self.assertEqual(len(self.get_context_variable('reuses')), 3)
+        self.assertEqual(len(self.get_context_variable('dataservices')), 2)
+
+    def test_render_display_fixed_number_of_queries(self):
+        '''It should not issue more queries when reuses and dataservices grow'''
+        dataset = DatasetFactory()
+        url = url_for('datasets.show', dataset=dataset)
+        VisibleReuseFactory(datasets=[dataset])
+        DataserviceFactory(datasets=[dataset])
+        self.get(url)  # Warm up lazy initializations
+
+        with query_counter() as counter:
+            self.assert200(self.get(url))
+            expected = int(counter)
+
+        VisibleReuseFactory.create_batch(5, datasets=[dataset])
+        DataserviceFactory.create_batch(5, datasets=[dataset])
+
+        with query_counter() as counter:
+            self.assert200(self.get(url))
+            self.assertEqual(int(counter), expected)
+
+    def test_render_display_conditional_get(self):
+        '''It should answer 304 when validators match and 200 once modified'''
+        dataset = DatasetFactory()
+        url = url_for('datasets.show', dataset=dataset)
+        response = self.get(url)
+        self.assert200(response)
+        etag = response.headers['ETag']
+        # A date can't reflect the embedded CSRF token
+        self.assertIsNone(response.headers.get('Last-Modified'))
+
+        response = self.get(url, headers={'If-None-Match': etag})
+        self.assertStatus(response, 304)
+        self.assertEqual(response.data, b'')
+
+        dataset.title = 'Updated title'
+        dataset.save()
+        response = self.get(url, headers={'If-None-Match': etag})
+        self.assert200(response)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_render_display_conditional_get_csrf_window(self):
+        '''It should not answer 304 once the embedded CSRF token could have expired'''
+        dataset = DatasetFactory()
+        url = url_for('datasets.show', dataset=dataset)
+        limit = self.app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+        now = time.time() // limit * limit
+        with mock.patch('udata_front.views.base.time.time', return_value=now):
+            etag = self.get(url).headers['ETag']
+            self.assertStatus(self.get(url, headers={'If-None-Match': etag}), 304)
+        with mock.patch('udata_front.views.base.time.time', return_value=now + limit):
+            self.assert200(self.get(url, headers={'If-None-Match': etag}))
+
+    def test_conditional_get_checks_visibility_first(self):
+        '''It should not answer 304 for a private or deleted dataset'''
+        private = DatasetFactory(private=True)
+        deleted = DatasetFactory(deleted=datetime.utcnow())
+        headers = {'If-None-Match': '*', 'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'}
+        self.assert404(self.get(url_for('datasets.show', dataset=private), headers=headers))
+        self.assert410(self.get(url_for('datasets.show', dataset=deleted), headers=headers))
+
     def test_raise_404_if_private(self):
         '''It should raise a 404 if the dataset is private'''
         dataset = DatasetFactory(private=True)
@@ -215,6 +292,20 @@ class DatasetBlueprintTest(GouvfrFrontTestCase):
             prev_published_date = feed.entries[i - 1].published_parsed
             self.assertGreaterEqual(prev_published_date, published_date)
 
+    def test_recent_feed_conditional_get(self):
+        DatasetFactory(resources=[ResourceFactory()])
+        response = self.get(url_for('datasets.recent_feed'))
+        self.assert200(response)
+
+        response = self.get(url_for('datasets.recent_feed'),
+                            headers={'If-None-Match': response.headers['ETag']})
+        self.assertStatus(response, 304)
+
+        DatasetFactory(resources=[ResourceFactory()])
+        response = self.get(url_for('datasets.recent_feed'),
+                            headers={'If-None-Match': response.headers['ETag']})
+        self.assert200(response)
+
     def test_recent_feed_owner(self):
         owner = UserFactory()
         DatasetFactory(owner=owner, resources=[ResourceFactory()])
@@ -266,3 +357,24 @@ class DatasetBlueprintTest(GouvfrFrontTestCase):
         self.assert200(response)
         rendered_followers = self.get_context_variable('followers')
         self.assertEqual(len(rendered_followers), len(followers))
+
+    def test_dataset_followers_paginated_by_name(self):
+        '''It should paginate the dataset followers sorted by name'''
+        dataset = DatasetFactory()
+        for name in 'Delta', 'alpha', 'Charlie', 'bravo':
+            Follow.objects.create(follower=UserFactory(first_name=name),
+                                  following=dataset)
+        Follow.objects.create(follower=UserFactory(), following=dataset,
+                              until=datetime.utcnow())
+
+        response = self.get(url_for('datasets.followers', dataset=dataset))
+
+        self.assert200(response)
+        rendered_followers = self.get_context_variable('followers')
+        self.assertEqual(rendered_followers.total, 4)
+        names = [f.follower.first_name for f in rendered_followers]
+        self.assertEqual(names, ['alpha', 'bravo', 'Charlie', 'Delta'])
+
+        response = self.get(url_for('datasets.followers', dataset=dataset,
+                                    page=2))
+        self.assert404(response)
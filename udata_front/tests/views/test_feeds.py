@@ -0,0 +1,61 @@
+import feedparser
+import pytest
+
+from flask import url_for
+
+from udata.app import cache
+from udata.core.dataset.activities import UserCreatedDataset, UserUpdatedDataset
+from udata.core.dataset.factories import DatasetFactory, ResourceFactory
+from udata.core.site.models import current_site
+from udata.core.user.factories import UserFactory
+
+from udata_front.tests import GouvFrSettings
+from udata_front.tests.frontend import GouvfrFrontTestCase
+from udata_front.views import dataset as dataset_views
+
+
+class FeedCacheSettings(GouvFrSettings):
+    CACHE_TYPE = 'flask_caching.backends.simple'
+
+
+class CachedFeedTest(GouvfrFrontTestCase):
+    settings = FeedCacheSettings
+
+    @pytest.fixture(autouse=True)
+    def inject_mocker(self, mocker):
+        self.mocker = mocker
+
+    def test_only_new_entries_are_rendered(self):
+        '''It should only render entries which are not cached yet'''
+        cache.clear()
+        DatasetFactory.create_batch(2, resources=[ResourceFactory()])
+        self.assert200(self.get(url_for('datasets.recent_feed')))
+
+        new = DatasetFactory(resources=[ResourceFactory()])
+        feed_entry = self.mocker.spy(dataset_views, 'feed_entry')
+
+        response = self.get(url_for('datasets.recent_feed'))
+
+        self.assert200(response)
+        self.assertEqual(feed_entry.call_count, 1)
+        self.assertEqual(feed_entry.call_args.args[0].id, new.id)
+        feed = feedparser.parse(response.data)
+        self.assertEqual(len(feed.entries), 3)
+        self.assertEqual(feed.entries[0].title, new.title)
+
+    def test_activity_feed_filters_keys_in_query(self):
+        '''It should fill the activity feed with activities matching the keys'''
+        user = UserFactory()
+        dataset = DatasetFactory()
+        created = [UserCreatedDataset.objects.create(actor=user, related_to=dataset)
+                   for _ in range(2)]
+        for _ in range(current_site.feed_size):
+            UserUpdatedDataset.objects.create(actor=user, related_to=dataset)
+
+        response = self.get(url_for('site.activity_feed', key='dataset:created'))
+
+        self.assert200(response)
+        feed = feedparser.parse(response.data)
+        self.assertEqual(len(feed.entries), len(created))
+        for entry in feed.entries:
+            self.assertTrue(entry.title.startswith('dataset:created by'))
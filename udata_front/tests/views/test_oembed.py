@@ -2,8 +2,11 @@ import copy
 import pytest
 
 from flask import url_for
+from mongoengine.context_managers import query_counter
 
 from udata_front import theme
+from udata.app import cache
+from udata.core.dataset.models import Dataset
 from udata.core.dataset.factories import DatasetFactory
 from udata.core.reuse.factories import ReuseFactory
 from udata.core.spatial.factories import GeoZoneFactory
@@ -161,6 +164,41 @@ class OEmbedAPITest:
         assert response.json['message'] == 'Only JSON format is supported'
 
 
+class OEmbedCacheSettings(GouvFrSettings):
+    CACHE_TYPE = 'flask_caching.backends.simple'
+
+
+class OEmbedAPICacheTest:
+    settings = OEmbedCacheSettings
+    modules = []
+
+    def test_oembed_served_from_cache(self, api):
+        '''It should serve a known URL without resolving its object again.'''
+        cache.clear()
+        dataset = DatasetFactory()
+        url = url_for('api.oembed', url=dataset.external_url)
+        assert200(api.get(url))
+
+        # Bypass signals: the cached payload is still considered fresh
+        Dataset._get_collection().delete_one({'_id': dataset.id})
+        response = api.get(url)
+        assert200(response)
+        assert dataset.title in response.json['html']
+
+    def test_oembed_cache_invalidated_on_save(self, api):
+        '''It should render the payload again once the object is saved.'''
+        cache.clear()
+        dataset = DatasetFactory()
+        url = url_for('api.oembed', url=dataset.external_url)
+        assert200(api.get(url))
+
+        dataset.title = 'Modified'
+        dataset.save()
+        response = api.get(url)
+        assert200(response)
+        assert 'Modified' in response.json['html']
+
+
 def territory_dataset_factory():
     org = OrganizationFactory()
 
@@ -230,6 +268,41 @@ class OEmbedsDatasetAPITest:
         assert organization.name in data['html']
         assert organization.external_url in data['html']
 
+    def test_oembeds_dataset_api_get_many(self, api):
+        '''It should resolve many datasets with a fixed number of queries.'''
+        def get(datasets):
+            references = ','.join('dataset-{0}'.format(d.id) for d in datasets)
+            url = url_for('api.oembeds', references=references)
+            with query_counter() as counter:
+                response = api.get(url, headers={'Origin': 'http://localhost'})
+                assert200(response)
+                return response, int(counter)
+
+        _, expected = get(DatasetFactory.create_batch(1))
+        datasets = DatasetFactory.create_batch(5)
+        response, count = get(datasets)
+
+        assert count == expected
+        assert [d.title in data['html'] for d, data in zip(datasets, response.json)] == [True] * 5
+
+    def test_oembeds_dataset_api_get_not_modified(self, api):
+        '''It should answer 304 until one of the datasets is modified.'''
+        dataset = DatasetFactory()
+        url = url_for('api.oembeds',
+                      references='dataset-{id}'.format(id=dataset.id))
+        response = api.get(url)
+        assert200(response)
+        etag = response.headers['ETag']
+
+        response = api.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 304
+
+        dataset.title = 'Modified'
+        dataset.save()
+        response = api.get(url, headers={'If-None-Match': etag})
+        assert200(response)
+        assert 'Modified' in response.json[0]['html']
+
     def test_oembeds_dataset_api_get_without_references(self, api):
         '''It should fail at fetching an oembed without a dataset.'''
         response = api.get(url_for('api.oembeds'))
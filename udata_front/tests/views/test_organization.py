@@ -1,7 +1,9 @@
 import pytest
 from io import StringIO
 
-from flask import url_for
+from flask import g, url_for
+from flask_login import login_user
+from mongoengine.context_managers import query_counter
 
 from udata.models import Organization, Member, Follow
 from udata.core.organization.constants import CERTIFIED, PUBLIC_SERVICE
@@ -16,9 +18,12 @@ from udata.core.user.factories import UserFactory, AdminFactory
 from udata.tests.helpers import capture_mails
 
 
+from udata_front.models import OrganizationStats
 from udata_front.tests import GouvFrSettings
 from udata_front.tests.frontend import GouvfrFrontTestCase
-from udata_front.views.organization import OrganizationDetailView
+from udata_front.views.organization import (
+    OrganizationDetailView, set_g_user_orgs, user_organizations,
+)
 
 pytestmark = [
     pytest.mark.usefixtures('clean_db'),
@@ -222,8 +227,32 @@ class OrganizationBlueprintTest(GouvfrFrontTestCase):
         response = self.get(url_for('organizations.show', org=org))
         self.assert200(response)
 
-        rendered_followers = self.get_context_variable('followers')
-        self.assertEqual(len(rendered_followers), len(followers))
+        total_followers = self.get_context_variable('total_followers')
+        self.assertEqual(total_followers, len(followers))
+
+    def test_render_display_with_materialized_stats(self):
+        '''It should render counters from the materialized organization stats'''
+        organization = OrganizationFactory()
+        DatasetFactory(organization=organization)
+        VisibleReuseFactory(organization=organization)
+        self.get(url_for('organizations.show', org=organization))
+
+        # Stats now exist and are incrementally updated
+        DatasetFactory(organization=organization, private=True)
+        VisibleReuseFactory(organization=organization)
+        Follow.objects.create(follower=UserFactory(), following=organization)
+
+        stats = OrganizationStats.objects.get(organization=organization.id)
+        self.assertEqual(stats.datasets, 2)
+        self.assertEqual(stats.visible_datasets, 1)
+        self.assertEqual(stats.visible_reuses, 2)
+        self.assertEqual(stats.followers, 1)
+
+        response = self.get(url_for('organizations.show', org=organization))
+        self.assert200(response)
+        self.assertEqual(self.get_context_variable('organization_datasets'), 1)
+        self.assertEqual(self.get_context_variable('total_reuses'), 2)
+        self.assertEqual(self.get_context_variable('total_followers'), 1)
 
     def test_not_found(self):
         '''It should render the organization page'''
@@ -239,6 +268,7 @@ class OrganizationBlueprintTest(GouvfrFrontTestCase):
         self.assertIn(b'<meta name="robots" content="noindex, nofollow"',
                       response.data)
 
+
 class OrganizationBadgeAPITest:
     settings = GouvFrSettings
     modules = []
@@ -285,3 +315,43 @@ class OrganizationBadgeAPITest:
         assert len(mails) == len(members_emails)
         assert [m.recipients[0] for m in mails] == members_emails
 
+
+class UserOrganizationsCacheSettings(GouvFrSettings):
+    CACHE_TYPE = 'flask_caching.backends.simple'
+
+
+class UserOrganizationsTest:
+    settings = UserOrganizationsCacheSettings
+    modules = []
+
+    def test_user_organizations_cached_until_membership_changes(self, app):
+        user = UserFactory()
+        org = OrganizationFactory(members=[Member(user=user, role='admin')])
+        other = OrganizationFactory()
+
+        with app.test_request_context('/'):
+            login_user(user)
+            assert user_organizations() == [org]
+
+            with query_counter() as queries:
+                assert user_organizations() == [org]
+            assert queries == 0
+
+            other.members.append(Member(user=user, role='editor'))
+            other.save()
+            assert sorted(o.id for o in user_organizations()) == sorted([org.id, other.id])
+
+            # Members pulled without saving are seen once members are counted
+            Organization.objects(id=org.id).update_one(pull__members__user=user.id)
+            org.reload()
+            org.count_members()
+            assert user_organizations() == [other]
+
+    def test_user_organizations_lazy(self, app):
+        user = UserFactory()
+        with app.test_request_context('/'):
+            login_user(user)
+            with query_counter() as queries:
+                set_g_user_orgs()
+            assert queries == 0
+            assert list(g.user_organizations) == []
@@ -1,14 +1,19 @@
 
 import pytest
 
+from datetime import datetime, timedelta
+
 from flask import url_for
 
 from udata.models import Site
 
 from udata.core.dataset.factories import DatasetFactory
 from udata.core.organization.factories import OrganizationFactory
+from udata.app import cache
+from udata.core.post.factories import PostFactory
 from udata.core.site.models import current_site
 from udata.core.reuse.factories import ReuseFactory
+from udata_front import home
 from udata_front.tests import GouvFrSettings
 from udata_front.tests.frontend import GouvfrFrontTestCase
 
@@ -81,4 +86,41 @@ class SiteViewsTest(GouvfrFrontTestCase):
 
     def test_terms_view(self):
         response = self.client.get(url_for('site.terms'))
-        self.assert200(response)
\ No newline at end of file
+        self.assert200(response)
+
+
+class HomeSnapshotSettings(GouvFrSettings):
+    CACHE_TYPE = 'flask_caching.backends.simple'
+
+
+@pytest.mark.usefixtures('clean_db')
+class HomeSnapshotTest:
+    settings = HomeSnapshotSettings
+    modules = []
+
+    def test_home_rendered_from_snapshot(self, client, mocker):
+        cache.clear()
+        delay = mocker.patch('udata_front.tasks.build_home_snapshot.delay')
+        assert client.get(url_for('site.home', lang_code='en')).status_code == 200
+
+        post = PostFactory(published=datetime.utcnow())
+        response = client.get(url_for('site.home', lang_code='en'))
+        assert response.status_code == 200
+        assert post.name not in response.data.decode('utf-8')
+        delay.assert_not_called()
+
+    def test_stale_snapshot_served_while_rebuilt(self, app, client, mocker):
+        cache.clear()
+        delay = mocker.patch('udata_front.tasks.build_home_snapshot.delay')
+        snapshot = home.build('en')
+        snapshot['built_at'] -= timedelta(seconds=app.config['HOME_SNAPSHOT_MAX_AGE'] + 1)
+        cache.set(home.SNAPSHOT_KEY.format('en'), snapshot)
+
+        for _ in range(2):
+            assert client.get(url_for('site.home', lang_code='en')).status_code == 200
+        delay.assert_called_once_with('en')
+
+        post = PostFactory(published=datetime.utcnow())
+        home.build('en')
+        response = client.get(url_for('site.home', lang_code='en'))
+        assert post.name in response.data.decode('utf-8')
@@ -4,12 +4,15 @@ from flask import url_for
 from udata.core.dataset.factories import DatasetFactory
 from udata.core.organization.factories import OrganizationFactory
 from udata.core.spatial.factories import SpatialCoverageFactory
+from udata.app import cache
 from udata.models import Member
 from udata.tests.features.territories import (
     create_geozones_fixtures, create_old_new_regions_fixtures,
     TerritoriesSettings
 )
+from udata_front import territories
 from udata_front.tests.frontend import GouvfrFrontTestCase
+from udata_front.views.territories import TERRITORY_COUNTS_KEY
 
 
 class GouvFrTerritoriesSettings(TerritoriesSettings):
@@ -412,3 +415,124 @@ class TerritoriesGenTest(GouvfrFrontTestCase):
         response = self.client.get(
             url_for('territories.territory', territory=self.paca))
         self.assert404(response)  # By default regions are deactivated.
+
+
+class TerritoriesHomeSettings(GouvFrTerritoriesSettings):
+    HANDLED_LEVELS = ('fr:commune', 'fr:departement', 'fr:region')
+    CACHE_TYPE = 'flask_caching.backends.simple'
+
+
+class TerritoriesHomeTest(GouvfrFrontTestCase):
+    modules = []
+    settings = TerritoriesHomeSettings
+
+    def setUp(self):
+        self.lr, self.occitanie = create_old_new_regions_fixtures()
+        self.paca = create_geozones_fixtures()[0]
+
+    def test_home_lists_prebuilt_regions(self):
+        built = territories.build_level('fr:region', 'en')
+        self.paca.delete()  # Only the prebuilt regions are listed
+
+        response = self.get(url_for('territories.home'))
+
+        self.assert200(response)
+        regions = self.get_context_variable('regions')
+        self.assertEqual([region['name'] for region in regions],
+                         [self.lr.name, self.occitanie.name, self.paca.name])
+        self.assertEqual(self.get_context_variable('geojson_url'),
+                         url_for('territories.geojson', level='fr:region',
+                                 v=built['hash']))
+
+    def test_geojson(self):
+        built = territories.build_level('fr:region', 'en')
+
+        response = self.get(url_for('territories.geojson', level='fr:region',
+                                    v=built['hash']))
+
+        self.assert200(response)
+        self.assertEqual(response.content_type, 'application/geo+json')
+        self.assertTrue(response.cache_control.immutable)
+        ids = [feature['id'] for feature in response.json['features']]
+        self.assertEqual(ids, [self.lr.id, self.occitanie.id, self.paca.id])
+
+        response = self.get(url_for('territories.geojson', level='fr:region'),
+                            headers={'If-None-Match': built['hash']})
+        self.assertStatus(response, 304)
+
+    def test_geojson_versioned_public_when_authenticated(self):
+        built = territories.build_level('fr:region', 'en')
+        self.login()
+
+        response = self.get(url_for('territories.geojson', level='fr:region',
+                                    v=built['hash']))
+
+        self.assert200(response)
+        self.assertTrue(response.cache_control.public)
+        self.assertFalse(response.cache_control.private)
+
+    def test_geojson_unhandled_level(self):
+        response = self.get(url_for('territories.geojson', level='country'))
+        self.assert404(response)
+
+
+class TerritoryDatasetsTest(GouvfrFrontTestCase):
+    modules = []
+    settings = TerritoriesHomeSettings
+
+    def setUp(self):
+        self.paca = create_geozones_fixtures()[0]
+
+    def test_split_and_count_datasets(self):
+        organization = OrganizationFactory(zone=self.paca.id)
+        DatasetFactory.create_batch(
+            2, organization=organization,
+            spatial=SpatialCoverageFactory(zones=[self.paca.id]))
+        DatasetFactory.create_batch(
+            3, organization=OrganizationFactory(),
+            spatial=SpatialCoverageFactory(zones=[self.paca.id]))
+        DatasetFactory(organization=organization)
+
+        response = self.get(url_for('territories.territory', territory=self.paca))
+
+        self.assert200(response)
+        self.assertEqual(len(self.get_context_variable('territory_datasets')), 2)
+        self.assertEqual(len(self.get_context_variable('other_datasets')), 3)
+        self.assertEqual(self.get_context_variable('territory_datasets_count'), 2)
+        self.assertEqual(self.get_context_variable('datasets').total, 5)
+
+        # Counts are cached until a dataset of the territory changes
+        key = TERRITORY_COUNTS_KEY.format(self.paca.id)
+        self.assertEqual(cache.get(key), {True: 2, False: 3})
+        DatasetFactory(spatial=SpatialCoverageFactory(zones=[self.paca.id]))
+        self.assertIsNone(cache.get(key))
+        response = self.get(url_for('territories.territory', territory=self.paca))
+        self.assertEqual(self.get_context_variable('datasets').total, 6)
+
+    def test_cached_counts(self):
+        DatasetFactory(spatial=SpatialCoverageFactory(zones=[self.paca.id]))
+        cache.set(TERRITORY_COUNTS_KEY.format(self.paca.id), {True: 4, False: 3})
+
+        response = self.get(url_for('territories.territory', territory=self.paca))
+
+        self.assert200(response)
+        self.assertEqual(self.get_context_variable('territory_datasets_count'), 4)
+        self.assertEqual(self.get_context_variable('datasets').total, 7)
+
+    def test_organization_changes_expire_counts(self):
+        organization = OrganizationFactory()
+        DatasetFactory(organization=organization,
+                       spatial=SpatialCoverageFactory(zones=[self.paca.id]))
+        self.get(url_for('territories.territory', territory=self.paca))
+        self.assertEqual(self.get_context_variable('territory_datasets_count'), 0)
+
+        organization.zone = self.paca.id
+        organization.save()
+
+        self.get(url_for('territories.territory', territory=self.paca))
+        self.assertEqual(self.get_context_variable('territory_datasets_count'), 1)
+
+    def test_out_of_range_page(self):
+        response = self.get(url_for('territories.territory', territory=self.paca,
+                                    page=2))
+        self.assert404(response)
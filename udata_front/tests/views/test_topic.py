@@ -1,3 +1,14 @@
+import pytest
+
+from flask import g
+from mongoengine.context_managers import query_counter
+
+from udata.app import cache
+from udata.core.topic.factories import TopicFactory
+from udata.core.topic.models import Topic
+from udata_front.tests import GouvFrSettings
+from udata_front.views.topic import featured_topics, store_featured_topics
+
 # from flask import url_for
 
 # from udata.core.dataset.factories import DatasetFactory
@@ -99,3 +110,40 @@
 #         url = url_for('topics.reuses', topic=topic, qs={'topic': 'whatever'})
 #         response = self.get(url)
 #         self.assert200(response)
+
+
+class FeaturedTopicsSettings(GouvFrSettings):
+    CACHE_TYPE = 'flask_caching.backends.simple'
+
+
+@pytest.mark.usefixtures('clean_db')
+class FeaturedTopicsTest:
+    settings = FeaturedTopicsSettings
+    modules = []
+
+    def test_featured_topics_cached_until_a_topic_changes(self, app):
+        cache.clear()
+        TopicFactory(featured=True, name='b')
+        TopicFactory(featured=True, name='a')
+        TopicFactory(featured=False, name='d')
+
+        assert [topic.name for topic in featured_topics()] == ['a', 'b']
+        with query_counter() as queries:
+            featured_topics()
+        assert queries == 0
+
+        # Bypass signals: the process-local topics are still up to date
+        Topic._get_collection().update_many({}, {'$set': {'featured': True}})
+        assert len(featured_topics()) == 2
+
+        TopicFactory(featured=True, name='c')
+        assert [topic.name for topic in featured_topics()] == ['a', 'b', 'c', 'd']
+
+    def test_featured_topics_fetched_on_use(self, app):
+        cache.clear()
+        TopicFactory(featured=True)
+        with app.test_request_context('/'):
+            with query_counter() as queries:
+                store_featured_topics()
+            assert queries == 0
+            assert len(g.featured_topics) == 1
@@ -29,6 +29,11 @@ def get_current_theme():
 current = LocalProxy(get_current_theme)
 
 
+def get_theme_version():
+    '''The current theme version, used to burst caches on theme upgrades'''
+    return current.entrypoint.dist.version
+
+
 @pass_context
 def theme_static_with_version(ctx, filename, external=False, inline_burst=False,
                               force_version=False):
@@ -52,7 +57,7 @@ def theme_static_with_version(ctx, filename, external=False, inline_burst=False,
     if current_app.config['DEBUG'] and not force_version:
         burst = time()
     else:
-        burst = current.entrypoint.dist.version
+        burst = get_theme_version()
     if inline_burst:
         url_parts = url.split(".")
         return '.'.join(url_parts[:-1] + [str(burst), url_parts[-1]])
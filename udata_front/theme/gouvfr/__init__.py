@@ -7,8 +7,7 @@ import requests
 from dateutil.parser import parse
 from flask import g, current_app, url_for
 
-from udata_front import theme
-from udata.app import cache
+from udata_front import refresh, theme
 from udata.models import Dataset
 from udata_front.frontend import nav
 from udata.i18n import lazy_gettext as _
@@ -189,7 +188,7 @@ nav.Bar(
 )
 
 
-@cache.memoize(50)
+@refresh.refreshed('blog', 50, default=None)
 def get_blog_post(lang):
     """
     Extract the latest post summary from an RSS or an Atom feed.
@@ -199,28 +198,37 @@ def get_blog_post(lang):
       - enclosures of image type (first match)
       - first image found in content
     Image size is ot taken in account but could in future improvements.
+
+    Served from a refresh-ahead cache: when the feed can't be fetched,
+    the last fetched post is kept.
     """
     wp_atom_url = current_app.config.get("WP_ATOM_URL")
     if not wp_atom_url:
         return
 
     feed = None
+    error = None
 
     for code in lang, current_app.config["DEFAULT_LANGUAGE"]:
         feed_url = wp_atom_url.format(lang=code)
         try:
             response = requests.get(feed_url, timeout=WP_TIMEOUT)
-        except requests.Timeout:
+        except requests.Timeout as e:
             log.error("Timeout while fetching %s", feed_url, exc_info=True)
+            error = e
             continue
-        except requests.RequestException:
+        except requests.RequestException as e:
             log.error("Error while fetching %s", feed_url, exc_info=True)
+            error = e
             continue
         feed = feedparser.parse(response.content)
 
         if len(feed.entries) > 0:
             break
 
+    if feed is None and error:
+        raise error
+
     if not feed or len(feed.entries) <= 0:
         return
 
@@ -1,10 +1,206 @@
+import hashlib
+import time
+
+from bson import DBRef
+from collections import defaultdict
+from datetime import timezone
 from typing import Optional
-from flask import request, redirect, abort, g
+from flask import current_app, request, redirect, abort, g, make_response, session
 from flask.views import MethodView
+from flask_security import current_user
+from flask_wtf.csrf import generate_csrf
+from mongoengine.base import get_document
+from mongoengine.dereference import DeReference
 
 from udata import search, auth
-from udata.utils import not_none_dict
-from udata_front import theme
+from udata.utils import Paginable, not_none_dict
+from udata_front import theme, page_cache
+from udata_front.followers import count_followers
+from udata_front.models import Follower
+
+# Field used to tag documents with their source in a `$unionWith` pipeline
+FACET_SOURCE = '_facet_source'
+
+
+class PagePaginator(Paginable):
+    '''A paginable page of documents whose total count is already known'''
+
+    def __init__(self, objects, page, page_size, total):
+        self.objects = objects
+        self.page = page
+        self.page_size = page_size
+        self.total = total
+
+    def __iter__(self):
+        return iter(self.objects)
+
+    def __len__(self):
+        return len(self.objects)
+
+
+def paginate_union(*sources):
+    '''
+    Paginate several querysets, possibly on distinct collections,
+    with a single `$unionWith` + `$facet` aggregation.
+
+    Each source is a `(name, queryset, page, page_size)` tuple.
+    Returns a `{name: PagePaginator}` mapping giving both the requested page
+    and the total count for each source in one round trip.
+    '''
+    pipeline = []
+    facets = {}
+    for index, (name, queryset, page, page_size) in enumerate(sources):
+        if page < 1:
+            abort(404)
+        stages = [
+            {'$match': queryset._query},
+            {'$addFields': {FACET_SOURCE: name}},
+        ]
+        if index == 0:
+            pipeline.extend(stages)
+        else:
+            pipeline.append({'$unionWith': {
+                'coll': queryset._document._get_collection_name(),
+                'pipeline': stages,
+            }})
+        page_stages = [{'$match': {FACET_SOURCE: name}}]
+        if queryset._ordering:
+            page_stages.append({'$sort': dict(queryset._ordering)})
+        page_stages.extend([
+            {'$skip': (page - 1) * page_size},
+            {'$limit': page_size},
+        ])
+        facets[name] = page_stages
+        facets[name + '_total'] = [
+            {'$match': {FACET_SOURCE: name}},
+            {'$count': 'total'},
+        ]
+    pipeline.append({'$facet': facets})
+
+    first_queryset = sources[0][1]
+    result = next(first_queryset._collection.aggregate(pipeline), {})
+
+    paginators = {}
+    for name, queryset, page, page_size in sources:
+        objects = []
+        for son in result.get(name, []):
+            son.pop(FACET_SOURCE, None)
+            objects.append(queryset._document._from_son(son))
+        if not objects and page != 1:
+            abort(404)
+        # Mimic queryset pagination which dereferences items in batch
+        objects = DeReference()(objects, max_depth=1)
+        counts = result.get(name + '_total') or [{'total': 0}]
+        paginators[name] = PagePaginator(objects, page, page_size, counts[0]['total'])
+    return paginators
+
+
+def make_etag(*parts, personal=True):
+    '''
+    Build a strong ETag from some parts.
+
+    The theme version, language, user and query string are always included
+    as they all change the rendered output.
+    Use `personal=False` for content which is the same for every user.
+    '''
+    if personal and current_user.is_authenticated:
+        user = str(current_user.id)
+    else:
+        user = 'anonymous'
+    parts = (theme.get_theme_version(), g.get('lang_code', ''), user,
+             request.query_string.decode('utf-8')) + parts
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+def csrf_state():
+    '''
+    The session CSRF token and the current window of the tokens signed from it.
+
+    Pages embed a signed CSRF token expiring after `WTF_CSRF_TIME_LIMIT`:
+    including this state in their ETag makes a copy revalidate as a miss
+    once its token could have expired (windows last half of the limit).
+    '''
+    generate_csrf()  # Ensure the session token exists before rendering
+    token = session.get(current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token'), '')
+    limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    window = int(time.time() // max(limit // 2, 1)) if limit else ''
+    return '{0}:{1}'.format(token, window)
+
+
+def is_not_modified(etag, last_modified=None):
+    '''Check the request conditional headers against some validators'''
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified:
+        last_modified = last_modified.replace(microsecond=0)
+        if not last_modified.tzinfo:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def conditional_response(etag, last_modified, produce):
+    '''
+    Answer a `304 Not Modified` without calling `produce` when validators match,
+    otherwise build the response from `produce()` and attach the validators.
+    '''
+    if is_not_modified(etag, last_modified):
+        response = make_response('', 304)
+    else:
+        response = make_response(produce())
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    # Clients must revalidate but can reuse their copy on 304
+    response.cache_control.no_cache = True
+    if current_user.is_authenticated:
+        response.cache_control.private = True
+    return response
+
+
+def referenced_model(obj, field, value):
+    '''The model referenced by a `DBRef`, including references to abstract models'''
+    if hasattr(value, 'cls'):
+        return get_document(value.cls)
+    return obj._fields[field].document_type
+
+
+def prefetch(objects, *fields):
+    '''
+    Dereference some reference fields of many documents
+    with a single `$in` query per referenced collection.
+    '''
+    ids = defaultdict(set)
+    for obj in objects:
+        for field in fields:
+            value = obj._data.get(field)
+            if isinstance(value, DBRef):
+                ids[referenced_model(obj, field, value)].add(value.id)
+    fetched = {
+        model: model.objects.in_bulk(list(model_ids))
+        for model, model_ids in ids.items()
+    }
+    for obj in objects:
+        for field in fields:
+            value = obj._data.get(field)
+            if isinstance(value, DBRef):
+                model = referenced_model(obj, field, value)
+                if value.id in fetched[model]:
+                    obj._data[field] = fetched[model][value.id]
+    return objects
+
+
+def paginate_followers(obj, page, page_size):
+    '''A page of the active followers of an object, sorted by follower name'''
+    if page < 1:
+        abort(404)
+    total = count_followers(obj)
+    followers = list(Follower.objects(following=obj.id)
+                             .order_by('follower_name', 'follow')
+                             .skip((page - 1) * page_size).limit(page_size))
+    if not followers and page != 1:
+        abort(404)
+    return PagePaginator(prefetch(followers, 'follower'), page, page_size, total)
 
 
 class Templated(object):
@@ -170,10 +366,51 @@ class NestedObject(SingleObject):
 class DetailView(SingleObject, Templated, BaseView):
     '''
     Render a single object.
+
+    Responses carry an ETag and conditional requests are answered
+    with a `304 Not Modified` without rendering when it matches.
+    Access checks (`check_access`) always run first.
+    Set `conditional` to `False` for views whose content is not reflected
+    by the object modification date or surrogate keys.
     '''
+    conditional = True
 
     def get(self, **kwargs):
-        return self.render()
+        return self.conditional_response(self.render)
+
+    def check_access(self):
+        '''Abort when the object can't be displayed, before any validator is computed'''
+
+    def get_last_modified(self):
+        obj = self.get_object()
+        for field in 'last_modified_internal', 'last_modified', 'metadata_modified_at':
+            value = getattr(obj, field, None)
+            if value:
+                return value
+
+    def get_validators(self):
+        '''
+        Compute `(etag, last_modified)` before rendering.
+
+        The surrogate keys versions change whenever the object
+        or a related one displayed on the page is saved.
+        No `Last-Modified` is sent: a date can't reflect the embedded CSRF token.
+        '''
+        last_modified = self.get_last_modified()
+        if not self.conditional or not last_modified:
+            return None
+        obj = self.get_object()
+        versions = page_cache.get_versions(page_cache.surrogate_keys(obj))
+        etag = make_etag(request.endpoint, obj.id, last_modified.isoformat(),
+                         versions, csrf_state())
+        return etag, None
+
+    def conditional_response(self, produce):
+        self.check_access()
+        validators = self.get_validators()
+        if validators is None:
+            return produce()
+        return conditional_response(*validators, produce)
 
     def get_context(self):
         context = super(DetailView, self).get_context()
@@ -183,6 +420,22 @@ class DetailView(SingleObject, Templated, BaseView):
         return context
 
 
+class PageCached(object):
+    '''
+    Serve anonymous GET renders from the page cache.
+
+    Pages are tagged with the surrogate keys of the displayed object
+    so they are invalidated whenever it (or a related object) changes.
+    '''
+
+    def get_surrogate_keys(self):
+        return page_cache.surrogate_keys(self.get_object())
+
+    def get(self, **kwargs):
+        return self.conditional_response(
+            lambda: page_cache.cached_page(self.render, self.get_surrogate_keys()))
+
+
 class FormView(Templated, BaseView):
     form = None
 
@@ -1,5 +1,4 @@
-from flask import abort, make_response, request, url_for
-from feedgenerator.django.utils.feedgenerator import Atom1Feed
+from flask import abort, request, url_for
 
 from jinja2 import TemplateNotFound
 from udata.core.contact_point.models import CONTACT_ROLES
@@ -7,45 +6,36 @@ from udata.core.dataservices.models import Dataservice
 from udata.core.dataservices.permissions import DataserviceEditPermission
 from udata.core.site.models import current_site
 from udata.i18n import I18nBlueprint, gettext as _
-from udata.sitemap import sitemap
+from udata_front.sitemaps import register_source
 from flask_mongoengine.pagination import Pagination
 
 from udata_front import theme
 from udata_front.theme import render as render_template
 from udata_front.views.base import DetailView
+from udata_front.views.feeds import author_of, cached_feed
 
 blueprint = I18nBlueprint('dataservices', __name__, url_prefix='/dataservices')
 
 
 @blueprint.route('/recent.atom')
 def recent_feed():
-    feed = Atom1Feed(_('Last datasets'), description=None,
-                     feed_url=request.url, link=request.url_root)
     dataservices = (Dataservice.objects.visible().order_by('-created_at_internal')
                     .limit(current_site.feed_size))
-    for dataservice in dataservices:
-        author_name = None
-        author_uri = None
-        if dataservice.organization:
-            author_name = dataservice.organization.name
-            author_uri = url_for('organizations.show',
-                                 org=dataservice.organization.id, _external=True)
-        elif dataservice.owner:
-            author_name = dataservice.owner.fullname
-            author_uri = url_for('users.show',
-                                 user=dataservice.owner.id, _external=True)
-        feed.add_item(dataservice.title,
-                      description=dataservice.description,
-                      content=render_template('dataservice/feed_item.html',
-                                              dataservice=dataservice),
-                      author_name=author_name,
-                      author_link=author_uri,
-                      link=url_for('dataservices.show', dataservice=dataservice.id, _external=True),
-                      updateddate=dataservice.metadata_modified_at,
-                      pubdate=dataservice.created_at)
-    response = make_response(feed.writeString('utf-8'))
-    response.headers['Content-Type'] = 'application/atom+xml'
-    return response
+    return cached_feed('dataservices', _('Last datasets'), dataservices,
+                       'metadata_modified_at', feed_entry)
+
+
+def feed_entry(dataservice):
+    author_name, author_uri = author_of(dataservice)
+    return dict(title=dataservice.title,
+                description=dataservice.description,
+                content=render_template('dataservice/feed_item.html',
+                                        dataservice=dataservice),
+                author_name=author_name,
+                author_link=author_uri,
+                link=url_for('dataservices.show', dataservice=dataservice.id, _external=True),
+                updateddate=dataservice.metadata_modified_at,
+                pubdate=dataservice.created_at)
 
 
 @blueprint.route("/", endpoint="list")
@@ -75,15 +65,16 @@ class DataserviceDetailView(DataserviceView, DetailView):
     def dispatch_request(self, *args, **kwargs):
         return super(DataserviceDetailView, self).dispatch_request(*args, **kwargs)
 
-    def get_context(self):
-        context = super(DataserviceDetailView, self).get_context()
-
+    def check_access(self):
         if not DataserviceEditPermission(self.dataservice).can():
             if self.dataservice.private:
                 abort(404)
             elif self.dataservice.deleted_at:
                 abort(410)
 
+    def get_context(self):
+        context = super(DataserviceDetailView, self).get_context()
+
         datasets = Pagination(
             self.dataservice.datasets,
             request.args.get('datasets_page', 1, type=int),
@@ -102,8 +93,7 @@ class DataserviceDetailView(DataserviceView, DetailView):
         return context
 
 
-@sitemap.register_generator
+@register_source('dataservices', 'dataservices.show_redirect', 'dataservice', 'weekly', 0.8,
+                 modified='metadata_modified_at')
 def sitemap_urls():
-    for dataservice in Dataservice.objects.visible().only('id', 'slug'):
-        yield ('dataservices.show_redirect', {'dataservice': dataservice},
-               None, 'weekly', 0.8)
+    return Dataservice.objects.visible()
@@ -1,9 +1,8 @@
 from collections import defaultdict, OrderedDict
 
-from flask import abort, request, url_for, redirect, make_response
-from feedgenerator.django.utils.feedgenerator import Atom1Feed
+from flask import abort, request, url_for, redirect
 
-from udata.models import Reuse, Follow
+from udata.models import Reuse
 from udata.core.contact_point.models import CONTACT_ROLES
 from udata.core.dataset.models import Dataset, get_resource
 from udata.core.dataset.constants import RESOURCE_TYPES
@@ -13,9 +12,12 @@ from udata.core.dataservices.models import Dataservice
 from udata.core.site.models import current_site
 
 from udata_front.theme import render as render_template
-from udata_front.views.base import DetailView, SearchView
+from udata_front.views.base import (
+    DetailView, PageCached, SearchView, paginate_followers, paginate_union,
+)
+from udata_front.views.feeds import author_of, cached_feed
 from udata.i18n import I18nBlueprint, gettext as _, ngettext
-from udata.sitemap import sitemap
+from udata_front.sitemaps import register_source
 
 
 blueprint = I18nBlueprint('datasets', __name__, url_prefix='/datasets')
@@ -23,32 +25,22 @@ blueprint = I18nBlueprint('datasets', __name__, url_prefix='/datasets')
 
 @blueprint.route('/recent.atom')
 def recent_feed():
-    feed = Atom1Feed(_('Last datasets'), description=None,
-                     feed_url=request.url, link=request.url_root)
     datasets = (Dataset.objects.visible().order_by('-created_at_internal')
                 .limit(current_site.feed_size))
-    for dataset in datasets:
-        author_name = None
-        author_uri = None
-        if dataset.organization:
-            author_name = dataset.organization.name
-            author_uri = url_for('organizations.show',
-                                 org=dataset.organization.id, _external=True)
-        elif dataset.owner:
-            author_name = dataset.owner.fullname
-            author_uri = url_for('users.show',
-                                 user=dataset.owner.id, _external=True)
-        feed.add_item(dataset.title,
-                      description=dataset.description,
-                      content=render_template('dataset/feed_item.html', dataset=dataset),
-                      author_name=author_name,
-                      author_link=author_uri,
-                      link=url_for('datasets.show', dataset=dataset.id, _external=True),
-                      updateddate=dataset.last_modified,
-                      pubdate=dataset.created_at)
-    response = make_response(feed.writeString('utf-8'))
-    response.headers['Content-Type'] = 'application/atom+xml'
-    return response
+    return cached_feed('datasets', _('Last datasets'), datasets,
+                       'last_modified_internal', feed_entry)
+
+
+def feed_entry(dataset):
+    author_name, author_uri = author_of(dataset)
+    return dict(title=dataset.title,
+                description=dataset.description,
+                content=render_template('dataset/feed_item.html', dataset=dataset),
+                author_name=author_name,
+                author_link=author_uri,
+                link=url_for('datasets.show', dataset=dataset.id, _external=True),
+                updateddate=dataset.last_modified,
+                pubdate=dataset.created_at)
 
 
 @blueprint.route('/', endpoint='list')
@@ -62,23 +54,29 @@ class DatasetListView(SearchView):
 class DatasetView(object):
     model = Dataset
     object_name = 'dataset'
+    _edit_permission = None
 
     @property
     def dataset(self):
         return self.get_object()
 
+    @property
+    def edit_permission(self):
+        if self._edit_permission is None:
+            self._edit_permission = DatasetEditPermission(self.dataset)
+        return self._edit_permission
+
     def get_context(self):
         return super(DatasetView, self).get_context()
 
 
 class ProtectedDatasetView(DatasetView):
     def can(self, *args, **kwargs):
-        permission = DatasetEditPermission(self.dataset)
-        return permission.can()
+        return self.edit_permission.can()
 
 
 @blueprint.route('/<dataset:dataset>/', endpoint='show')
-class DatasetDetailView(DatasetView, DetailView):
+class DatasetDetailView(PageCached, DatasetView, DetailView):
     template_name = 'dataset/display.html'
     dataservice_page_size = 8
     reuse_page_size = 8
@@ -86,6 +84,13 @@ class DatasetDetailView(DatasetView, DetailView):
     def dispatch_request(self, *args, **kwargs):
         return super(DatasetDetailView, self).dispatch_request(*args, **kwargs)
 
+    def check_access(self):
+        if not self.edit_permission.can():
+            if self.dataset.private:
+                abort(404)
+            elif self.dataset.deleted:
+                abort(410)
+
     def get_context(self):
         context = super(DatasetDetailView, self).get_context()
 
@@ -95,21 +100,20 @@ class DatasetDetailView(DatasetView, DetailView):
         params_reuses_page = request.args.get('reuses_page', 1, type=int)
         reuses = Reuse.objects(datasets=self.dataset.id).visible()
 
-        if not DatasetEditPermission(self.dataset).can():
-            if self.dataset.private:
-                abort(404)
-            elif self.dataset.deleted:
-                abort(410)
-
-        context["dataservices"] = dataservices.paginate(
-            params_dataservices_page, self.dataservice_page_size
+        # Totals and first pages of both collections in a single round trip
+        pages = paginate_union(
+            ('reuses', reuses, params_reuses_page, self.reuse_page_size),
+            ('dataservices', dataservices, params_dataservices_page,
+             self.dataservice_page_size),
         )
-        context["total_dataservices"] = len(dataservices)
 
-        context['reuses'] = reuses.paginate(params_reuses_page, self.reuse_page_size)
-        context['total_reuses'] = len(reuses)
+        context["dataservices"] = pages['dataservices']
+        context["total_dataservices"] = pages['dataservices'].total
+
+        context['reuses'] = pages['reuses']
+        context['total_reuses'] = pages['reuses'].total
 
-        context['can_edit'] = DatasetEditPermission(self.dataset)
+        context['can_edit'] = self.edit_permission
         context['can_edit_resource'] = ResourceEditPermission
         context["CONTACT_ROLES"] = CONTACT_ROLES
         return context
@@ -118,11 +122,13 @@ class DatasetDetailView(DatasetView, DetailView):
 @blueprint.route('/<dataset:dataset>/followers/', endpoint='followers')
 class DatasetFollowersView(DatasetView, DetailView):
     template_name = 'dataset/followers.html'
+    conditional = False
+    page_size = 24
 
     def get_context(self):
         context = super(DatasetFollowersView, self).get_context()
-        context['followers'] = (Follow.objects.followers(self.dataset)
-                                              .order_by('follower.fullname'))
+        page = request.args.get('page', 1, type=int)
+        context['followers'] = paginate_followers(self.dataset, page, self.page_size)
         return context
 
 
@@ -135,11 +141,10 @@ def resource_redirect(id):
     return redirect(resource.url.strip()) if resource else abort(404)
 
 
-@sitemap.register_generator
+@register_source('datasets', 'datasets.show_redirect', 'dataset', 'weekly', 0.8,
+                 modified='last_modified_internal')
 def sitemap_urls():
-    for dataset in Dataset.objects.visible().only('id', 'slug'):
-        yield ('datasets.show_redirect', {'dataset': dataset},
-               None, 'weekly', 0.8)
+    return Dataset.objects.visible()
 
 
 @blueprint.app_template_filter()
@@ -0,0 +1,90 @@
+'''
+Cached Atom feeds.
+
+A feed state is identified by its items identifiers and modification dates,
+fetched with a single projection query which also gives the validators.
+The serialized XML is cached for this exact state, and each entry is cached
+by identifier and modification date, so a new or updated object
+only renders its own entry.
+'''
+from feedgenerator.django.utils.feedgenerator import Atom1Feed
+from flask import g, make_response, request, url_for
+
+from udata.app import cache
+
+from udata_front.views.base import conditional_response, make_etag, prefetch
+
+FEED_KEY = 'feed:{0}:{1}'
+FEED_ITEM_KEY = 'feed-item:{0}:{1}:{2}:{3}'
+
+# Entries are keyed by modification date so they can live long
+FEED_ITEM_TIMEOUT = 24 * 60 * 60
+FEED_TIMEOUT = 60 * 60
+
+
+def feed_validators(items):
+    '''Validators for a feed from its `(id, modified)` items'''
+    last_modified = max((modified for _, modified in items if modified), default=None)
+    etag = make_etag(request.url, *('{0}:{1}'.format(*item) for item in items),
+                     personal=False)
+    return etag, last_modified
+
+
+def get_entries(name, model, items, build_entry, related=('organization', 'owner')):
+    '''Get feed entries from cache, building only the missing ones'''
+    keys = [FEED_ITEM_KEY.format(name, obj_id, modified, g.lang_code)
+            for obj_id, modified in items]
+    entries = dict(zip(keys, cache.get_many(*keys)))
+    missing = [obj_id for (obj_id, _), key in zip(items, keys) if entries[key] is None]
+    if missing:
+        objects = prefetch(list(model.objects(id__in=missing)), *related)
+        built = {obj.id: build_entry(obj) for obj in objects}
+        fresh = {}
+        for (obj_id, _), key in zip(items, keys):
+            if entries[key] is None and obj_id in built:
+                entries[key] = fresh[key] = built[obj_id]
+        cache.set_many(fresh, timeout=FEED_ITEM_TIMEOUT)
+    return [entries[key] for key in keys if entries[key] is not None]
+
+
+def author_of(obj):
+    '''Feed author name and link of an owned object'''
+    if obj.organization:
+        return obj.organization.name, url_for('organizations.show',
+                                              org=obj.organization.id, _external=True)
+    elif obj.owner:
+        return obj.owner.fullname, url_for('users.show',
+                                           user=obj.owner.id, _external=True)
+    return None, None
+
+
+def cached_feed(name, title, queryset, modified_field, build_entry,
+                related=('organization', 'owner')):
+    '''
+    Serve the Atom feed of a queryset from cache, with validators.
+
+    :param name: a name identifying the feed in cache
+    :param title: the feed title
+    :param queryset: the ordered and limited feed queryset
+    :param modified_field: the field holding the objects modification date
+    :param build_entry: a callable building the `Atom1Feed.add_item` kwargs of an object
+    :param related: the reference fields prefetched before building entries
+    '''
+    items = list(queryset.scalar('id', modified_field))
+    etag, last_modified = feed_validators(items)
+
+    def render():
+        key = FEED_KEY.format(name, etag)
+        xml = cache.get(key)
+        if xml is None:
+            feed = Atom1Feed(title, description=None,
+                             feed_url=request.url, link=request.url_root)
+            for entry in get_entries(name, queryset._document, items, build_entry, related):
+                feed.add_item(**entry)
+            xml = feed.writeString('utf-8')
+            cache.set(key, xml, timeout=FEED_TIMEOUT)
+        response = make_response(xml)
+        response.headers['Content-Type'] = 'application/atom+xml'
+        return response
+
+    return conditional_response(etag, last_modified, render)
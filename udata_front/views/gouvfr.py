@@ -1,12 +1,13 @@
 import frontmatter
+import hashlib
 import logging
 import requests
 
-from flask import url_for, redirect, abort, current_app
+from bson import ObjectId
+from flask import url_for, redirect, abort, current_app, g
 from jinja2.exceptions import TemplateNotFound
-from mongoengine.errors import ValidationError
 
-from udata_front import theme
+from udata_front import page_cache, pages, refresh, theme
 from udata.app import cache
 from udata.frontend import template_hook
 from udata.models import Reuse, Dataset
@@ -20,6 +21,7 @@ blueprint = I18nBlueprint('gouvfr', __name__,
                           static_url_path='/static/gouvfr')
 
 PAGE_CACHE_DURATION = 60 * 5  # in seconds
+PAGE_BODY_KEY = 'page-body:{0}'
 
 
 @blueprint.route('/dataset/<dataset>/')
@@ -58,54 +60,88 @@ def get_pages_gh_urls(slug):
 
 
 def detect_pages_extension(raw_url):
-    if requests.head(f'{raw_url}.md').status_code == 200:
+    if requests.head(f'{raw_url}.md', timeout=5).status_code == 200:
         return 'md'
     return 'html'
 
 
-@cache.memoize(PAGE_CACHE_DURATION)
-def get_page_content(slug):
+@refresh.refreshed('pages', PAGE_CACHE_DURATION)
+def fetch_page_content(slug):
     '''
-    Get a page content from gh repo (md).
-    This has a double layer of cache:
-    - @cache.cached decorator w/ short lived cache for normal operations
-    - a long terme cache w/o timeout to be able to always render some content
+    Get a page content from gh repo (md or html), `None` if it does not exist.
+
+    Served from a refresh-ahead cache: errors keep the last fetched content.
     '''
-    cache_key = f'pages-content-{slug}'
     raw_url, gh_url = get_pages_gh_urls(slug)
-    try:
-        extension = detect_pages_extension(raw_url)
+    extension = detect_pages_extension(raw_url)
+
+    response = requests.get(f'{raw_url}.{extension}', timeout=5)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.text, f'{gh_url}.{extension}', extension
 
-        raw_url = f'{raw_url}.{extension}'
-        gh_url = f'{gh_url}.{extension}'
 
-        response = requests.get(raw_url, timeout=5)
-        # do not cache 404 and forward status code
-        if response.status_code == 404:
+def get_page_content(slug):
+    if not current_app.config.get('PAGES_GH_REPO_NAME'):
+        abort(404)
+    manifest = pages.get_manifest()
+    if manifest is not None:
+        # Once mirrored, the manifest lists every existing page
+        if slug not in manifest['pages']:
             abort(404)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        log.exception(f'Error while getting {slug} page from gh: {e}')
-        content = cache.get(cache_key)
-    else:
-        content = response.text
-        cache.set(cache_key, content)
-    # no cached version or no content from gh
-    if not content:
+        page = pages.get_page(slug, manifest)
+        if page is not None:
+            return page
+    try:
+        page = fetch_page_content(slug)
+    except refresh.Unavailable:
         log.error(f'No content found inc. from cache for page {slug}')
         abort(503)
-    return content, gh_url, extension
+    if page is None:
+        abort(404)
+    return page
+
+
+def get_objects(model, ids_or_slugs):
+    '''Resolve some slugs or ids with a query on each, keeping their order'''
+    values = [str(value) for value in ids_or_slugs if value]
+    found = {}
+    if values:
+        for obj in model.objects(slug__in=values):
+            found[obj.slug] = obj
+    ids = [value for value in values if value not in found and ObjectId.is_valid(value)]
+    if ids:
+        for obj in model.objects(id__in=ids):
+            found[str(obj.id)] = obj
+    return [found[value] for value in values if value in found]
 
 
-def get_object(model, id_or_slug):
-    objects = getattr(model, 'objects')
-    obj = objects.filter(slug=id_or_slug).first()
-    if not obj:
-        try:
-            obj = objects.filter(id=id_or_slug).first()
-        except ValidationError:
-            pass
-    return obj
+def render_page_body(page, extension):
+    '''
+    Render a page content with its datasets and reuses cards.
+
+    The rendering is cached by page content, tagged with the displayed objects
+    surrogate keys so that saving any of them renders it again.
+    '''
+    key = PAGE_BODY_KEY.format(hashlib.sha1('|'.join((
+        page.content, repr(page.metadata), extension,
+        g.get('lang_code', ''), theme.get_theme_version(),
+    )).encode('utf-8')).hexdigest())
+    entry = cache.get(key)
+    if entry and page_cache.is_fresh(entry['tags']):
+        return entry['body']
+
+    reuses = get_objects(Reuse, page.get('reuses') or [])
+    datasets = get_objects(Dataset, page.get('datasets') or [])
+    tags = page_cache.get_versions([
+        surrogate_key for obj in datasets + reuses
+        for surrogate_key in page_cache.surrogate_keys(obj)
+    ])
+    body = theme.render('page-body.html', page=page, reuses=reuses, datasets=datasets,
+                        extension=extension)
+    cache.set(key, {'tags': tags, 'body': body}, timeout=PAGE_CACHE_DURATION)
+    return body
 
 
 @blueprint.route('/pages/<path:slug>', endpoint='show_page')
@@ -115,13 +151,9 @@ def show_page(slug):
         return redirect(url_for('gouvfr.show_page', slug=slug + '/'))
     content, gh_url, extension = get_page_content(slug.rstrip('/'))
     page = frontmatter.loads(content)
-    reuses = [get_object(Reuse, r) for r in page.get('reuses') or []]
-    datasets = [get_object(Dataset, d) for d in page.get('datasets') or []]
-    reuses = [r for r in reuses if r is not None]
-    datasets = [d for d in datasets if d is not None]
     return theme.render(
         'page.html',
-        page=page, reuses=reuses, datasets=datasets, gh_url=gh_url, extension=extension
+        page=page, body=render_page_body(page, extension), gh_url=gh_url, extension=extension
     )
 
 
@@ -1,10 +1,30 @@
-from flask import current_app
+import hashlib
+
+from functools import lru_cache
+from urllib.parse import unquote, urlsplit
+
+from bson import ObjectId
+from flask import current_app, jsonify
 from flask_restx import inputs
 from werkzeug.exceptions import HTTPException
+from werkzeug.routing import BaseConverter, Map
 
 from udata.api import api, API
-from udata.models import db, Dataset, GeoZone, TERRITORY_DATASETS
-from udata_front import theme
+from udata.app import cache
+from udata.core.spatial import geoids
+from udata.i18n import get_current_locale
+from udata.models import Dataset, GeoZone, TERRITORY_DATASETS
+from udata.routing import LazyRedirect
+from udata_front import page_cache, theme
+from udata_front.views.base import conditional_response, make_etag, prefetch
+
+# oEmbed payloads, by a hash of theme version, language, URL and maximum sizes
+OEMBED_KEY = 'oembed:{0}'
+# Rendered embeds, by theme version, language, reference and modification date
+OEMBEDS_KEY = 'oembeds:{0}:{1}:{2}:{3}'
+OEMBEDS_TIMEOUT = 24 * 60 * 60
+
+URL_MATCHES_CACHE_SIZE = 1024
 
 oembed_parser = api.parser()
 oembed_parser.add_argument(
@@ -30,10 +50,48 @@ oembeds_parser.add_argument(
     location='args', required=True)
 
 
+def unresolved(converter):
+    '''A converter matching like `converter` but keeping the raw URL value'''
+    return type(converter.__name__, (converter,), {'to_python': BaseConverter.to_python})
+
+
+def get_url_matcher():
+    '''
+    A matcher of URLs against the application routes which does not convert
+    arguments (and so never hits the database), remembering the recently matched URLs.
+    '''
+    matcher = current_app.extensions.get('oembed-url-matcher')
+    if matcher is None:
+        url_map = current_app.url_map
+        converters = {
+            name: unresolved(converter) for name, converter in url_map.converters.items()
+        }
+        routes = Map([rule.empty() for rule in url_map.iter_rules()],
+                     converters=converters,
+                     strict_slashes=url_map.strict_slashes,
+                     merge_slashes=url_map.merge_slashes)
+        server_name = current_app.config.get('SERVER_NAME')
+
+        @lru_cache(maxsize=URL_MATCHES_CACHE_SIZE)
+        def matcher(url):
+            parts = urlsplit(url)
+            if server_name and parts.netloc != server_name:
+                return None, {}
+            adapter = routes.bind(parts.netloc, url_scheme=parts.scheme)
+            try:
+                return adapter.match(unquote(parts.path), method='GET')
+            except HTTPException:
+                return None, {}
+
+        current_app.extensions['oembed-url-matcher'] = matcher
+    return matcher
+
+
 @api.route('/oembed', endpoint='oembed')
 class OEmbedAPI(API):
     ROUTES = {
         # endpoint: (param name, template prefix)
+        # The param name is also the name of its model converter
         'datasets.show': ('dataset', 'dataset'),
         'organizations.show': ('org', 'organization'),
         'reuses.show': ('reuse', 'reuse'),
@@ -59,23 +117,36 @@ class OEmbedAPI(API):
         if 'https:' in url and ':443/' in url:
             url = url.replace(':443/', '/')
 
-        with current_app.test_request_context(url) as ctx:
-            if not ctx.request.endpoint:
-                return {'message': 'Unknown URL "{0}"'.format(url)}, 404
-            endpoint = ctx.request.endpoint.replace('_redirect', '')
-            view_args = ctx.request.view_args
+        key = OEMBED_KEY.format(hashlib.sha1('|'.join(str(part) for part in (
+            theme.get_theme_version(), get_current_locale(),
+            url, args['maxwidth'], args['maxheight'],
+        )).encode('utf-8')).hexdigest())
+        entry = cache.get(key)
+        if entry and page_cache.is_fresh(entry['tags']):
+            return entry['payload']
+
+        endpoint, view_args = get_url_matcher()(url)
+        if not endpoint:
+            return {'message': 'Unknown URL "{0}"'.format(url)}, 404
+        endpoint = endpoint.replace('_redirect', '')
 
         if endpoint not in self.ROUTES:
             return {'message': 'The URL "{0}" does not support oembed'.format(url)}, 404
 
         param, prefix = self.ROUTES[endpoint]
-        item = view_args[param]
+        # Only resolve the object to embed
+        converter = current_app.url_map.converters[param](current_app.url_map)
+        item = converter.to_python(view_args[param])
+        if isinstance(item, LazyRedirect):
+            item = converter.to_python(item.arg)
         if isinstance(item, Exception):
             if isinstance(item, HTTPException):
                 return {
                     'message': 'An error occured on URL "{0}": {1}'.format(url, str(item))
                 }, item.code
             raise item
+        # Versions are read before rendering so a concurrent purge is never missed
+        tags = page_cache.get_versions(page_cache.surrogate_keys(item))
         width = maxwidth = 1000
         height = maxheight = 200
         params = {
@@ -86,7 +157,7 @@ class OEmbedAPI(API):
         }
         params[param] = item
         html = theme.render('oembed.html', **params)
-        return {
+        payload = {
             'type': 'rich',
             'version': '1.0',
             'html': html,
@@ -95,10 +166,14 @@ class OEmbedAPI(API):
             'maxwidth': maxwidth,
             'maxheight': maxheight,
         }
+        cache.set(key, {'tags': tags, 'payload': payload}, timeout=OEMBEDS_TIMEOUT)
+        return payload
 
 
 @api.route('/oembeds/', endpoint='oembeds')
 class OEmbedsAPI(API):
+    WIDTH = 1000
+    HEIGHT = 200
 
     @api.doc('oembeds')
     @api.expect(oembeds_parser)
@@ -117,52 +192,95 @@ class OEmbedsAPI(API):
         """
         args = oembeds_parser.parse_args()
         references = args['references'].split(',')
-        result = []
-        for item_reference in references:
-            try:
-                item_kind, item_id = item_reference.split('-', 1)
-            except ValueError:
-                return api.abort(400, 'Invalid ID.')
-            if item_kind == 'dataset':
-                try:
-                    item = Dataset.objects.get(id=item_id)
-                except (db.ValidationError, Dataset.DoesNotExist):
+        parsed = [self.parse_reference(reference) for reference in references]
+
+        # Resolve all references with a single query per kind
+        dataset_ids = [ref[1] for ref in parsed
+                       if ref[0] == 'dataset' and ObjectId.is_valid(ref[1])]
+        modified = dict(Dataset.objects(id__in=dataset_ids)
+                               .scalar('id', 'last_modified_internal')) if dataset_ids else {}
+        territory_refs = [ref[1] for ref in parsed if ref[0] == 'territory']
+        zones = {
+            (zone.level, zone.code): zone
+            for zone in GeoZone.objects(code__in=[code for _, code in territory_refs])
+        } if territory_refs else {}
+
+        items = []
+        for reference, (kind, key, *extra) in zip(references, parsed):
+            if kind == 'error':
+                return api.abort(400, key)
+            elif kind == 'dataset':
+                if not ObjectId.is_valid(key) or ObjectId(key) not in modified:
                     return api.abort(400, 'Unknown dataset ID.')
-            elif (item_kind == 'territory' and
-                    current_app.config.get('ACTIVATE_TERRITORIES')):
-
-                try:
-                    country, level, code, kind = item_id.split(':')
-                except ValueError:
-                    return api.abort(400, 'Invalid territory ID.')
-                geoid = ':'.join((country, level, code))
-                zone = GeoZone.objects.resolve(geoid)
+                items.append((reference, ObjectId(key), modified[ObjectId(key)]))
+            else:
+                zone = zones.get(key)
                 if not zone:
                     return api.abort(400, 'Unknown territory identifier.')
-                if level in TERRITORY_DATASETS:
-                    if kind in TERRITORY_DATASETS[level]:
-                        item = TERRITORY_DATASETS[level][kind](zone)
-                    else:
-                        return api.abort(400, 'Unknown territory dataset id.')
-                else:
+                level, territory_kind = extra
+                if level not in TERRITORY_DATASETS:
                     return api.abort(400, 'Unknown kind of territory.')
-            else:
-                return api.abort(400, 'Invalid object type.')
-            width = maxwidth = 1000
-            height = maxheight = 200
-            html = theme.render('embed-dataset.html', **{
-                'width': width,
-                'height': height,
+                if territory_kind not in TERRITORY_DATASETS[level]:
+                    return api.abort(400, 'Unknown territory dataset id.')
+                items.append((reference, TERRITORY_DATASETS[level][territory_kind](zone), None))
+
+        etag = make_etag(*('{0}:{1}'.format(reference, modified)
+                           for reference, _, modified in items), personal=False)
+        last_modified = max((modified for _, _, modified in items if modified), default=None)
+        return conditional_response(etag, last_modified,
+                                    lambda: jsonify(self.render(items)))
+
+    def parse_reference(self, reference):
+        '''
+        Parse a reference into `(kind, key, *extra)`.
+
+        Invalid references are parsed as `('error', message)`.
+        '''
+        try:
+            kind, item_id = reference.split('-', 1)
+        except ValueError:
+            return 'error', 'Invalid ID.'
+        if kind == 'dataset':
+            return 'dataset', item_id
+        elif kind == 'territory' and current_app.config.get('ACTIVATE_TERRITORIES'):
+            try:
+                country, level, code, territory_kind = item_id.split(':')
+            except ValueError:
+                return 'error', 'Invalid territory ID.'
+            geoid = geoids.parse(':'.join((country, level, code)))
+            return 'territory', geoid, level, territory_kind
+        return 'error', 'Invalid object type.'
+
+    def render(self, items):
+        '''Render the embeds, from cache when their item did not change'''
+        keys = [OEMBEDS_KEY.format(theme.get_theme_version(), get_current_locale(),
+                                   reference, modified)
+                for reference, _, modified in items]
+        htmls = dict(zip(keys, cache.get_many(*keys)))
+        missing = [item for item, key in zip(items, keys) if htmls[key] is None]
+        datasets = Dataset.objects.in_bulk([item for _, item, _ in missing
+                                            if isinstance(item, ObjectId)])
+        prefetch(list(datasets.values()), 'organization', 'owner')
+        fresh = {}
+        for (reference, item, _), key in zip(items, keys):
+            if htmls[key] is not None:
+                continue
+            if isinstance(item, ObjectId):
+                item = datasets.get(item) or api.abort(400, 'Unknown dataset ID.')
+            htmls[key] = fresh[key] = theme.render('embed-dataset.html', **{
+                'width': self.WIDTH,
+                'height': self.HEIGHT,
                 'item': item,
-                'item_reference': item_reference,
+                'item_reference': reference,
             })
-            result.append({
-                'type': 'rich',
-                'version': '1.0',
-                'html': html,
-                'width': width,
-                'height': height,
-                'maxwidth': maxwidth,
-                'maxheight': maxheight,
-            })
-        return result
+        if fresh:
+            cache.set_many(fresh, timeout=OEMBEDS_TIMEOUT)
+        return [{
+            'type': 'rich',
+            'version': '1.0',
+            'html': htmls[key],
+            'width': self.WIDTH,
+            'height': self.HEIGHT,
+            'maxwidth': self.WIDTH,
+            'maxheight': self.HEIGHT,
+        } for key in keys]
@@ -1,28 +1,83 @@
-from flask import g, abort, redirect, url_for, request
+import logging
+import uuid
+
+from flask import current_app, g, abort, redirect, url_for, request
 from flask_security import current_user
+from mongoengine.signals import post_delete, post_save
+from werkzeug.local import LocalProxy
 
 from udata import search
-from udata_front.views.base import DetailView, SearchView
+from udata.app import cache
+from udata_front.views.base import DetailView, PageCached, SearchView
 from udata.i18n import I18nBlueprint
-from udata.models import (
-    Organization, Reuse, Dataset, Dataservice, Follow
-)
-from udata.sitemap import sitemap
+from udata.models import Organization, Reuse, Dataset
+from udata_front.sitemaps import register_source
 from udata.core.dataset.search import DatasetSearch
 from udata.core.organization.permissions import (
     EditOrganizationPermission, OrganizationPrivatePermission
 )
 from udata.core.organization.search import OrganizationSearch
 from udata.utils import not_none_dict
+from udata_front.stats import get_organization_stats
+
+log = logging.getLogger(__name__)
 
 blueprint = I18nBlueprint('organizations', __name__,
                           url_prefix='/organizations')
 
+USER_ORGS_KEY = 'user-organizations:{0}:{1}'
+# Any membership change expires every cached user organizations
+USER_ORGS_GENERATION_KEY = 'user-organizations-generation'
+
+# Fields changed by membership updates, including `count_members()`
+# called after members are pulled without saving the organization
+MEMBERSHIP_FIELDS = ('members', 'deleted', 'metrics.members')
+
+
+def user_organizations():
+    '''The current user organizations, cached until a membership changes'''
+    if not current_user.is_authenticated:
+        return []
+    generation = cache.get(USER_ORGS_GENERATION_KEY)
+    if generation is None:
+        generation = uuid.uuid4().hex
+        cache.add(USER_ORGS_GENERATION_KEY, generation, timeout=0)
+    key = USER_ORGS_KEY.format(generation, current_user.id)
+    organizations = cache.get(key)
+    if organizations is None:
+        organizations = list(current_user.organizations)
+        cache.set(key, organizations)
+    return organizations
+
 
 @blueprint.before_app_request
 def set_g_user_orgs():
-    if current_user.is_authenticated:
-        g.user_organizations = current_user.organizations
+    # Only resolved when read, so requests not using it never load the user organizations
+    g.user_organizations = LocalProxy(user_organizations)
+
+
+def expire_user_organizations():
+    if not current_app:
+        return
+    try:
+        cache.set(USER_ORGS_GENERATION_KEY, uuid.uuid4().hex, timeout=0)
+    except Exception:
+        log.exception('Unable to expire user organizations')
+
+
+def on_organization_saved(sender, document, created=False, **kwargs):
+    changed = document._get_changed_fields()
+    if created or any(field == 'metrics' or field.startswith(MEMBERSHIP_FIELDS)
+                      for field in changed):
+        expire_user_organizations()
+
+
+def on_organization_deleted(sender, document, **kwargs):
+    expire_user_organizations()
+
+
+post_save.connect(on_organization_saved, sender=Organization)
+post_delete.connect(on_organization_deleted, sender=Organization)
 
 
 @blueprint.route('/', endpoint='list')
@@ -56,7 +111,7 @@ class ProtectedOrgView(OrgView):
 
 
 @blueprint.route('/<org:org>/', endpoint='show')
-class OrganizationDetailView(SearchView, OrgView, DetailView):
+class OrganizationDetailView(PageCached, SearchView, OrgView, DetailView):
     template_name = 'organization/display.html'
     model = Dataset
     search_adapter = DatasetSearch
@@ -69,6 +124,11 @@ class OrganizationDetailView(SearchView, OrgView, DetailView):
         args.update(organization=self.organization.id)
         return search.query(self.search_adapter, **args)
 
+    def check_access(self):
+        can_view = OrganizationPrivatePermission(self.organization)
+        if self.organization.deleted and not can_view.can():
+            abort(410)
+
     def get_context(self):
         context = super(OrganizationDetailView, self).get_context()
         params_reuses_page = request.args.get('reuses_page', 1, type=int)
@@ -76,33 +136,28 @@ class OrganizationDetailView(SearchView, OrgView, DetailView):
         can_edit = EditOrganizationPermission(self.organization)
         can_view = OrganizationPrivatePermission(self.organization)
 
-        if self.organization.deleted and not can_view.can():
-            abort(410)
-
-        dataservices = Dataservice.objects(
-            organization=self.organization).visible()
-
-        datasets = Dataset.objects(
-            organization=self.organization)
-
         reuses = Reuse.objects(
             organization=self.organization).order_by(
             '-created_at')
 
-        followers = (Follow.objects.followers(self.organization)
-                     .order_by('follower.fullname'))
+        # Materialized counters instead of live counts
+        stats = get_organization_stats(self.organization)
 
-        if not can_view:
+        if can_view:
+            organization_datasets = stats.datasets
+            total_reuses = stats.reuses
+        else:
             reuses = reuses.visible()
-            datasets = datasets.visible()
+            organization_datasets = stats.visible_datasets
+            total_reuses = stats.visible_reuses
 
         context.update({
             'reuses': reuses.paginate(params_reuses_page, self.reuse_page_size),
             'total_datasets': context.get("datasets").total,
-            'total_dataservices': len(dataservices),
-            'organization_datasets': len(datasets),
-            'total_reuses': len(reuses),
-            'followers': followers,
+            'total_dataservices': stats.visible_dataservices,
+            'organization_datasets': organization_datasets,
+            'total_reuses': total_reuses,
+            'total_followers': stats.followers,
             'can_edit': can_edit,
             'can_view': can_view,
         })
@@ -114,7 +169,7 @@ def organization_dashboard(org):
     return redirect('%s#dashboard' % url_for('organizations.show', org=org), code=301)
 
 
-@sitemap.register_generator
+@register_source('organizations', 'organizations.show_redirect', 'org', 'weekly', 0.7,
+                 modified='last_modified')
 def sitemap_urls():
-    for org in Organization.objects.visible().only('id', 'slug'):
-        yield 'organizations.show_redirect', {'org': org}, None, 'weekly', 0.7
\ No newline at end of file
+    return Organization.objects.visible()
\ No newline at end of file
@@ -3,6 +3,7 @@ from flask import current_app
 from udata.i18n import I18nBlueprint
 from udata.models import Post
 from udata.sitemap import sitemap
+from udata_front.sitemaps import register_source
 from udata.core.post.permissions import PostEditPermission
 from udata_front import theme
 from udata_front.views.base import ListView
@@ -51,5 +52,9 @@ def show(post):
 @sitemap.register_generator
 def sitemap_urls():
     yield 'posts.list_redirect', {}, None, "weekly", 0.6
-    for post in Post.objects.published().only('id', 'slug'):
-        yield 'posts.show_redirect', {'post': post}, None, "weekly", 0.6
+
+
+@register_source('posts', 'posts.show_redirect', 'post', 'weekly', 0.6,
+                 modified='last_modified')
+def posts_sitemap_urls():
+    return Post.objects.published()
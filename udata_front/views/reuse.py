@@ -1,10 +1,9 @@
-from flask import abort, request, url_for, make_response
-from feedgenerator.django.utils.feedgenerator import Atom1Feed
+from flask import abort, url_for
 
-from udata_front.views.base import SearchView, DetailView
+from udata_front.views.base import SearchView, DetailView, PageCached
+from udata_front.views.feeds import author_of, cached_feed
 from udata.i18n import I18nBlueprint, gettext as _
-from udata.models import Follow
-from udata.sitemap import sitemap
+from udata_front.sitemaps import register_source
 from udata_front.frontend import nav
 from udata_front.theme import render as render_template
 
@@ -17,31 +16,20 @@ blueprint = I18nBlueprint('reuses', __name__, url_prefix='/reuses')
 
 @blueprint.route('/recent.atom')
 def recent_feed():
-    feed = Atom1Feed(_('Last reuses'), description=None,
-                     feed_url=request.url, link=request.url_root)
     reuses = Reuse.objects.visible().order_by('-created_at').limit(15)
-    for reuse in reuses:
-        author_name = None
-        author_uri = None
-        if reuse.organization:
-            author_name = reuse.organization.name
-            author_uri = url_for('organizations.show',
-                                 org=reuse.organization.id, _external=True)
-        elif reuse.owner:
-            author_name = reuse.owner.fullname
-            author_uri = url_for('users.show',
-                                 user=reuse.owner.id, _external=True)
-        feed.add_item(reuse.title,
-                      description=reuse.description,
-                      content=render_template('reuse/feed_item.html', reuse=reuse),
-                      author_name=author_name,
-                      author_link=author_uri,
-                      link=url_for('reuses.show', reuse=reuse.id, _external=True),
-                      updateddate=reuse.last_modified,
-                      pubdate=reuse.created_at)
-    response = make_response(feed.writeString('utf-8'))
-    response.headers['Content-Type'] = 'application/atom+xml'
-    return response
+    return cached_feed('reuses', _('Last reuses'), reuses, 'last_modified', feed_entry)
+
+
+def feed_entry(reuse):
+    author_name, author_uri = author_of(reuse)
+    return dict(title=reuse.title,
+                description=reuse.description,
+                content=render_template('reuse/feed_item.html', reuse=reuse),
+                author_name=author_name,
+                author_link=author_uri,
+                link=url_for('reuses.show', reuse=reuse.id, _external=True),
+                updateddate=reuse.last_modified,
+                pubdate=reuse.created_at)
 
 
 @blueprint.route('/', endpoint='list')
@@ -79,20 +67,18 @@ class ProtectedReuseView(ReuseView):
 
 
 @blueprint.route('/<reuse:reuse>/', endpoint='show')
-class ReuseDetailView(ReuseView, DetailView):
+class ReuseDetailView(PageCached, ReuseView, DetailView):
     template_name = 'reuse/display.html'
 
-    def get_context(self):
-        context = super(ReuseDetailView, self).get_context()
-
+    def check_access(self):
         if self.reuse.private and not ReuseEditPermission(self.reuse).can():
             abort(404)
 
         if self.reuse.deleted and not ReuseEditPermission(self.reuse).can():
             abort(410)
 
-        followers = (Follow.objects.followers(self.reuse)
-                     .order_by('follower.fullname'))
+    def get_context(self):
+        context = super(ReuseDetailView, self).get_context()
 
         related_reuses = Reuse.objects(id__ne=self.reuse.id)
         if self.reuse.organization:
@@ -102,7 +88,6 @@ class ReuseDetailView(ReuseView, DetailView):
         related_reuses = related_reuses.visible().order_by('-created_at').limit(4)
 
         context.update(
-            followers=followers,
             related_reuses=related_reuses,
             can_edit=ReuseEditPermission(self.reuse)
         )
@@ -110,7 +95,7 @@ class ReuseDetailView(ReuseView, DetailView):
         return context
 
 
-@sitemap.register_generator
+@register_source('reuses', 'reuses.show_redirect', 'reuse', 'weekly', 0.8,
+                 modified='last_modified')
 def sitemap_urls():
-    for reuse in Reuse.objects.visible().only('id', 'slug'):
-        yield 'reuses.show_redirect', {'reuse': reuse}, None, 'weekly', 0.8
+    return Reuse.objects.visible()
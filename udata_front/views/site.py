@@ -1,18 +1,18 @@
 import logging
 import requests
 
-from flask import request, url_for, current_app, make_response, send_from_directory
+from flask import abort, request, url_for, current_app, make_response, send_from_directory
+from mongoengine.base import get_document
 from mongoengine.errors import DoesNotExist
-from feedgenerator.django.utils.feedgenerator import Atom1Feed
 
-from udata.app import cache
 from udata.core.activity.models import Activity
 from udata.core.dataset.models import Dataset
 from udata.core.post.models import Post
 from udata.core.reuse.models import Reuse
-from udata.i18n import I18nBlueprint, lazy_gettext as _
+from udata.i18n import I18nBlueprint
 from udata.sitemap import sitemap
-from udata_front import theme
+from udata_front import home as home_snapshot, refresh, sitemaps, theme
+from udata_front.views.feeds import cached_feed
 
 from udata.core.site.models import current_site
 
@@ -26,79 +26,72 @@ def static_from_root():
     return send_from_directory(current_app.static_folder, 'robots.txt')
 
 
+@blueprint.route('/sitemaps/<source>-<int:page>.xml.gz', localize=False)
+def sitemap_shard(source, page):
+    data = sitemaps.get_shard(source, page)
+    if data is None:
+        abort(404)
+    response = make_response(data)
+    response.headers['Content-Type'] = 'application/gzip'
+    return response
+
+
 @blueprint.app_context_processor
 def inject_site():
     return dict(current_site=current_site)
 
 
+def activity_classes(keys):
+    '''The stored class names of the activities matching some keys'''
+    return [name for name in Activity._subclasses
+            if getattr(get_document(name), 'key', None) in keys]
+
+
+def activity_entry(activity):
+    try:
+        owner = activity.actor or activity.organization
+    except DoesNotExist:
+        owner = 'deleted'
+        owner_url = None
+    else:
+        owner_url = owner.url_for(_external=True)
+    try:
+        related = activity.related_to
+    except DoesNotExist:
+        related = 'deleted'
+        related_url = None
+    else:
+        related_url = related.url_for(_external=True)
+    return dict(
+        id='%s#activity=%s' % (
+            url_for('site.dashboard', _external=True), activity.id),
+        title='%s by %s on %s' % (
+            activity.key, owner, related),
+        description=None,
+        link=related_url,
+        author_name=owner,
+        author_link=owner_url,
+        updateddate=activity.created_at
+    )
+
+
 @blueprint.route('/activity.atom')
 def activity_feed():
-    # TODO: doesn't seem tested. Is it used somewhere?
+    activities = Activity.objects
     activity_keys = request.args.getlist('key')
-
-    feed = Atom1Feed(
-        current_app.config.get('SITE_TITLE'), feed_url=request.url,
-        link=request.url_root, description=None)
-    activities = (Activity.objects.order_by('-created_at')
-                                  .limit(current_site.feed_size))
-
-    for activity in activities.select_related():
-        # filter by activity.key
-        # /!\ this won't completely honour `feed_size` (only as a max value)
-        if activity_keys and activity.key not in activity_keys:
-            continue
-        try:
-            owner = activity.actor or activity.organization
-        except DoesNotExist:
-            owner = 'deleted'
-            owner_url = None
-        else:
-            owner_url = owner.url_for(_external=True)
-        try:
-            related = activity.related_to
-        except DoesNotExist:
-            related = 'deleted'
-            related_url = None
-        else:
-            related_url = related.url_for(_external=True)
-        feed.add_item(
-            id='%s#activity=%s' % (
-                url_for('site.dashboard', _external=True), activity.id),
-            title='%s by %s on %s' % (
-                activity.key, owner, related),
-            description=None,
-            link=related_url,
-            author_name=owner,
-            author_link=owner_url,
-            updateddate=activity.created_at
-        )
-    response = make_response(feed.writeString('utf-8'))
-    response.headers['Content-Type'] = 'application/atom+xml'
-    return response
+    if activity_keys:
+        # `key` is a class attribute: filter on the matching stored classes
+        activities = activities(_cls__in=activity_classes(activity_keys))
+    activities = activities.order_by('-created_at').limit(current_site.feed_size)
+    # Activities are never updated: their creation date identifies their entry
+    return cached_feed('activity', current_app.config.get('SITE_TITLE'),
+                       activities, 'created_at', activity_entry,
+                       related=('actor', 'organization', 'related_to'))
 
 
 @blueprint.route('/')
 def home():
-    context = {
-        'spd_datasets': Dataset.objects.filter(badges__kind='spd'),
-        'recent_datasets': Dataset.objects.visible(),
-        'recent_reuses': Reuse.objects(featured=True).visible(),
-        'last_post': Post.objects.published().first(),
-        'data_metrics': [
-            (_('Datasets and Dataservices'),
-             current_site.metrics.get('datasets', 0) + current_site.metrics.get('dataservices', 0)),
-            (_('Files'), current_site.metrics.get('resources', 0)),
-            (_('Organizations'), current_site.metrics.get('organizations', 0)),
-        ],
-        'community_metrics': [
-            (_('Reuses'), current_site.metrics.get('reuses', 0)),
-            (_('Users'), current_site.metrics.get('users', 0)),
-            (_('Discussions'), current_site.metrics.get('discussions', 0)),
-        ]
-    }
-    processor = theme.current.get_processor('home')
-    context = processor(context)
-    return theme.render('home.html', **context)
+    return theme.render('home.html', **home_snapshot.get_context())
 
 
 class SiteView(object):
@@ -120,13 +113,11 @@ def site_dashboard():
     return theme.render('site/dashboard.html', **context)
 
 
-@cache.cached(50)
+@refresh.refreshed('terms', 50)
 def get_terms_content():
     filename = current_app.config['SITE_TERMS_LOCATION']
     if filename.startswith('http'):
-        # We let the error appear because:
-        # - we dont want to cache false responses
-        # - this is only visible on terms
+        # Errors keep the last fetched terms
         response = requests.get(filename, timeout=5)
         response.raise_for_status()
         return response.text
@@ -137,7 +128,10 @@ def get_terms_content():
 
 @blueprint.route('/terms/')
 def terms():
-    content = get_terms_content()
+    try:
+        content = get_terms_content()
+    except refresh.Unavailable:
+        abort(503)
     return theme.render('terms.html', terms=content)
 
 
@@ -1,22 +1,27 @@
+import logging
+
 from collections import namedtuple
-import unicodedata
 
-from flask import abort, current_app, redirect, url_for
+from flask import abort, current_app, make_response, redirect, request, url_for
+from mongoengine.signals import post_delete, post_save
+
+from udata.app import cache
+from udata.i18n import I18nBlueprint, get_current_locale
+from udata.models import Dataset, GeoZone, Organization, TERRITORY_DATASETS
+from udata_front import territories, theme
+from udata_front.sitemaps import register_source
+from udata_front.views.base import PagePaginator, conditional_response
 
-from udata.i18n import I18nBlueprint
-from udata.models import Dataset, GeoZone, TERRITORY_DATASETS
-from udata.sitemap import sitemap
-from udata_front import theme
+log = logging.getLogger(__name__)
 
 blueprint = I18nBlueprint('territories', __name__)
 
+TERRITORY_COUNTS_KEY = 'territory-datasets-count:{0}'
+TERRITORY_DATASETS_PAGE_SIZE = 30
 
-def dict_to_namedtuple(name, data):
-    """Convert a `data` dict to a namedtuple.
 
-    Useful for easy attribute access.
-    """
-    return namedtuple(name, data.keys())(**data)
+# The attributes the territory url converter needs
+Territory = namedtuple('Territory', ('level_name', 'id', 'code', 'slug'))
 
 
 @blueprint.route('/territories/', endpoint='home')
@@ -25,21 +30,35 @@ def render_home():
         return abort(404)
 
     highest_level = current_app.config['HANDLED_LEVELS'][-1]
-    regions = GeoZone.objects(level=highest_level)
-    regions = sorted(
-        regions,
-        key=lambda zone: unicodedata.normalize('NFD', zone.name)
-                                    .encode('ascii', 'ignore'))
+    built = territories.get_level(highest_level, str(get_current_locale()))
 
     return theme.render('territories/home.html', **{
-        'geojson': {
-            'type': 'FeatureCollection',
-            'features': [region.toGeoJSON() for region in regions]
-        },
-        'regions': regions
+        'geojson_url': url_for('territories.geojson', level=highest_level,
+                               v=built['hash']),
+        'regions': built['regions']
     })
 
 
+@blueprint.route('/territories/<level>.geojson', endpoint='geojson')
+def render_geojson(level):
+    if (not current_app.config.get('ACTIVATE_TERRITORIES')
+            or level not in current_app.config['HANDLED_LEVELS']):
+        return abort(404)
+
+    built = territories.get_level(level, str(get_current_locale()))
+    response = conditional_response(built['hash'], None,
+                                    lambda: make_response(built['geojson']))
+    response.headers['Content-Type'] = 'application/geo+json'
+    if request.args.get('v') == built['hash']:
+        # Versioned urls never change
+        response.cache_control.no_cache = None
+        response.cache_control.private = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    return response
+
+
 @blueprint.route('/town/<code>/')
 def redirect_town(code):
     """
@@ -89,60 +108,127 @@ def redirect_territory(level, code):
     return redirect(url_for('territories.territory', territory=territory))
 
 
+def paginate_territory_datasets(territory, page, page_size):
+    '''
+    Paginate the visible datasets of a territory with a single aggregation,
+    listing first the datasets of organizations from that territory.
+
+    Each dataset is flagged `in_territory` and only holds its identifier.
+    Returns the page and the count of datasets from territory organizations,
+    counts being cached per territory and dropped whenever a dataset
+    or an organization of that territory is saved or deleted.
+    '''
+    if page < 1:
+        abort(404)
+    key = TERRITORY_COUNTS_KEY.format(territory.id)
+    counts = cache.get(key)
+
+    facets = {'page': [
+        {'$skip': (page - 1) * page_size},
+        {'$limit': page_size},
+        {'$project': {'in_territory': 1}},
+    ]}
+    if counts is None:
+        facets['counts'] = [{'$group': {'_id': '$in_territory', 'count': {'$sum': 1}}}]
+    queryset = Dataset.objects(spatial__zones=territory.id).visible()
+    # Only the sort keys and the organization zone go through the join and the sort
+    pipeline = [
+        {'$match': queryset._query},
+        {'$project': {'organization': 1, 'created_at_internal': 1}},
+        {'$lookup': {
+            'from': Organization._get_collection_name(),
+            'localField': 'organization',
+            'foreignField': '_id',
+            'pipeline': [{'$project': {'_id': 0, 'zone': 1}}],
+            'as': 'owner_organization',
+        }},
+        {'$addFields': {
+            'in_territory': {'$in': [territory.id, '$owner_organization.zone']},
+        }},
+        {'$unset': ['owner_organization', 'organization']},
+        {'$sort': {'in_territory': -1, 'created_at_internal': -1, '_id': 1}},
+        {'$facet': facets},
+    ]
+    result = next(queryset._collection.aggregate(pipeline, allowDiskUse=True), {})
+
+    if counts is None:
+        counts = {group['_id']: group['count'] for group in result.get('counts', [])}
+        cache.set(key, counts, timeout=current_app.config['TERRITORY_COUNTS_TIMEOUT'])
+    objects = []
+    for son in result.get('page', []):
+        dataset = Dataset._from_son({'_id': son['_id']})
+        dataset.in_territory = son['in_territory']
+        objects.append(dataset)
+    if not objects and page != 1:
+        abort(404)
+    paginator = PagePaginator(objects, page, page_size, sum(counts.values()))
+    return paginator, counts.get(True, 0)
+
+
+def expire_territory_counts(sender, document, **kwargs):
+    '''Drop the cached datasets counts of the territories a document belongs to'''
+    if not current_app:
+        return
+    if isinstance(document, Organization):
+        zones = [document.zone] if document.zone else []
+    else:
+        spatial = document._data.get('spatial')
+        values = (spatial._data.get('zones') or []) if spatial else []
+        zones = [getattr(value, 'id', value) for value in values]
+    if not zones:
+        return
+    try:
+        cache.delete_many(*[TERRITORY_COUNTS_KEY.format(zone) for zone in zones])
+    except Exception:
+        log.exception('Unable to expire territory counts for %s', document)
+
+
+for model in (Dataset, Organization):
+    post_save.connect(expire_territory_counts, sender=model)
+    post_delete.connect(expire_territory_counts, sender=model)
+
+
 @blueprint.route('/territories/<territory:territory>/', endpoint='territory')
 def render_territory(territory):
     if not current_app.config.get('ACTIVATE_TERRITORIES'):
         return abort(404)
 
-    # Only display dynamic datasets for present territories.
+    page = request.args.get('page', 1, type=int)
+    datasets, territory_count = paginate_territory_datasets(
+        territory, page, TERRITORY_DATASETS_PAGE_SIZE)
+
+    # Only display dynamic datasets for present territories, on the first page.
     base_datasets = []
-    DATASETS = TERRITORY_DATASETS[territory.level_code]
-    base_dataset_classes = sorted(DATASETS.values(), key=lambda a: a.order)
-    base_datasets = [
-        base_dataset_class(territory)
-        for base_dataset_class in base_dataset_classes
-    ]
-    territories = [territory]
-
-    # Retrieve all datasets then split between those optionally owned
-    # by an org for that zone and others. We need to know if the current
-    # user has datasets for that zone in order to display a custom
-    # message to ease the conversion.
-    datasets = Dataset.objects(spatial__zones__in=territories).visible()
-    # Retrieving datasets from old regions.
-    territory_datasets = []
-    other_datasets = []
-    if datasets:
-        for dataset in datasets:
-            if (dataset.organization and
-                    territory.id == dataset.organization.zone):
-                territory_datasets.append(dataset)
-            else:
-                other_datasets.append(dataset)
+    if page == 1:
+        DATASETS = TERRITORY_DATASETS[territory.level_code]
+        base_dataset_classes = sorted(DATASETS.values(), key=lambda a: a.order)
+        base_datasets = [
+            base_dataset_class(territory)
+            for base_dataset_class in base_dataset_classes
+        ]
+
     context = {
         'territory': territory,
         'base_datasets': base_datasets,
-        'other_datasets': other_datasets,
-        'territory_datasets': territory_datasets
+        'datasets': datasets,
+        'territory_datasets_count': territory_count,
+        'other_datasets': [d for d in datasets if not d.in_territory],
+        'territory_datasets': [d for d in datasets if d.in_territory]
     }
     template = 'territories/{level_name}.html'.format(
         level_name=territory.level_name)
     return theme.render(template, **context)
 
 
-@sitemap.register_generator
+def territory_values(zone):
+    # Remove 'fr:' manually from the level.
+    return {'territory': Territory(zone['level'][3:], zone['_id'],
+                                   zone.get('code'), zone.get('slug'))}
+
+
+@register_source('territories', 'territories.territory', None, 'weekly', 0.5,
+                 values=territory_values, fields=('level', 'code', 'slug'))
 def sitemap_urls():
-    if current_app.config.get('ACTIVATE_TERRITORIES'):
-        for level in current_app.config.get('HANDLED_LEVELS'):
-            for territory in (GeoZone.objects(level=level)
-                                     .only('id', 'code', 'slug')):
-                # Remove 'fr:' manually from the level.
-                territory = dict_to_namedtuple(
-                    'Territory', {
-                        'level_name': level[3:],
-                        'id': territory.id,
-                        'code': territory.code,
-                        'slug': territory.slug,
-                    })
-                yield ('territories.territory', {'territory': territory},
-                       None, 'weekly', 0.5)
+    if not current_app.config.get('ACTIVATE_TERRITORIES'):
+        return GeoZone.objects.none()
+    return GeoZone.objects(level__in=current_app.config.get('HANDLED_LEVELS'))
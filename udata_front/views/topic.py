@@ -1,14 +1,27 @@
-from flask import g, request
+import logging
+import uuid
 
+from flask import current_app, g, request
+from mongoengine.signals import post_delete, post_save
+from werkzeug.local import LocalProxy
+
+from udata.app import cache
 from udata.i18n import I18nBlueprint
 from udata.models import Topic
-from udata.sitemap import sitemap
+from udata_front.sitemaps import register_source
 from udata.utils import multi_to_dict
 from udata_front import theme
 
 
+log = logging.getLogger(__name__)
+
 blueprint = I18nBlueprint('topics', __name__, url_prefix='/topics')
 
+FEATURED_TOPICS_VERSION_KEY = 'featured-topics-version'
+
+# Process-local (version, topics), only reloaded when the shared version changes
+_featured_topics = (None, [])
+
 
 @blueprint.route('/<topic:topic>/')
 def display(topic):
@@ -44,13 +57,41 @@ def reuses(topic):
     )
 
 
+def featured_topics():
+    '''The featured topics sorted by slug, from the process-local cache when up to date'''
+    global _featured_topics
+    version = cache.get(FEATURED_TOPICS_VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.add(FEATURED_TOPICS_VERSION_KEY, version, timeout=0)
+    cached_version, topics = _featured_topics
+    if cached_version != version:
+        topics = list(Topic.objects(featured=True).only('id', 'slug', 'name')
+                                                  .order_by('slug'))
+        _featured_topics = (version, topics)
+    return topics
+
+
 @blueprint.before_app_request
 def store_featured_topics():
-    g.featured_topics = sorted(Topic.objects(featured=True),
-                               key=lambda t: t.slug)
+    # Only resolved by the pages displaying them
+    g.featured_topics = LocalProxy(featured_topics)
+
+
+def bump_featured_topics(sender, document, **kwargs):
+    if not current_app:
+        return
+    try:
+        cache.set(FEATURED_TOPICS_VERSION_KEY, uuid.uuid4().hex, timeout=0)
+    except Exception:
+        log.exception('Unable to expire featured topics')
+
+
+post_save.connect(bump_featured_topics, sender=Topic)
+post_delete.connect(bump_featured_topics, sender=Topic)
 
 
-@sitemap.register_generator
+@register_source('topics', 'topics.display_redirect', 'topic', 'weekly', 0.8,
+                 modified='last_modified')
 def sitemap_urls():
-    for topic in Topic.objects.only('id', 'slug'):
-        yield 'topics.display_redirect', {'topic': topic}, None, "weekly", 0.8
+    return Topic.objects
@@ -1,12 +1,15 @@
 import logging
 
-from flask import url_for, redirect, abort, g
+from collections import defaultdict
+
+from flask import url_for, redirect, abort, g, request
 from flask_security import current_user
 
-from udata_front.views.base import DetailView
+from udata_front.models import Follower
+from udata_front.views.base import DetailView, paginate_followers
 from udata.core.user.permissions import sysadmin, UserEditPermission
 from udata.i18n import I18nBlueprint
-from udata.models import User, Organization, Dataset, Reuse, Follow
+from udata.models import User, Organization, Dataset, Reuse
 
 
 blueprint = I18nBlueprint('users', __name__, url_prefix='/users')
@@ -43,10 +46,12 @@ class UserView(object):
 class UserDetailView(UserView, DetailView):
     template_name = 'user/base.html'
 
-    def get_context(self):
+    def check_access(self):
         if current_user.is_anonymous or not current_user.sysadmin:
             if not self.user.active:
                 abort(410, 'User is not active')
+
+    def get_context(self):
         context = super(UserDetailView, self).get_context()
         context['can_edit'] = UserEditPermission(self.user)
 
@@ -66,33 +71,32 @@ def redirect_reuses(user):
 @blueprint.route('/<user:user>/following/', endpoint='following')
 class UserFollowingView(UserView, DetailView):
     template_name = 'user/following.html'
+    conditional = False
+
+    page_size = 12
+    # context name: (model, ordering)
+    FOLLOWED = {
+        'followed_datasets': (Dataset, ('title',)),
+        'followed_reuses': (Reuse, ('title',)),
+        'followed_organizations': (Organization, ('name',)),
+        'followed_users': (User, ('first_name', 'last_name')),
+    }
 
     def get_context(self):
         context = super(UserFollowingView, self).get_context()
         context['can_edit'] = UserEditPermission(self.user)
-        datasets, reuses, organizations, users = [], [], [], []
-
-        for follow in Follow.objects.following(self.user).select_related():
-            if isinstance(follow.following, Organization):
-                organizations.append(follow.following)
-            elif isinstance(follow.following, Reuse):
-                reuses.append(follow.following)
-            elif isinstance(follow.following, Dataset):
-                datasets.append(follow.following)
-            elif isinstance(follow.following, User):
-                users.append(follow.following)
-            else:
-                log.warning(
-                    'Follow object %s has not dereferenced %s',
-                    follow.id, follow.following)
-
-        context.update({
-            'followed_datasets': sorted(datasets, key=lambda d: d.title),
-            'followed_reuses': sorted(reuses, key=lambda r: r.title),
-            'followed_organizations': sorted(organizations,
-                                             key=lambda o: o.name),
-            'followed_users': sorted(users, key=lambda u: u.fullname),
-        })
+
+        followed = defaultdict(list)
+        for following_type, following_id in (Follower.objects(follower=self.user.id)
+                                                     .scalar('following_type', 'following')):
+            followed[following_type].append(following_id)
+
+        # A page of each followed type, with its own page parameter
+        for name, (model, ordering) in self.FOLLOWED.items():
+            page = request.args.get(name.replace('followed_', '') + '_page', 1, type=int)
+            context[name] = (model.objects(id__in=followed[model.__name__])
+                                  .order_by(*ordering)
+                                  .paginate(page, self.page_size))
 
         return context
 
@@ -100,10 +104,12 @@ class UserFollowingView(UserView, DetailView):
 @blueprint.route('/<user:user>/followers/', endpoint='followers')
 class UserFollowersView(UserView, DetailView):
     template_name = 'user/followers.html'
+    conditional = False
+    page_size = 24
 
     def get_context(self):
         context = super(UserFollowersView, self).get_context()
         context['can_edit'] = UserEditPermission(self.user)
-        context['followers'] = (Follow.objects.followers(self.user)
-                                              .order_by('follower.fullname'))
+        page = request.args.get('page', 1, type=int)
+        context['followers'] = paginate_followers(self.user, page, self.page_size)
         return context